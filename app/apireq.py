@@ -1,9 +1,23 @@
 # -*- coding: utf-8 -*-
+import asyncio
+import atexit
+import email.utils
+import functools
+import random
+import threading
 import time
+import urllib.parse
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
 from requests import Session, Response
-from requests.packages.urllib3.util.retry import Retry
 from requests.adapters import HTTPAdapter
-from typing import Optional, Dict, Union, Tuple
+from typing import Optional, Dict, Union, Tuple, Callable, Awaitable, TypeVar, Iterator, List
+
+import const
+from ratelimit import RateLimiter
+from circuit import CircuitBreaker
+
+T = TypeVar('T')
 
 
 class APIError(Exception):
@@ -15,53 +29,328 @@ class APIError(Exception):
         super().__init__(message, *args)
 
 
+class CircuitOpenError(APIError):
+    pretext = 'モールへのリクエスト停止中'
+
+    def __init__(self, message, *args, retry_after: float = 0.0):
+        super().__init__(message, *args)
+        # 試行を再開するまでの秒数
+        self.retry_after = retry_after
+
+
 class APIRequests:
+    # 再試行するステータスコード(429は流量超過、5xxはモール側の障害)
+    retry_status_codes = frozenset([429, 500, 502, 503, 504])
+
     def __init__(self,
                  retry_total: int = 5,
                  backoff_factor: int = 2,
                  connect_timeout: float = 30.0,
                  read_timeout: float = 60.0,
                  cert: Optional[Tuple[str, str]] = None,
+                 rate_limiter: Optional[RateLimiter] = None,
+                 circuit_breaker: Optional[CircuitBreaker] = None,
+                 backoff_max: float = const.RETRY_BACKOFF_MAX,
+                 pool_maxsize: int = 10,
+                 pool_block: bool = False,
                  ):
         self.retry_total = retry_total
         self.backoff_factor = backoff_factor
+        self.backoff_max = backoff_max
         self.connect_timeout = connect_timeout
         self.read_timeout = read_timeout
+        self.rate_limiter = rate_limiter
+        self.circuit_breaker = circuit_breaker
+        self.cert = cert
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+
+        # このインスタンスで使用したセッション
+        self._sessions: Dict[Tuple[str, Optional[Tuple[str, str]]], Session] = {}
+        self._lock = threading.Lock()
 
-        session = Session()
-        retries = Retry(total=self.retry_total,
-                        backoff_factor=self.backoff_factor,
-                        status_forcelist=[500, 502, 503, 504])
-        session.mount('http://', HTTPAdapter(max_retries=retries))
-        session.mount('https://', HTTPAdapter(max_retries=retries))
-        session.cert = cert
-        self.session: Optional[Session] = session
+    def _get_session(self, url: str) -> Session:
+        session = get_session(url=url,
+                              cert=self.cert,
+                              pool_maxsize=self.pool_maxsize,
+                              pool_block=self.pool_block)
+        with self._lock:
+            self._sessions[_session_key(url=url, cert=self.cert)] = session
+        return session
 
     def close(self):
-        if self.session:
-            self.session.close()
-            self.session = None
+        # セッション(接続)はプロセス内で共有するため、閉じずに次回以降のリクエストで使い回す
+        with self._lock:
+            self._sessions.clear()
 
-    def request_get(self, url: str, headers: Dict, payload: Dict) -> Response:
-        try:
-            response = self.session.get(url=url,
-                                        params=payload,
-                                        headers=headers,
-                                        timeout=(self.connect_timeout, self.read_timeout))
-            time.sleep(1)
-        except Exception:
-            raise APIError('API exception error during requests.get')
+    def reset(self):
+        # 使用したセッションを共有から外し、次のリクエストで新しいセッションを作成して再接続する
+        # (他のインスタンスが使用中の場合もあるため閉じない)
+        with self._lock:
+            sessions = list(self._sessions.items())
+            self._sessions.clear()
+        for key, session in sessions:
+            _evict_session(key=key, session=session)
+
+    def _wait_rate_limit(self, url: str):
+        if self.rate_limiter:
+            # 流量制限を超える場合のみ待機
+            self.rate_limiter.acquire(url)
+
+    def _check_circuit(self, url: str):
+        if self.circuit_breaker and not self.circuit_breaker.allow_request():
+            raise CircuitOpenError(f'Circuit is open mall={self.circuit_breaker.name}, url={url}',
+                                   retry_after=self.circuit_breaker.remaining_open_time())
+
+    def _get_backoff_time(self, attempt: int, response: Optional[Response]) -> float:
+        # Retry-Afterがあればその時間、なければ指数バックオフ(直近のエラー率が高いほど延ばす)
+        retry_after = parse_retry_after(response.headers.get('Retry-After')) if response is not None else None
+        if retry_after is not None:
+            return min(self.backoff_max, retry_after)
+
+        backoff = self.backoff_factor * (2 ** attempt)
+        if self.circuit_breaker:
+            backoff *= 1 + self.circuit_breaker.error_rate()
+        return min(self.backoff_max, random.uniform(backoff / 2, backoff))
+
+    def _request(self, method: str, url: str, error_message: str, **kwargs) -> Response:
+        attempt = 0
+        while True:
+            self._check_circuit(url)
+            self._wait_rate_limit(url)
+            response = None
+            try:
+                response = self._get_session(url).request(method=method,
+                                                          url=url,
+                                                          timeout=(self.connect_timeout, self.read_timeout),
+                                                          **kwargs)
+                failed = response.status_code in self.retry_status_codes
+            except Exception:
+                failed = True
+
+            if self.circuit_breaker:
+                if failed:
+                    self.circuit_breaker.record_failure()
+                else:
+                    self.circuit_breaker.record_success()
+            if not failed:
+                return response
 
-        return response
+            if attempt >= self.retry_total or (self.circuit_breaker and self.circuit_breaker.is_open()):
+                # 再試行しても失敗した場合、レスポンスがあれば呼び出し元でエラー内容を処理する
+                if response is not None:
+                    return response
+                raise APIError(error_message)
+
+            time.sleep(self._get_backoff_time(attempt=attempt, response=response))
+            attempt += 1
+
+    def request_get(self, url: str, headers: Dict, payload: Dict) -> Response:
+        return self._request('GET', url=url,
+                             error_message='API exception error during requests.get',
+                             params=payload,
+                             headers=headers)
 
     def request_post(self, url: str, headers: Dict, data: Union[Dict, str, bytes]) -> Response:
+        return self._request('POST', url=url,
+                             error_message='API post error during requests.post',
+                             headers=headers,
+                             data=data)
+
+
+# ホスト・クライアント証明書ごとにプロセス内で共有するセッション
+_sessions: Dict[Tuple[str, Optional[Tuple[str, str]]], Session] = {}
+_sessions_lock = threading.Lock()
+
+
+def _session_key(url: str, cert: Optional[Tuple[str, str]]) -> Tuple[str, Optional[Tuple[str, str]]]:
+    url_p = urllib.parse.urlsplit(url)
+    return f'{url_p.scheme}://{url_p.netloc}', tuple(cert) if cert else None
+
+
+def get_session(url: str,
+                cert: Optional[Tuple[str, str]] = None,
+                pool_maxsize: int = 10,
+                pool_block: bool = False) -> Session:
+    # 同じホスト・クライアント証明書のリクエストは、APIのインスタンスを閉じた後も接続(TLSセッション)を使い回す
+    # 接続プールの設定は最初に作成したときの設定になる
+    key = _session_key(url=url, cert=cert)
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            # 再試行はリクエスト単位でまとめて行うため、接続では再試行しない
+            session = Session()
+            adapter = HTTPAdapter(pool_connections=1,
+                                  pool_maxsize=pool_maxsize,
+                                  pool_block=pool_block,
+                                  max_retries=0)
+            session.mount(key[0], adapter)
+            session.cert = cert
+            _sessions[key] = session
+    return session
+
+
+def create_session(url: str,
+                   cert: Optional[Tuple[str, str]] = None,
+                   pool_maxsize: int = 10,
+                   pool_block: bool = False) -> Session:
+    # 呼び出し元専用のセッションを作成する(ヘッダーやアダプターを変更するライブラリ向け)
+    # 接続プールは共有セッションのアダプターを使い、接続(TLSセッション)を使い回す
+    key = _session_key(url=url, cert=cert)
+    shared_session = get_session(url=url, cert=cert, pool_maxsize=pool_maxsize, pool_block=pool_block)
+    session = Session()
+    session.mount(key[0], shared_session.get_adapter(key[0]))
+    session.cert = shared_session.cert
+    return session
+
+
+def _evict_session(key: Tuple[str, Optional[Tuple[str, str]]], session: Session):
+    # 既に作り直されている場合は何もしない
+    with _sessions_lock:
+        if _sessions.get(key) is session:
+            del _sessions[key]
+
+
+def close_sessions():
+    with _sessions_lock:
+        sessions = list(_sessions.values())
+        _sessions.clear()
+    for session in sessions:
+        session.close()
+
+
+atexit.register(close_sessions)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    # Retry-Afterは秒数または日時
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+class AsyncAPIRequests:
+    # APIRequestsのリクエストをスレッドで実行し、流量制限の範囲で複数のリクエストを同時に送る
+    # (HTTP通信自体は非同期ではなく、スレッドプール上のrequestsで行う)
+    def __init__(self,
+                 retry_total: int = 5,
+                 backoff_factor: int = 2,
+                 connect_timeout: float = 30.0,
+                 read_timeout: float = 60.0,
+                 cert: Optional[Tuple[str, str]] = None,
+                 rate_limiter: Optional[RateLimiter] = None,
+                 circuit_breaker: Optional[CircuitBreaker] = None,
+                 max_concurrency: int = const.ASYNC_API_MAX_CONCURRENCY,
+                 pool_maxsize: int = 10,
+                 pool_block: bool = False,
+                 ):
+        # 再試行を含む各リクエストで流量制限を守るよう、流量制限の待機はスレッド側で行う
+        self.api = APIRequests(retry_total=retry_total,
+                               backoff_factor=backoff_factor,
+                               connect_timeout=connect_timeout,
+                               read_timeout=read_timeout,
+                               cert=cert,
+                               rate_limiter=rate_limiter,
+                               circuit_breaker=circuit_breaker,
+                               pool_maxsize=pool_maxsize,
+                               pool_block=pool_block)
+        self.rate_limiter = rate_limiter
+        self.max_concurrency = max_concurrency
+
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._semaphore_loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency + 1)
+        return self._executor
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # 実行中のイベントループ内で生成する(asyncio.runごとにループが変わるため作り直す)
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._semaphore_loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._semaphore_loop = loop
+        return self._semaphore
+
+    def close(self):
+        self.api.close()
+        if self._executor:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        self._semaphore = None
+        self._semaphore_loop = None
+
+    def reset(self):
+        # 接続を破棄し、次のリクエストで再接続する
+        self.api.reset()
+
+    async def run(self, func: Callable[..., T], *args, **kwargs) -> T:
+        # 同期処理(SOAP・トークン更新など)をスレッドで実行する
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_executor(), functools.partial(func, *args, **kwargs))
+
+    async def request_get(self, url: str, headers: Dict, payload: Dict) -> Response:
+        async with self._get_semaphore():
+            return await self.run(self.api.request_get, url=url, headers=headers, payload=payload)
+
+    async def request_post(self, url: str, headers: Dict, data: Union[Dict, str, bytes]) -> Response:
+        async with self._get_semaphore():
+            return await self.run(self.api.request_post, url=url, headers=headers, data=data)
+
+
+async def retry_async(func: Callable[[], Awaitable[T]],
+                      exceptions=Exception,
+                      tries: int = 3,
+                      delay: float = 2,
+                      backoff: float = 2) -> T:
+    # retryデコレーター(exceptions, tries, delay, backoff)の非同期版
+    for attempt in range(1, tries + 1):
         try:
-            response = self.session.post(url=url,
-                                         headers=headers,
-                                         data=data,
-                                         timeout=(self.connect_timeout, self.read_timeout))
-            time.sleep(1)
-        except Exception:
-            raise APIError('API post error during requests.post')
-
-        return response
+            return await func()
+        except exceptions:
+            if attempt >= tries:
+                raise
+        await asyncio.sleep(delay)
+        delay *= backoff
+
+
+def iter_pages(fetch_page: Callable[[int], T],
+               get_total_pages: Callable[[T], int],
+               max_workers: int = const.API_PAGE_MAX_WORKERS) -> Iterator[T]:
+    # 1ページ目で総ページ数を取得し、残りのページは並列で取得してページ順に返す(ページ番号は1から)
+    # 送信間隔は各リクエストの流量制限で調整される
+    first = fetch_page(1)
+    yield first
+
+    total_pages = get_total_pages(first)
+    if total_pages <= 1:
+        return
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, total_pages - 1))) as executor:
+        # 途中で終了した場合、未実行のページは取り消される
+        yield from executor.map(fetch_page, range(2, total_pages + 1))
+
+
+async def gather_pages(fetch_page: Callable[[int], Awaitable[T]],
+                       get_total_pages: Callable[[T], int]) -> List[T]:
+    # iter_pagesの非同期版(同時実行数はAsyncAPIRequestsで制限する)
+    first = await fetch_page(1)
+    pages = await asyncio.gather(*(fetch_page(page) for page in range(2, get_total_pages(first) + 1)))
+    return [first, *pages]
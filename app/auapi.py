@@ -1,45 +1,123 @@
 # -*- coding: utf-8 -*-
-from typing import List
+import asyncio
+from typing import AsyncIterator, Dict, Iterable, Iterator, List, Optional
+import itertools
+import math
 from dataclasses import dataclass
 from datetime import datetime
-import xml.etree.ElementTree as ET
 
 import const
 from logging import Logger
-from apireq import APIRequests
+from apireq import APIRequests, AsyncAPIRequests, iter_pages
+import ratelimit
+import circuit
+import xmlparser
+import xmlbuilder
+from models import (AuGetStockData, AuUpdateStockData, AuUpdateErrorResponseData, AuGetTradeItemData,
+                    AuGetTradeData)
 
 
 @dataclass
-class AuGetStockData:
-    item_code: str
-    stock_count: int
+class AuTradeSearchResult:
+    status: Optional[str]
+    result_count: int
+    orders: List[AuGetTradeData]
 
 
 @dataclass
-class AuUpdateStockData:
-    item_code: str
-    stock_count: int
-
-
-@dataclass
-class AuUpdateErrorResponseData:
-    item_code: str
-    error_code: str
-    error_message: str
-
-
-@dataclass
-class AuGetTradeItemData:
-    order_detail_id: int
-    item_code: str
-    item_name: str
-
-
-@dataclass
-class AuGetTradeData:
-    order_id: int
-    order_status: str
-    details: List[AuGetTradeItemData]
+class AuStockUpdateResult:
+    status: Optional[str]
+    # 更新できなかった商品
+    error_items: List[AuUpdateErrorResponseData]
+
+
+def parse_stock_search(content: bytes) -> Iterator[AuGetStockData]:
+    for el in xmlparser.iterparse(content, tags=('status', 'resultStocks')):
+        if el.tag == 'status':
+            # 検索エラー
+            if el.getparent().tag == 'result' and el.text != '0':
+                return
+            continue
+
+        yield AuGetStockData(item_code=el.findtext('.//itemCode'),
+                             stock_count=int(el.findtext('.//stockCount')))
+
+
+def parse_stock_update(content: bytes) -> AuStockUpdateResult:
+    result = AuStockUpdateResult(status=None, error_items=[])
+    for el in xmlparser.iterparse(content, tags=('status', 'updateResult')):
+        if el.tag == 'status':
+            if el.getparent().tag == 'result':
+                result.status = el.text
+            continue
+
+        # 更新できなかった商品のみ
+        item_code = el.findtext('.//itemCode')
+        error = el.find('.//error')
+        if item_code is None or error is None:
+            continue
+        result.error_items.append(AuUpdateErrorResponseData(item_code=item_code,
+                                                            error_code=error.findtext('.//code'),
+                                                            error_message=el.findtext('.//message')))
+    return result
+
+
+def get_stock_update_error_items(result: AuStockUpdateResult) -> List[AuUpdateErrorResponseData]:
+    # 商品ごとのエラーが無い異常終了は、どの商品を更新できたか不明なため例外にする
+    # (商品ごとのエラーがあれば、それ以外の商品は更新済み)
+    if result.status != '0' and not result.error_items:
+        raise AuAPIError(f'Failed to update stock status={result.status}')
+    return result.error_items
+
+
+def parse_trade_search(content: bytes) -> AuTradeSearchResult:
+    result = AuTradeSearchResult(status=None, result_count=0, orders=[])
+    for el in xmlparser.iterparse(content, tags=('status', 'resultCount', 'orderInfo')):
+        if el.tag == 'status':
+            if el.getparent().tag == 'result':
+                result.status = el.text
+        elif el.tag == 'resultCount':
+            result.result_count = int(el.text)
+        else:
+            details = tuple(AuGetTradeItemData(order_detail_id=int(el_detail.findtext('.//orderDetailId')),
+                                               item_code=el_detail.findtext('.//itemCode'),
+                                               item_name=el_detail.findtext('.//itemName'))
+                            for el_detail in el.iterfind('.//detail'))
+            result.orders.append(AuGetTradeData(order_id=int(el.findtext('.//orderId')),
+                                                order_status=el.findtext('.//orderStatus'),
+                                                details=details))
+    return result
+
+
+def build_stock_update_request(update_items: Iterable[AuUpdateStockData]) -> bytes:
+    children = itertools.chain(
+        [xmlbuilder.text_element('shopId', AuAPI.shop_id)],
+        (xmlbuilder.element('stockUpdateItem',
+                            xmlbuilder.text_element('itemCode', item.item_code),
+                            xmlbuilder.text_element('stockSegment', 1),
+                            xmlbuilder.text_element('stockCount', item.stock_count))
+         for item in update_items))
+    return xmlbuilder.build_document(root_tag='request',
+                                     children=children,
+                                     attrs={'version': '1.0', 'encoding': 'UTF-8'})
+
+
+def build_trade_search_request(start_time: datetime,
+                               end_time: datetime,
+                               count_per_request: int,
+                               start_count: int) -> Dict:
+    return {
+        'shopId': AuAPI.shop_id,
+        'totalCount': count_per_request,
+        'startCount': start_count,
+        'dateType': 0,
+        'startDate': start_time.strftime('%Y-%m-%d'),
+        'endDate': end_time.strftime('%Y-%m-%d'),
+    }
+
+
+def get_trade_search_total_pages(result: AuTradeSearchResult, count_per_request: int) -> int:
+    return math.ceil(result.result_count / count_per_request)
 
 
 class AuAPIBaseError(Exception):
@@ -68,7 +146,10 @@ class AuAPI:
         self.api = APIRequests(retry_total=retry_total,
                                backoff_factor=backoff_factor,
                                connect_timeout=connect_timeout,
-                               read_timeout=read_timeout)
+                               read_timeout=read_timeout,
+                               rate_limiter=ratelimit.get_rate_limiter('au'),
+                               circuit_breaker=circuit.get_circuit_breaker('au'),
+                               **const.HTTP_POOL_SETTING['au'])
         self.stock = AuStockAPI(api=self.api, log=log)
         self.trade = AuTradeAPI(api=self.api, log=log)
 
@@ -81,6 +162,10 @@ class AuAPI:
     def close(self):
         self.api.close()
 
+    def reset(self):
+        # 接続を破棄し、次のリクエストで再接続する
+        self.api.reset()
+
     @staticmethod
     def get_authz() -> bytes:
         auth = f'Bearer {const.AUPAYM_API_KEY}'
@@ -116,70 +201,28 @@ class AuStockAPI:
             self.log.exception('Failed to post request to search stock')
             raise AuAPIError('Failed to post request to search stock')
 
-        root = ET.fromstring(response.text)
-        status = root.find('.//result/status').text
-        if status != '0':
-            return []
-
-        stocks = []
-        for result_stock in root.findall('.//searchResult/resultStocks'):
-            item_code = result_stock.find('.//itemCode').text
-            stock_count = int(result_stock.find('.//stockCount').text)
-            stock_data = AuGetStockData(item_code=item_code,
-                                        stock_count=stock_count)
-            stocks.append(stock_data)
-
-        return stocks
+        return list(parse_stock_search(response.content))
 
     def update(self, update_items: List[AuUpdateStockData]) -> List[AuUpdateErrorResponseData]:
-        xml = f"""
-        <request>
-            <shopId>{AuAPI.shop_id}</shopId>
-        </request>"""
-        root = ET.fromstring(xml)
-        root.set('version', '1.0')
-        root.set('encoding', 'UTF-8')
-
-        for item in update_items:
-            xml = f"""
-            <stockUpdateItem>
-                <itemCode>{item.item_code}</itemCode>
-                <stockSegment>1</stockSegment>
-                <stockCount>{item.stock_count}</stockCount>
-            </stockUpdateItem>"""
-            el_stock_update_item = ET.fromstring(xml)
-            root.append(el_stock_update_item)
-
         headers = {
             'Authorization': AuAPI.get_authz(),
             'content-type': 'application/xml; charset=utf-8',
         }
         url = AuAPI.base_url + '/updateStock'
-        post_data = ET.tostring(element=root, encoding='utf-8', method='xml')
+        post_data = build_stock_update_request(update_items)
         try:
             response = self._api.request_post(url=url, headers=headers, data=post_data)
+            if response.status_code != 200:
+                self.log.error('Failed to post request to update stock error=%s', response.text)
+                raise AuAPIError('Failed to post request to update stock status not 200')
+            result = parse_stock_update(response.content)
         except Exception:
             self.log.exception('Failed to post request to update stock')
             raise AuAPIError('Failed to post request to update stock')
 
-        if not getattr(response, 'text', None):
-            return []
-        root = ET.fromstring(response.text)
-        update_items = []
-        for el_update_result in root.findall('.//updateResult'):
-            if el_update_result.findall('.//itemCode'):
-                item_code = el_update_result.find('.//itemCode').text
-
-                if el_update_result.findall('.//error'):
-                    error = el_update_result.find('.//error')
-                    error_code = error.find('.//code').text
-                    error_message = el_update_result.find('.//message').text
-                    update_item = AuUpdateErrorResponseData(item_code=item_code,
-                                                            error_code=error_code,
-                                                            error_message=error_message)
-                    update_items.append(update_item)
-
-        return update_items
+        if result.status != '0':
+            self.log.error('Failed to update stock status=%s, error=%s', result.status, response.text)
+        return get_stock_update_error_items(result)
 
 
 class AuTradeAPI:
@@ -190,63 +233,228 @@ class AuTradeAPI:
     def search(self,
                start_time: datetime,
                end_time: datetime,
-               count_per_request: int = 1000) -> List[AuGetTradeData]:
+               count_per_request: int = 1000) -> Iterator[AuGetTradeData]:
+        for orders in self.search_pages(start_time=start_time,
+                                        end_time=end_time,
+                                        count_per_request=count_per_request):
+            yield from orders
+
+    def _search_page(self,
+                     start_time: datetime,
+                     end_time: datetime,
+                     count_per_request: int,
+                     page: int) -> AuTradeSearchResult:
         headers = {
             'Authorization': AuAPI.get_authz(),
             'content-type': 'application/x-www-form-urlencoded',
         }
         url = AuAPI.base_url + '//searchTradeInfoListProc'
+        post_data = build_trade_search_request(start_time=start_time,
+                                               end_time=end_time,
+                                               count_per_request=count_per_request,
+                                               start_count=1 + (page - 1) * count_per_request)
+        try:
+            response = self._api.request_get(url=url, headers=headers, payload=post_data)
+            if response.status_code != 200:
+                self.log.error('Failed to post request to trade search error=%s', response.text)
+                raise AuAPIError('Failed to post request to trade search status not 200')
+        except Exception:
+            self.log.exception('Failed to get request to search trade')
+            raise AuAPIError('Failed to get request to search trade')
+
+        result = parse_trade_search(response.content)
+        if result.status != '0':
+            self.log.error('Failed to search trade status=%s, error=%s', result.status, response.text)
+            raise AuAPIError(f'Failed to search trade status={result.status}')
+        return result
+
+    def search_pages(self,
+                     start_time: datetime,
+                     end_time: datetime,
+                     count_per_request: int = 1000,
+                     max_workers: int = const.API_PAGE_MAX_WORKERS) -> Iterator[List[AuGetTradeData]]:
+        # 1ページ目で総件数を取得し、残りのページは並列で取得する
+        # 1ページ取得するごとに、ページ順にそのページの注文を返す(同じ注文は1度だけ)
+        results = iter_pages(fetch_page=lambda page: self._search_page(start_time=start_time,
+                                                                       end_time=end_time,
+                                                                       count_per_request=count_per_request,
+                                                                       page=page),
+                             get_total_pages=lambda result: get_trade_search_total_pages(result, count_per_request),
+                             max_workers=max_workers)
+
+        # 取得中に注文が増えるとページがずれて同じ注文が再度含まれるため除外する
+        order_ids = set()
+        for result in results:
+            orders = []
+            for order in result.orders:
+                if order.order_id in order_ids:
+                    continue
+                order_ids.add(order.order_id)
+                orders.append(order)
+            yield orders
+
+
+class AsyncAuAPI:
+    # AuAPIの非同期版(結果のデータは同期版と同じ)
+    def __init__(self,
+                 log: Logger,
+                 retry_total: int = 5,
+                 backoff_factor: int = 2,
+                 connect_timeout: float = 30.0,
+                 read_timeout: float = 60.0,
+                 max_concurrency: int = const.ASYNC_API_MAX_CONCURRENCY):
+        self.api = AsyncAPIRequests(retry_total=retry_total,
+                                    backoff_factor=backoff_factor,
+                                    connect_timeout=connect_timeout,
+                                    read_timeout=read_timeout,
+                                    rate_limiter=ratelimit.get_rate_limiter('au'),
+                                    circuit_breaker=circuit.get_circuit_breaker('au'),
+                                    max_concurrency=max_concurrency,
+                                    **const.HTTP_POOL_SETTING['au'])
+        self.stock = AsyncAuStockAPI(api=self.api, log=log)
+        self.trade = AsyncAuTradeAPI(api=self.api, log=log)
+
+    async def __aenter__(self):
+        return self
 
-        count = 1
-        result_count = 1
-        orders = []
-        while count <= result_count:
-            post_data = {
-                'shopId': AuAPI.shop_id,
-                'totalCount': count_per_request,
-                'startCount': count,
-                'dateType': 0,
-                'startDate': start_time.strftime('%Y-%m-%d'),
-                'endDate': end_time.strftime('%Y-%m-%d'),
-            }
-            try:
-                response = self._api.request_get(url=url, headers=headers, payload=post_data)
-                if response.status_code != 200:
-                    self.log.error('Failed to post request to trade search error=%s', response.text)
-                    raise AuAPIError('Failed to post request to trade search status not 200')
-            except Exception:
-                self.log.exception('Failed to get request to search trade')
-                raise AuAPIError('Failed to get request to search trade')
-
-            root = ET.fromstring(response.text)
-            status = root.find('.//result/status').text
-            if status != '0':
-                continue
-
-            result_count = int(root.find('.//resultCount').text)
-
-            order_list = []
-            for el_order_info in root.findall('.//orderInfo'):
-                order_id = int(el_order_info.find('.//orderId').text)
-                order_status = el_order_info.find('.//orderStatus').text
-
-                details = []
-                for el_detail in el_order_info.findall('.//detail'):
-                    order_detail_id = int(el_detail.find('.//orderDetailId').text)
-                    item_code = el_detail.find('.//itemCode').text
-                    item_name = el_detail.find('.//itemName').text
-
-                    detail_data = AuGetTradeItemData(order_detail_id=order_detail_id,
-                                                     item_code=item_code,
-                                                     item_name=item_name)
-                    details.append(detail_data)
-
-                    order_data = AuGetTradeData(order_id=order_id,
-                                                order_status=order_status,
-                                                details=details)
-                    order_list.append(order_data)
-
-            orders.extend(order_list)
-            count += count_per_request
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self.api.close()
+
+    def reset(self):
+        # 接続を破棄し、次のリクエストで再接続する
+        self.api.reset()
+
+
+class AsyncAuStockAPI:
+    def __init__(self, api: AsyncAPIRequests, log: Logger):
+        self._api = api
+        self.log = log
+
+    async def search(self, item_code: str, count_per_request: int = 500) -> List[AuGetStockData]:
+        post_data = {
+            'shopId': AuAPI.shop_id,
+            'itemCode': item_code,
+            'totalCount': count_per_request,
+            'startCount': 1
+        }
 
+        headers = {
+            'Authorization': AuAPI.get_authz(),
+            'content-type': 'application/x-www-form-urlencoded',
+        }
+        try:
+            url = AuAPI.base_url + '/searchStocks'
+            response = await self._api.request_get(url=url,
+                                                   headers=headers,
+                                                   payload=post_data)
+            if response.status_code != 200:
+                self.log.error('Failed to post request to stock search error=%s', response.text)
+                raise AuAPIError('Failed to post request to stock search status not 200')
+        except Exception:
+            self.log.exception('Failed to post request to search stock')
+            raise AuAPIError('Failed to post request to search stock')
+
+        return list(parse_stock_search(response.content))
+
+    async def update(self, update_items: List[AuUpdateStockData]) -> List[AuUpdateErrorResponseData]:
+        headers = {
+            'Authorization': AuAPI.get_authz(),
+            'content-type': 'application/xml; charset=utf-8',
+        }
+        url = AuAPI.base_url + '/updateStock'
+        post_data = build_stock_update_request(update_items)
+        try:
+            response = await self._api.request_post(url=url, headers=headers, data=post_data)
+            if response.status_code != 200:
+                self.log.error('Failed to post request to update stock error=%s', response.text)
+                raise AuAPIError('Failed to post request to update stock status not 200')
+            result = parse_stock_update(response.content)
+        except Exception:
+            self.log.exception('Failed to post request to update stock')
+            raise AuAPIError('Failed to post request to update stock')
+
+        if result.status != '0':
+            self.log.error('Failed to update stock status=%s, error=%s', result.status, response.text)
+        return get_stock_update_error_items(result)
+
+
+class AsyncAuTradeAPI:
+    def __init__(self, api: AsyncAPIRequests, log: Logger):
+        self._api = api
+        self.log = log
+
+    async def _search_page(self,
+                           start_time: datetime,
+                           end_time: datetime,
+                           count_per_request: int,
+                           page: int) -> AuTradeSearchResult:
+        headers = {
+            'Authorization': AuAPI.get_authz(),
+            'content-type': 'application/x-www-form-urlencoded',
+        }
+        url = AuAPI.base_url + '//searchTradeInfoListProc'
+        post_data = build_trade_search_request(start_time=start_time,
+                                               end_time=end_time,
+                                               count_per_request=count_per_request,
+                                               start_count=1 + (page - 1) * count_per_request)
+        try:
+            response = await self._api.request_get(url=url, headers=headers, payload=post_data)
+            if response.status_code != 200:
+                self.log.error('Failed to post request to trade search error=%s', response.text)
+                raise AuAPIError('Failed to post request to trade search status not 200')
+        except Exception:
+            self.log.exception('Failed to get request to search trade')
+            raise AuAPIError('Failed to get request to search trade')
+
+        result = parse_trade_search(response.content)
+        if result.status != '0':
+            self.log.error('Failed to search trade status=%s, error=%s', result.status, response.text)
+            raise AuAPIError(f'Failed to search trade status={result.status}')
+        return result
+
+    async def search(self,
+                     start_time: datetime,
+                     end_time: datetime,
+                     count_per_request: int = 1000) -> List[AuGetTradeData]:
+        orders = []
+        async for orders_1 in self.search_pages(start_time=start_time,
+                                                end_time=end_time,
+                                                count_per_request=count_per_request):
+            orders.extend(orders_1)
         return orders
+
+    async def search_pages(self,
+                           start_time: datetime,
+                           end_time: datetime,
+                           count_per_request: int = 1000) -> AsyncIterator[List[AuGetTradeData]]:
+        # 1ページ目で総件数を取得し、残りのページは同時に取得してページ順に返す(同じ注文は1度だけ)
+        first = await self._search_page(start_time=start_time,
+                                        end_time=end_time,
+                                        count_per_request=count_per_request,
+                                        page=1)
+        tasks = [asyncio.ensure_future(self._search_page(start_time=start_time,
+                                                         end_time=end_time,
+                                                         count_per_request=count_per_request,
+                                                         page=page))
+                 for page in range(2, get_trade_search_total_pages(first, count_per_request) + 1)]
+
+        order_ids = set()
+        try:
+            for result in itertools.chain([first], tasks):
+                if not isinstance(result, AuTradeSearchResult):
+                    result = await result
+
+                orders = []
+                for order in result.orders:
+                    if order.order_id in order_ids:
+                        continue
+                    order_ids.add(order.order_id)
+                    orders.append(order)
+                yield orders
+        finally:
+            # 途中で終了・失敗した場合は残りの取得を取り消す
+            for task in tasks:
+                task.cancel()
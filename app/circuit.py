@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+from collections import deque
+from typing import Dict
+
+import const
+
+
+class CircuitBreaker:
+    # モールへのリクエストの失敗が続いたら、一定時間リクエストを送らずに失敗させる
+    # 停止時間の経過後は1件だけ試行し、成功したら再開・失敗したら再度停止する
+    def __init__(self,
+                 name: str,
+                 failure_threshold: int,
+                 reset_timeout: float,
+                 error_rate_window: int):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False
+        # 直近のリクエスト結果(True:失敗)
+        self._results = deque(maxlen=max(1, error_rate_window))
+        self._lock = threading.Lock()
+
+    def is_open(self) -> bool:
+        with self._lock:
+            return self._opened_at is not None and time.monotonic() - self._opened_at < self.reset_timeout
+
+    def remaining_open_time(self) -> float:
+        # 停止中であれば、試行を再開するまでの秒数
+        with self._lock:
+            if self._opened_at is None:
+                return 0.0
+            return max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+
+    def allow_request(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_timeout or self._trial:
+                return False
+            # 停止時間の経過後は1件だけ試行する
+            self._trial = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._results.append(False)
+            self._failures = 0
+            self._opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self._results.append(True)
+            self._failures += 1
+            if self._trial or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._trial = False
+
+    def error_rate(self) -> float:
+        with self._lock:
+            if not self._results:
+                return 0.0
+            return sum(self._results) / len(self._results)
+
+
+# モール単位でプロセス内共有
+_circuit_breakers: Dict[str, CircuitBreaker] = {}
+_circuit_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(mall: str) -> CircuitBreaker:
+    with _circuit_breakers_lock:
+        circuit_breaker = _circuit_breakers.get(mall)
+        if circuit_breaker is None:
+            circuit_breaker = CircuitBreaker(name=mall,
+                                             failure_threshold=const.CIRCUIT_FAILURE_THRESHOLD,
+                                             reset_timeout=const.CIRCUIT_RESET_TIMEOUT,
+                                             error_rate_window=const.RETRY_ERROR_RATE_WINDOW)
+            _circuit_breakers[mall] = circuit_breaker
+    return circuit_breaker
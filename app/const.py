@@ -79,6 +79,16 @@ else:
     YJDN_SECRET_CONSUMER = CREDENTIALS['yjdn']['test']['stockout'][2]['secret']
 
 YJDN_CALLBACK_URL = CFG.get('yjdn.common', 'callback_url')  # コールバックURL
+YJDN_TOKEN_REFRESH_MARGIN = CFG.getint('yjdn.common', 'token_refresh_margin_seconds')  # 有効期限の何秒前に更新するか
+YJDN_TOKEN_DEFAULT_LIFETIME = CFG.getint('yjdn.common', 'token_default_lifetime_seconds')  # 有効期限が不明な場合の有効期間
+YJDN_TOKEN_MIN_REFRESH_INTERVAL = CFG.getint('yjdn.common', 'token_min_refresh_interval_seconds')  # バックグラウンド更新の最小間隔
+YJDN_REAUTH_MODE = CFG.get('yjdn.common', 'reauth_mode')  # 再認証方法(inline/service)
+YJDN_REAUTH_CHECK_INTERVAL = CFG.getint('yjdn.common', 'reauth_check_interval_seconds')  # 再認証サービスの確認間隔
+# 認証ファイル(アプリケーション単位で全タスク共有)
+YJDN_AUTH_FILE_PRODUCER = os.path.join(
+    TMP_DIR, 'yshop_auth_producer.json' if IS_PRODUCTION else 'yshop_auth_producer_test.json')
+YJDN_AUTH_FILE_CONSUMER = os.path.join(
+    TMP_DIR, 'yshop_auth_consumer.json' if IS_PRODUCTION else 'yshop_auth_consumer_test.json')
 
 
 # ------- Yahoo!ショッピング関連 ----------
@@ -104,6 +114,9 @@ YSHOP_CERT_PKEY_FILE = os.path.join(CERT_DIR, YSHOP_CERT_PKEY_FILENAME) if YSHOP
 YSHOP_CERT_CRT_FILENAME = CFG.get('yshop.production' if IS_PRODUCTION else 'yshop.test', 'api_cert_crt_filename')
 YSHOP_CERT_CRT_FILE = os.path.join(CERT_DIR, YSHOP_CERT_CRT_FILENAME) if YSHOP_CERT_CRT_FILENAME else None
 
+# 注文詳細の並列取得数
+YSHOP_ORDER_INFO_MAX_WORKERS = CFG.getint('yshop.common', 'order_info_max_workers')
+
 # ------- 楽天関連 ----------
 # 認証情報
 if IS_PRODUCTION:
@@ -116,6 +129,7 @@ else:
 # WSDLファイル
 RMS_WSDL_FILENAME = CFG.get('rakuten.common', 'wsdl_filename')
 RMS_WSDL_FILE = os.path.join(WSDL_DIR, RMS_WSDL_FILENAME)
+RMS_ORDER_GET_MAX_WORKERS = CFG.getint('rakuten.common', 'order_get_max_workers')  # 注文詳細の並列取得数
 
 # ------- AuPayマーケット関連 ----------
 # 認証情報
@@ -128,6 +142,40 @@ else:
 AU_SHOP_ID = CFG.getint('au.common', 'shop_id')  # ショップID
 
 
+# ------- API流量制限 ----------
+RATE_LIMIT_SHARED = CFG.getboolean('ratelimit.common', 'shared')  # 同一マシンの全プロセスで流量制限を共有
+RATE_LIMIT_STATE_DIR = os.path.join(TMP_DIR, CFG.get('ratelimit.common', 'state_dirname'))
+ASYNC_API_MAX_CONCURRENCY = CFG.getint('ratelimit.common', 'async_max_concurrency')  # 非同期APIの同時リクエスト数
+API_PAGE_MAX_WORKERS = CFG.getint('ratelimit.common', 'page_max_workers')  # 検索結果の2ページ目以降の並列取得数
+RATE_LIMIT_SETTING = {
+    mall: {
+        'rate': CFG.getfloat(f'ratelimit.{mall}', 'requests_per_second'),
+        'burst': CFG.getint(f'ratelimit.{mall}', 'burst'),
+        'per_endpoint': CFG.getboolean(f'ratelimit.{mall}', 'per_endpoint'),
+        'shared': RATE_LIMIT_SHARED,
+        'state_dir': RATE_LIMIT_STATE_DIR,
+    }
+    for mall in ['rakuten', 'yshop', 'au']
+}
+
+
+# ------- HTTP接続プール ----------
+HTTP_POOL_SETTING = {
+    mall: {
+        'pool_maxsize': CFG.getint(f'http.{mall}', 'pool_maxsize'),
+        'pool_block': CFG.getboolean(f'http.{mall}', 'pool_block'),
+    }
+    for mall in ['rakuten', 'yshop', 'au']
+}
+
+
+# ------- API再試行 ----------
+RETRY_BACKOFF_MAX = CFG.getfloat('retry.common', 'backoff_max_seconds')  # 再試行の待機時間の上限
+RETRY_ERROR_RATE_WINDOW = CFG.getint('retry.common', 'error_rate_window')  # エラー率を求めるリクエスト数
+CIRCUIT_FAILURE_THRESHOLD = CFG.getint('retry.common', 'circuit_failure_threshold')  # 一時停止する連続失敗回数
+CIRCUIT_RESET_TIMEOUT = CFG.getfloat('retry.common', 'circuit_reset_timeout_seconds')  # 一時停止する時間
+
+
 # ------- ブラウザー設定 ----------
 DRIVER_HEADLESS = CFG.getboolean('browser.common', 'headless')
 
@@ -169,6 +217,19 @@ MQ_QUEUE_EXCLUSIVE = CFG.getboolean('mq.common', 'queue_exclusive')
 MQ_QUEUE_AUTO_DELETE = CFG.getboolean('mq.common', 'queue_auto_delete')
 MQ_QOS_PRE_FETCH_COUNT = CFG.getint('mq.common', 'qos_pre_fetch_count')  # 1メッセージずつ取得
 MQ_DELIVERY_MODE = CFG.getint('mq.common', 'delivery_mode')  # 再起動してもメッセージが失われないようにする
+MQ_CONSUMER_BATCH_SIZE = CFG.getint('mq.common', 'consumer_batch_size')  # コンシューマーでまとめて処理する最大メッセージ数
+MQ_CONSUMER_BATCH_WAIT_MS = CFG.getint('mq.common', 'consumer_batch_wait_ms')  # まとめて処理するまでの最大待機ミリ秒
+MQ_CONSUMER_RETRY_DELAY = CFG.getfloat('mq.common', 'consumer_retry_delay_seconds')  # 処理失敗時に次を受信するまでの待機秒数
+MQ_BLOCKED_CONNECTION_TIMEOUT = CFG.getfloat('mq.common', 'blocked_connection_timeout')  # ブローカーに接続をブロックされた場合に切断するまでの秒数
+
+# ------- 在庫0更新済み台帳 ----------
+LEDGER_DB_FILENAME = CFG.get('ledger.common', 'db_filename' if IS_PRODUCTION else 'db_filename_test')
+LEDGER_DB_FILE = os.path.join(TMP_DIR, LEDGER_DB_FILENAME)
+LEDGER_TTL_MINUTES = CFG.getint('ledger.common', 'ttl_minutes')  # 在庫0更新後、再更新をスキップする期間(分)
 
 # ------- その他 ----------
 ORDER_LIST_GET_LAST_DAYS = CFG.getint('etc.common', 'order_list_get_last_days')  # x日前から現在までの注文リストを取得
+ORDER_SCAN_OVERLAP_MINUTES = CFG.getint('etc.common', 'order_scan_overlap_minutes')  # 前回取得時刻からさかのぼる分数
+SCAN_STATE_DIR = os.path.join(TMP_DIR, CFG.get('etc.common', 'scan_state_dirname'))  # 注文取得状態の保存先
+SCAN_STATE_LOCK_TIMEOUT = CFG.getfloat('etc.common', 'scan_state_lock_timeout_seconds')  # 注文取得状態のロック待ち秒数
+PRODUCER_POLL_INTERVAL = CFG.getint('etc.common', 'producer_poll_interval_seconds')  # プロデューサー常駐時の取得間隔(秒)
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+import signal
+import threading
+import time
+from logging import Logger
+from typing import Callable, Optional
+
+
+def install_stop_handlers(stop_event: threading.Event, log: Logger):
+    # 終了シグナルを受けたら、実行中の処理が終わってから停止する
+    def _handler(signum, frame):
+        log.info('Received stop signal=%s', signum)
+        stop_event.set()
+
+    for name in ('SIGINT', 'SIGTERM', 'SIGBREAK'):
+        # SIGBREAKはWindowsのみ(Ctrl+Break・コンソールのクローズ)
+        signum = getattr(signal, name, None)
+        if signum is not None:
+            signal.signal(signum, _handler)
+
+
+def run(task: Callable[[], None],
+        interval: float,
+        log: Logger,
+        on_idle: Optional[Callable[[], None]] = None,
+        on_error: Optional[Callable[[], None]] = None,
+        idle_interval: float = 1.0,
+        stop_event: Optional[threading.Event] = None):
+    # 停止するまでinterval秒ごとにtaskを実行する
+    # 待機中はidle_interval秒ごとにon_idleを呼ぶ(MQ接続のハートビート応答など)
+    if stop_event is None:
+        stop_event = threading.Event()
+        install_stop_handlers(stop_event=stop_event, log=log)
+
+    while not stop_event.is_set():
+        started = time.monotonic()
+        try:
+            task()
+        except Exception:
+            # 失敗しても常駐は継続し、次の実行で再試行する
+            log.exception('Failed to run task')
+            if on_error:
+                try:
+                    on_error()
+                except Exception:
+                    log.exception('Failed to run error handler')
+
+        next_run = started + interval
+        while not stop_event.is_set():
+            remaining = next_run - time.monotonic()
+            if remaining <= 0:
+                break
+            stop_event.wait(min(remaining, idle_interval))
+            if on_idle:
+                try:
+                    on_idle()
+                except Exception:
+                    log.exception('Failed to run idle handler')
+
+    log.info('Stopped daemon')
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sqlite3
+from datetime import datetime, timedelta
+from typing import Iterable, List, Optional
+
+import const
+
+
+class LedgerError(Exception):
+    pretext = ''
+
+    def __init__(self, message, *args):
+        if self.pretext:
+            message = f"{self.pretext}: {message}"
+        super().__init__(message, *args)
+
+
+class StockoutLedger:
+    # 在庫0に更新済みの商品を記録する(モール, 商品コード, 更新日時)
+    def __init__(self,
+                 db_file: str = const.LEDGER_DB_FILE,
+                 ttl_minutes: int = const.LEDGER_TTL_MINUTES):
+        self.db_file = db_file
+        self.ttl_minutes = ttl_minutes
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def open(self):
+        if self._conn:
+            return
+
+        try:
+            os.makedirs(os.path.dirname(self.db_file), exist_ok=True)
+            # 複数のコンシューマーから同時に書き込まれるためロック待ちを長めにする
+            conn = sqlite3.connect(self.db_file, timeout=30.0)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS stockout_ledger (
+                    mall TEXT NOT NULL,
+                    item_code TEXT NOT NULL,
+                    zeroed_at TEXT NOT NULL,
+                    PRIMARY KEY (mall, item_code)
+                )""")
+            conn.commit()
+        except Exception:
+            raise LedgerError(f'Failed to open ledger db file={self.db_file}')
+        self._conn = conn
+
+    def close(self):
+        if self._conn:
+            self._conn.close()
+            self._conn = None
+
+    def filter_not_zeroed(self, mall: str, item_codes: Iterable[str]) -> List[str]:
+        # TTL内に在庫0に更新済みの商品を除外する
+        item_codes = list(item_codes)
+        if not item_codes or self.ttl_minutes <= 0:
+            return item_codes
+
+        self.open()
+        expire_time = (datetime.now() - timedelta(minutes=self.ttl_minutes)).isoformat()
+        zeroed = set()
+        # SQLiteのパラメータ数上限を超えないよう分割
+        chunk_size = 500
+        for i in range(0, len(item_codes), chunk_size):
+            item_codes_1 = item_codes[i:i + chunk_size]
+            placeholders = ','.join('?' * len(item_codes_1))
+            rows = self._conn.execute(
+                f'SELECT item_code FROM stockout_ledger '
+                f'WHERE mall = ? AND zeroed_at >= ? AND item_code IN ({placeholders})',
+                [mall, expire_time, *item_codes_1])
+            zeroed.update(row[0] for row in rows)
+
+        return [item_code for item_code in item_codes if item_code not in zeroed]
+
+    def record(self, mall: str, item_codes: Iterable[str]):
+        self.open()
+        zeroed_at = datetime.now().isoformat()
+        with self._conn:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO stockout_ledger (mall, item_code, zeroed_at) VALUES (?, ?, ?)',
+                [(mall, item_code, zeroed_at) for item_code in item_codes])
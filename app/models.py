@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+# APIから取得・APIへ送信するデータ
+# 大量の注文・在庫を保持するため、__slots__で属性辞書を持たない変更不可のデータとする
+# (Python3.10未満でも使えるよう、dataclassのslots引数ではなく__slots__を定義する)
+
+
+class _Record:
+    # 変更不可かつ__slots__のデータをcopy・pickleできるようにする
+    __slots__ = ()
+
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            object.__setattr__(self, name, value)
+
+
+# ------- 楽天 ----------
+@dataclass(frozen=True)
+class RakutenApiGetItemData(_Record):
+    __slots__ = ('product_id', 'item_name', 'item_price', 'inventory_count')
+    product_id: str
+    item_name: Optional[str]
+    item_price: Optional[int]
+    inventory_count: Optional[int]
+
+
+@dataclass(frozen=True)
+class OrderItemData(_Record):
+    __slots__ = ('item_name', 'manage_number')
+    item_name: str
+    manage_number: str
+
+
+@dataclass(frozen=True)
+class OrderData(_Record):
+    __slots__ = ('order_number', 'order_progress', 'order_items')
+    order_number: str
+    order_progress: int
+    order_items: Tuple[OrderItemData, ...]
+
+
+@dataclass(frozen=True)
+class InventoryData(_Record):
+    __slots__ = ('item_url', 'inventory_count')
+    item_url: str
+    inventory_count: int
+
+
+@dataclass(frozen=True)
+class InventoryUpdateData(_Record):
+    __slots__ = ('item_url', 'inventory_count')
+    item_url: str
+    inventory_count: int
+
+
+@dataclass(frozen=True)
+class InventoryUpdateErrorResponseItemData(_Record):
+    __slots__ = ('item_url', 'error_code', 'error_message')
+    item_url: str
+    error_code: str
+    error_message: str
+
+
+@dataclass(frozen=True)
+class InventoryUpdateResultData(_Record):
+    __slots__ = ('err_code', 'error_items')
+    # N00-000:正常終了(全件更新済み)
+    err_code: str
+    error_items: Tuple[InventoryUpdateErrorResponseItemData, ...]
+
+    @property
+    def succeeded(self) -> bool:
+        return self.err_code == 'N00-000'
+
+
+# ------- Yahoo!ショッピング ----------
+@dataclass(frozen=True)
+class OrderListData(_Record):
+    __slots__ = ('order_id',)
+    order_id: str
+
+
+@dataclass(frozen=True)
+class OrderInfoItemData(_Record):
+    __slots__ = ('item_id', 'title')
+    item_id: str
+    title: str
+
+
+@dataclass(frozen=True)
+class OrderInfoData(_Record):
+    __slots__ = ('order_id', 'order_status', 'items')
+    order_id: str
+    order_status: int
+    items: Tuple[OrderInfoItemData, ...]
+
+
+@dataclass(frozen=True)
+class GetStockData(_Record):
+    __slots__ = ('item_code', 'status', 'quantity')
+    item_code: str
+    status: int
+    quantity: int
+
+
+@dataclass(frozen=True)
+class SetStockResponseData(_Record):
+    __slots__ = ('item_code', 'quantity')
+    item_code: str
+    quantity: int
+
+
+@dataclass(frozen=True)
+class SetStockData(_Record):
+    __slots__ = ('item_code', 'quantity')
+    item_code: str
+    quantity: int
+
+
+# ------- AuPayマーケット ----------
+@dataclass(frozen=True)
+class AuGetStockData(_Record):
+    __slots__ = ('item_code', 'stock_count')
+    item_code: str
+    stock_count: int
+
+
+@dataclass(frozen=True)
+class AuUpdateStockData(_Record):
+    __slots__ = ('item_code', 'stock_count')
+    item_code: str
+    stock_count: int
+
+
+@dataclass(frozen=True)
+class AuUpdateErrorResponseData(_Record):
+    __slots__ = ('item_code', 'error_code', 'error_message')
+    item_code: str
+    error_code: str
+    error_message: str
+
+
+@dataclass(frozen=True)
+class AuGetTradeItemData(_Record):
+    __slots__ = ('order_detail_id', 'item_code', 'item_name')
+    order_detail_id: int
+    item_code: str
+    item_name: str
+
+
+@dataclass(frozen=True)
+class AuGetTradeData(_Record):
+    __slots__ = ('order_id', 'order_status', 'details')
+    order_id: int
+    order_status: str
+    details: Tuple[AuGetTradeItemData, ...]
@@ -2,19 +2,44 @@
 
 import functools
 import json
-from typing import Optional, Dict, List
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+from typing import Optional, Dict, Iterable, List, Sequence, Set, Tuple
 import pika
+import pika.exceptions
 from pika.adapters.blocking_connection import BlockingChannel
 from dataclasses import dataclass
 
 import const
+from apireq import CircuitOpenError
 
 
 @dataclass
 class MQMsgData:
     id: str
+    # 重複を除いた商品ID(注文順)
     item_ids: List[str]
     msg_send_time: str
+    # 商品IDごとの注文明細数(旧形式のメッセージには無い)
+    item_counts: Optional[Dict[str, int]] = None
+
+    @classmethod
+    def create(cls, item_ids: Iterable[str], with_counts: bool = True) -> 'MQMsgData':
+        # 注文明細ごとの商品IDを、重複を除いた商品IDと件数にまとめる
+        item_counts = Counter(item_ids)
+        return cls(id=str(uuid.uuid4()),
+                   item_ids=list(item_counts),
+                   msg_send_time=datetime.now().isoformat(),
+                   item_counts=dict(item_counts) if with_counts else None)
+
+
+@dataclass
+class MQPublishFailure:
+    index: int
+    routing_key: str
+    reason: str
 
 
 class MQError(Exception):
@@ -26,6 +51,45 @@ class MQError(Exception):
         super().__init__(message, *args)
 
 
+# プロセス内で再利用する接続(host, vhost, username)
+_connection_pool: Dict[Tuple[str, str, str], pika.BlockingConnection] = {}
+
+
+def close_connections():
+    for connection in _connection_pool.values():
+        try:
+            if connection.is_open:
+                connection.close()
+        except Exception:
+            pass
+    _connection_pool.clear()
+
+
+def _evict_connection(connection: pika.BlockingConnection):
+    # 共有接続から外して閉じる(次の接続で作り直す)
+    for pool_key, pooled_connection in list(_connection_pool.items()):
+        if pooled_connection is connection:
+            _connection_pool.pop(pool_key, None)
+    try:
+        if connection.is_open:
+            connection.close()
+    except Exception:
+        pass
+
+
+def process_connections(time_limit: float = 0):
+    # 共有接続のハートビートに応答する(常駐時の待機中に呼ぶ)
+    # 切断された接続は破棄し、次の送信時に再接続する
+    for pool_key, connection in list(_connection_pool.items()):
+        try:
+            if connection.is_open:
+                connection.process_data_events(time_limit=time_limit)
+                continue
+        except Exception:
+            pass
+        _connection_pool.pop(pool_key, None)
+
+
 class MQ:
     def __init__(self,
                  host: str,
@@ -33,12 +97,13 @@ class MQ:
                  username: str,
                  password: str,
                  exchange: str,
-                 queue: str,
-                 routing_key: str,
+                 queue: Optional[str] = None,
+                 routing_key: Optional[str] = None,
                  exchange_type: str = const.MQ_EXCHANGE_TYPE,
                  passive: bool = const.MQ_PASSIVE,
                  durable: bool = const.MQ_DURABLE,
-                 connection_attempts: int = const.MQ_CONNECTION_ATTEMPTS
+                 connection_attempts: int = const.MQ_CONNECTION_ATTEMPTS,
+                 pooled: bool = False,
                  ):
         self.host = host
         self.vhost = vhost
@@ -51,9 +116,15 @@ class MQ:
         self.passive = passive
         self.durable = durable
         self.connection_attempts = connection_attempts
+        # True: 接続をプロセス内で共有し、close時はチャネルのみ閉じる
+        self.pooled = pooled
 
         self.connection: Optional[pika.BlockingConnection] = None
         self.channel: Optional[BlockingChannel] = None
+        self._bindings: Set[Tuple[str, str]] = set()
+        self._tx_enabled = False
+        # トランザクション中に返送された(ルーティングできなかった)メッセージ(message_id, routing_key)
+        self._returned: List[Tuple[str, str]] = []
 
     def __del__(self):
         self.close()
@@ -65,9 +136,19 @@ class MQ:
     def __exit__(self, exc_type, exc_value, traceback):
         self.close()
 
-    def open(self):
-        if self.is_open():
-            return
+    def _connect(self) -> pika.BlockingConnection:
+        pool_key = (self.host, self.vhost, self.username)
+        if self.pooled:
+            connection = _connection_pool.get(pool_key)
+            if connection and connection.is_open:
+                try:
+                    # 待機中に切断されていないか、受信済みのイベントを処理してから使い回す
+                    connection.process_data_events(time_limit=0)
+                    if connection.is_open:
+                        return connection
+                except Exception:
+                    pass
+                _evict_connection(connection)
 
         try:
             connection = pika.BlockingConnection(
@@ -76,19 +157,58 @@ class MQ:
                     virtual_host=self.vhost,
                     credentials=pika.PlainCredentials(username=self.username, password=self.password),
                     connection_attempts=self.connection_attempts,
+                    blocked_connection_timeout=const.MQ_BLOCKED_CONNECTION_TIMEOUT,
                 ),
             )
         except Exception:
             raise MQError('Queue Connection AMQPError')
 
-        try:
-            channel = connection.channel()
-        except Exception:
-            if connection:
-                if connection.is_open:
-                    connection.close()
-            raise MQError('Message queue AMQPError when connection.channel()')
+        if self.pooled:
+            _connection_pool[pool_key] = connection
+        return connection
+
+    def _close_connection(self, connection: pika.BlockingConnection):
+        if self.pooled:
+            return
+        if connection:
+            if connection.is_open:
+                connection.close()
+
+    def open(self):
+        if self.is_open():
+            return
+
+        for attempt in range(2):
+            connection = self._connect()
+            try:
+                channel = self._open_channel(connection)
+                break
+            except pika.exceptions.AMQPConnectionError:
+                if self.pooled and attempt == 0:
+                    # 共有接続がハートビート切れなどで切断されていた場合は、破棄して新しい接続で1度だけ開き直す
+                    _evict_connection(connection)
+                    continue
+                self._close_connection(connection)
+                raise MQError('Message queue AMQPError when connection.channel()')
+            except Exception:
+                self._close_connection(connection)
+                raise MQError('Declare and bind AMQPError')
 
+        self.connection = connection
+        self.channel = channel
+        self._bindings = set()
+        self._tx_enabled = False
+        self._returned = []
+
+        if self.queue:
+            try:
+                self.bind(queue=self.queue, routing_key=self.routing_key)
+            except Exception:
+                self.close()
+                raise
+
+    def _open_channel(self, connection: pika.BlockingConnection) -> BlockingChannel:
+        channel = connection.channel()
         try:
             channel.exchange_declare(
                 exchange=self.exchange,
@@ -97,30 +217,47 @@ class MQ:
                 durable=self.durable,
                 auto_delete=const.MQ_EXCHANGE_AUTO_DELETE,
             )
-            channel.queue_declare(
-                queue=self.queue,
+            channel.basic_qos(prefetch_count=const.MQ_QOS_PRE_FETCH_COUNT)
+        except Exception:
+            if channel.is_open:
+                channel.close()
+            raise
+        return channel
+
+    def _reopen(self):
+        # 共有接続を破棄して新しい接続で開き直し、バインド済みのキューを再度バインドする
+        bindings = set(self._bindings)
+        connection = self.connection
+        self.close()
+        if connection:
+            _evict_connection(connection)
+        self.open()
+        for queue, routing_key in bindings:
+            self.bind(queue=queue, routing_key=routing_key)
+
+    def bind(self, queue: str, routing_key: str):
+        # 同一チャネルで複数キューへ送信するため、キューの宣言・バインドは1度だけ行う
+        if not self.is_open():
+            raise MQError('Cannot open connect')
+        if (queue, routing_key) in self._bindings:
+            return
+
+        try:
+            self.channel.queue_declare(
+                queue=queue,
                 passive=self.passive,
                 durable=self.durable,
                 exclusive=const.MQ_QUEUE_EXCLUSIVE,
                 auto_delete=const.MQ_QUEUE_AUTO_DELETE,
             )
-            channel.queue_bind(
+            self.channel.queue_bind(
                 exchange=self.exchange,
-                queue=self.queue,
-                routing_key=self.routing_key
+                queue=queue,
+                routing_key=routing_key
             )
-            channel.basic_qos(prefetch_count=const.MQ_QOS_PRE_FETCH_COUNT)
         except Exception:
-            if channel:
-                if channel.is_open:
-                    channel.close()
-            if connection:
-                if connection.is_open:
-                    connection.close()
             raise MQError('Declare and bind AMQPError')
-
-        self.connection = connection
-        self.channel = channel
+        self._bindings.add((queue, routing_key))
 
     def close(self):
         try:
@@ -129,12 +266,14 @@ class MQ:
                     self.channel.stop_consuming()
                     self.channel.close()
             if self.connection:
-                if self.connection.is_open:
-                    self.connection.close()
+                self._close_connection(self.connection)
         except Exception:
             pass
         self.channel = None
         self.connection = None
+        self._bindings = set()
+        self._tx_enabled = False
+        self._returned = []
 
     def is_open(self):
         if self.connection and self.channel:
@@ -142,7 +281,7 @@ class MQ:
                 return True
         return False
 
-    def send_message(self, message: Dict):
+    def send_message(self, message: Dict, routing_key: Optional[str] = None):
         if not self.is_open():
             raise MQError('Cannot open connect')
 
@@ -154,15 +293,101 @@ class MQ:
         try:
             self.channel.basic_publish(
                 exchange=self.exchange,
-                routing_key=self.routing_key,
+                routing_key=routing_key or self.routing_key,
                 body=message_json.encode('utf-8'),
                 properties=pika.BasicProperties(
                     delivery_mode=const.MQ_DELIVERY_MODE,
                     content_type='application/json',
                 ))
+            # トランザクションモードのチャネルではコミットするまで送信されない
+            if self._tx_enabled:
+                self.channel.tx_commit()
         except Exception:
             raise MQError('Publish message AMQPError')
 
+    def _on_returned(self,
+                     channel: BlockingChannel,  # noqa
+                     method: pika.spec.Basic.Return,
+                     properties: pika.BasicProperties,
+                     body: bytes):  # noqa
+        self._returned.append((properties.message_id, method.routing_key))
+
+    def _tx_select(self):
+        # トランザクションモードはチャネルごとに1度だけ有効にする
+        if self._tx_enabled:
+            return
+        self.channel.add_on_return_callback(self._on_returned)
+        self.channel.tx_select()
+        self._tx_enabled = True
+
+    def _publish_batch(self, bodies: List[Tuple[str, bytes]], routing_keys: List[str]):
+        self._tx_select()
+        self._returned = []
+        for message_id, body in bodies:
+            for routing_key in routing_keys:
+                self.channel.basic_publish(
+                    exchange=self.exchange,
+                    routing_key=routing_key,
+                    body=body,
+                    properties=pika.BasicProperties(
+                        delivery_mode=const.MQ_DELIVERY_MODE,
+                        content_type='application/json',
+                        message_id=message_id,
+                    ),
+                    mandatory=True)
+
+        self.channel.tx_commit()
+        # コミット完了までに届いた返送メッセージを受け取る
+        self.connection.process_data_events(time_limit=0)
+
+    def send_messages(self,
+                      messages: List[Dict],
+                      routing_keys: Optional[Sequence[str]] = None) -> List[MQPublishFailure]:
+        # 全メッセージを各ルーティングキーへ続けて送信し、まとめてコミットする(ブローカーとの往復はコミットの1回のみ)
+        # コミットが完了した時点で、ルーティングできたメッセージはブローカーが受け付け済み(永続化設定の場合は保存済み)
+        # ルーティングできなかったメッセージ・JSONに変換できなかったメッセージを返す
+        # コミットに失敗した場合はどのメッセージも送信されないため、MQErrorにする
+        # BlockingChannelは送信確認(publisher confirms)を送信ごとに待つため、確認モードではなくトランザクションを使う
+        if not self.is_open():
+            raise MQError('Cannot open connect')
+
+        routing_keys = list(routing_keys) if routing_keys else [self.routing_key]
+        failures = []
+        message_indexes = {}
+        bodies = []
+        for index, message in enumerate(messages):
+            try:
+                body = json.dumps(message, ensure_ascii=False).encode('utf-8')
+            except Exception:
+                failures.extend(MQPublishFailure(index=index, routing_key=routing_key,
+                                                 reason='JSON dump exception error')
+                                for routing_key in routing_keys)
+                continue
+            message_id = uuid.uuid4().hex
+            message_indexes[message_id] = index
+            bodies.append((message_id, body))
+
+        for attempt in range(2):
+            try:
+                self._publish_batch(bodies=bodies, routing_keys=routing_keys)
+                break
+            except pika.exceptions.AMQPConnectionError:
+                if not self.pooled or attempt > 0:
+                    raise MQError('Publish messages AMQPError')
+                # 共有接続が切断されていた場合は、新しい接続で開き直して1度だけ送り直す
+                # (コミット中に切断された場合は重複することがあるが、在庫0への更新は重複しても結果は同じ)
+                self._reopen()
+            except Exception:
+                raise MQError('Publish messages AMQPError')
+
+        for message_id, routing_key in self._returned:
+            if message_id in message_indexes:
+                failures.append(MQPublishFailure(index=message_indexes[message_id],
+                                                 routing_key=routing_key,
+                                                 reason='Unroutable message'))
+        self._returned = []
+        return sorted(failures, key=lambda failure: failure.index)
+
     def receive_message(self, callback: functools.partial):
         if not self.is_open():
             raise MQError('not open connect')
@@ -175,6 +400,67 @@ class MQ:
         except Exception:
             raise MQError('Receive message Exception Error')
 
+    def receive_message_batch(self,
+                              callback: functools.partial,
+                              max_messages: int = const.MQ_CONSUMER_BATCH_SIZE,
+                              max_wait_ms: int = const.MQ_CONSUMER_BATCH_WAIT_MS):
+        # 最大max_messages件、または最初の受信からmax_wait_ms経過までまとめて処理する
+        if not self.is_open():
+            raise MQError('not open connect')
+
+        try:
+            self.channel.basic_qos(prefetch_count=max_messages)
+            batch = []
+            deadline = None
+            for method, _properties, body in self.channel.consume(queue=self.queue, inactivity_timeout=0.05):
+                if method is not None:
+                    try:
+                        msg = json.loads(body.decode('utf-8'))
+                        batch.append((method.delivery_tag, msg))
+                        if deadline is None:
+                            deadline = time.monotonic() + max_wait_ms / 1000
+                    except Exception:
+                        # メッセージ異常(デッドレター交換が設定されていれば転送)
+                        self.channel.basic_reject(delivery_tag=method.delivery_tag, requeue=False)
+
+                if batch and (len(batch) >= max_messages or time.monotonic() >= deadline):
+                    self._on_messages(channel=self.channel, batch=batch, func=callback)
+                    batch = []
+                    deadline = None
+        except Exception:
+            raise MQError('Receive message Exception Error')
+
+    @staticmethod
+    def _on_messages(channel: BlockingChannel,
+                     batch: List[Tuple[int, Dict]],
+                     func: functools.partial):
+        # 形式が異常なメッセージは個別に破棄し(デッドレター交換が設定されていれば転送)、
+        # 残りのメッセージはまとめてack/nackする
+        valid_batch = []
+        for delivery_tag, msg in batch:
+            try:
+                MQMsgData(**msg)
+            except Exception:
+                channel.basic_reject(delivery_tag=delivery_tag, requeue=False)
+                continue
+            valid_batch.append((delivery_tag, msg))
+        if not valid_batch:
+            return
+
+        last_delivery_tag = max(delivery_tag for delivery_tag, _msg in valid_batch)
+        try:
+            result = func(msgs=[msg for _delivery_tag, msg in valid_batch])
+        except Exception as e:
+            # 処理できなかったメッセージは再配信し、待機してから次を受信する
+            channel.basic_nack(delivery_tag=last_delivery_tag, multiple=True, requeue=True)
+            channel.connection.sleep(MQ._get_retry_delay(e))
+            return
+
+        if result:
+            channel.basic_ack(delivery_tag=last_delivery_tag, multiple=True)
+        else:
+            channel.basic_nack(delivery_tag=last_delivery_tag, multiple=True)
+
     @staticmethod
     def _on_message(channel: BlockingChannel,
                     method: pika.spec.Basic.Deliver,
@@ -191,9 +477,25 @@ class MQ:
 
         try:
             result = func(msg=msg)
-            if result:
-                channel.basic_ack(delivery_tag=method.delivery_tag)
-            else:
-                channel.basic_nack(delivery_tag=method.delivery_tag)
-        except Exception:
+        except Exception as e:
+            # 処理できなかったメッセージは再配信し、待機してから次を受信する
+            channel.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+            channel.connection.sleep(MQ._get_retry_delay(e))
             return
+
+        if result:
+            channel.basic_ack(delivery_tag=method.delivery_tag)
+        else:
+            channel.basic_nack(delivery_tag=method.delivery_tag)
+
+    @staticmethod
+    def _get_retry_delay(error: BaseException) -> float:
+        # モールへのリクエストが停止中であれば、再開まで待つ
+        # (コンシューマーが例外を包み直している場合もあるため、元の例外まで遡る)
+        errors = set()
+        while error is not None and id(error) not in errors:
+            errors.add(id(error))
+            if isinstance(error, CircuitOpenError):
+                return max(const.MQ_CONSUMER_RETRY_DELAY, error.retry_after)
+            error = error.__cause__ or error.__context__
+        return const.MQ_CONSUMER_RETRY_DELAY
@@ -1,56 +1,117 @@
 # -*- coding: utf-8 -*-
 
+import asyncio
 import base64
-import xml.etree.ElementTree as ET
-from typing import Optional, List
-from dataclasses import dataclass
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterator, Optional, List, Tuple
 from datetime import datetime
 import json
 import zeep
+from zeep.transports import Transport
 
 from logging import Logger
 import const
-from apireq import APIRequests
+from apireq import APIRequests, AsyncAPIRequests, CircuitOpenError, create_session, iter_pages, gather_pages
+import ratelimit
+import circuit
+import xmlparser
+import xmlbuilder
+from models import (RakutenApiGetItemData, OrderItemData, OrderData, InventoryData, InventoryUpdateData,
+                    InventoryUpdateErrorResponseItemData, InventoryUpdateResultData)
 
 
-@dataclass
-class RakutenApiGetItemData:
-    product_id: str
-    item_name: Optional[str]
-    item_price: Optional[int]
-    inventory_count: Optional[int]
+def parse_item_get(content: bytes) -> Optional[RakutenApiGetItemData]:
+    for el in xmlparser.iterparse(content, tags=('code', 'item')):
+        if el.getparent() is None or el.getparent().tag != 'itemGetResult':
+            continue
 
+        if el.tag == 'code':
+            if el.text != 'N000':
+                return None
+            continue
 
-@dataclass
-class OrderItemData:
-    item_name: str
-    manage_number: str
-
-
-@dataclass
-class OrderData:
-    order_number: str
-    order_progress: int
-    order_items: List[OrderItemData]
+        inventory_count = 0
+        for el_inventory in el.iterfind('.//itemInventory/inventories'):
+            inventory_count = el_inventory.findtext('.//inventoryCount')
+
+        return RakutenApiGetItemData(product_id=el.findtext('.//itemUrl'),
+                                     item_name=el.findtext('.//itemName'),
+                                     item_price=int(el.findtext('.//itemPrice')),
+                                     inventory_count=int(inventory_count))
+    return None
+
+
+def parse_item_update(content: bytes) -> Optional[str]:
+    # 更新結果のステータスコード
+    for el in xmlparser.iterparse(content, tags=('code',)):
+        if el.getparent() is not None and el.getparent().tag == 'itemUpdateResult':
+            return el.text
+    return None
+
+
+def build_item_update_request(item_url: str, inventory_count: int) -> bytes:
+    item = xmlbuilder.element(
+        'item',
+        xmlbuilder.text_element('itemUrl', item_url),
+        xmlbuilder.element('itemInventory',
+                           xmlbuilder.text_element('inventoryType', 1),
+                           xmlbuilder.element('inventories',
+                                              xmlbuilder.element('inventory',
+                                                                 xmlbuilder.text_element('inventoryCount',
+                                                                                         inventory_count)))))
+    return xmlbuilder.build_document(root_tag='request',
+                                     children=[xmlbuilder.element('itemUpdateRequest', item)])
+
+
+def build_order_search_request(start_datetime: datetime,
+                               end_datetime: datetime,
+                               item_count_per_page: int,
+                               page: int) -> bytes:
+    post_data = {
+        "dateType": 1,
+        "startDatetime": start_datetime.strftime('%Y-%m-%dT%H:%M:%S+0900'),
+        "endDatetime": end_datetime.strftime('%Y-%m-%dT%H:%M:%S+0900'),
+        "PaginationRequestModel": {
+            "requestRecordsAmount": item_count_per_page,
+            "requestPage": page,
+            "SortModelList": [
+                {
+                    "sortColumn": 1,
+                    "sortDirection": 1
+                }
+            ]
+        }
+    }
+    return json.dumps(post_data).encode('utf-8')
 
 
-@dataclass
-class InventoryData:
-    item_url: str
-    inventory_count: int
+def parse_order_search(res_json: dict) -> Tuple[List[str], int]:
+    # (注文番号リスト, 総ページ数)
+    total_pages = res_json.get('PaginationResponseModel', {}).get('totalPages')
+    return res_json.get('orderNumberList', []), 0 if not total_pages else total_pages
 
 
-@dataclass
-class InventoryUpdateData:
-    item_url: str
-    inventory_count: int
+def build_order_get_request(order_number_list: List[str]) -> bytes:
+    post_data = {
+        'orderNumberList': order_number_list,
+        'version': 5,
+    }
+    return json.dumps(post_data).encode('utf-8')
 
 
-@dataclass
-class InventoryUpdateErrorResponseItemData:
-    item_url: str
-    error_code: str
-    error_message: str
+def parse_order_get(res_json: dict) -> List[OrderData]:
+    orders = []
+    for order_model in res_json.get('OrderModelList', []):
+        order_items = tuple(OrderItemData(item_name=item_model['itemName'],
+                                          manage_number=item_model['manageNumber'])
+                            for package_model in order_model['PackageModelList']
+                            for item_model in package_model['ItemModelList'])
+        orders.append(OrderData(order_number=order_model['orderNumber'],
+                                order_progress=order_model['orderProgress'],
+                                order_items=order_items))
+    return orders
 
 
 class RakutenAPIError(Exception):
@@ -69,17 +130,22 @@ class RakutenAPI:
                  backoff_factor: int = 2,
                  connect_timeout: float = 30.0,
                  read_timeout: float = 60.0):
+        rate_limiter = ratelimit.get_rate_limiter('rakuten')
+        circuit_breaker = circuit.get_circuit_breaker('rakuten')
         self.api = APIRequests(retry_total=retry_total,
                                backoff_factor=backoff_factor,
                                connect_timeout=connect_timeout,
-                               read_timeout=read_timeout)
+                               read_timeout=read_timeout,
+                               rate_limiter=rate_limiter,
+                               circuit_breaker=circuit_breaker,
+                               **const.HTTP_POOL_SETTING['rakuten'])
 
         # 商品API
         self.item = RakutenItemAPI(api=self.api, log=log)
         # 注文API
         self.order = RakutenOrderAPI(api=self.api, log=log)
         # 在庫API
-        self.inventory = RakutenInventoryAPI(log=log)
+        self.inventory = RakutenInventoryAPI(log=log, rate_limiter=rate_limiter, circuit_breaker=circuit_breaker)
 
     def __enter__(self):
         return self
@@ -90,6 +156,10 @@ class RakutenAPI:
     def close(self):
         self.api.close()
 
+    def reset(self):
+        # 接続を破棄し、次のリクエストで再接続する
+        self.api.reset()
+
     @staticmethod
     def get_authz() -> bytes:
         b_service_secret = bytes(const.RMS_API_SERVICE_SECRET, encoding='utf-8')
@@ -122,49 +192,10 @@ class RakutenItemAPI:
             self.log.exception('Failed to get request to get item')
             raise RakutenAPIError('Failed to get request to get item')
 
-        root = ET.fromstring(response.text)
-        status_code = root.find('.//itemGetResult/code').text
-        if status_code != 'N000':
-            return None
-
-        if not root.findall('.//itemGetResult/item'):
-            return None
-
-        el_item = root.find('.//item')
-        product_id = el_item.find('.//itemUrl').text
-        item_name = el_item.find('.//itemName').text
-        item_price = el_item.find('.//itemPrice').text
-
-        inventory_count = 0
-        for el_inventory in el_item.findall('.//itemInventory/inventories'):
-            inventory_count = el_inventory.find('.//inventoryCount').text
-
-        item_data = RakutenApiGetItemData(product_id=product_id,
-                                          item_name=item_name,
-                                          item_price=int(item_price),
-                                          inventory_count=int(inventory_count))
-        return item_data
+        return parse_item_get(response.content)
 
     def update(self, item_url: str, inventory_count: int) -> bool:
-        data = f"""<?xml version="1.0" encoding="UTF-8"?>
-            <request>
-                <itemUpdateRequest>
-                    <item>
-                        <itemUrl>{item_url}</itemUrl>
-                        <itemInventory>
-                            <inventoryType>1</inventoryType>
-                            <inventories>
-                                <inventory>
-                                    <inventoryCount>{inventory_count}</inventoryCount>
-                                </inventory>
-                            </inventories>
-                        </itemInventory>
-                    </item>
-                </itemUpdateRequest>
-            </request>
-            """
-
-        # ET.dump(root)
+        data = build_item_update_request(item_url=item_url, inventory_count=inventory_count)
         headers = {
             'Authorization': RakutenAPI.get_authz(),
             'content-type': 'text/xml; charset=utf-8',
@@ -181,147 +212,220 @@ class RakutenItemAPI:
             self.log.exception('Failed to post request to update item')
             raise RakutenAPIError('Failed to post request to update item')
 
-        root = ET.fromstring(res.text)
-        status_code = root.find('.//itemUpdateResult/code').text
+        status_code = parse_item_update(res.content)
         if status_code == 'N000':
             return False
         return True
 
 
 class RakutenOrderAPI:
+    # url = https://api.rms.rakuten.co.jp/es/2.0/sample.order/searchOrder/
+    search_url: str = 'https://api.rms.rakuten.co.jp/es/2.0/order/searchOrder/'
+    get_url: str = 'https://api.rms.rakuten.co.jp/es/2.0/order/getOrder/'
+
     def __init__(self, api: APIRequests, log: Logger):
         self._api = api
         self.log = log
 
-    def search(self,
-               start_datetime: datetime,
-               end_datetime: datetime,
-               item_count_per_page: int = 1000) -> List[str]:
-        post_data = {
-            "dateType": 1,
-            "startDatetime": start_datetime.strftime('%Y-%m-%dT%H:%M:%S+0900'),
-            "endDatetime": end_datetime.strftime('%Y-%m-%dT%H:%M:%S+0900'),
-            "PaginationRequestModel": {
-                "requestRecordsAmount": item_count_per_page,
-                "requestPage": 1,
-                "SortModelList": [
-                    {
-                        "sortColumn": 1,
-                        "sortDirection": 1
-                    }
-                ]
-            }
-        }
-        # url = https://api.rms.rakuten.co.jp/es/2.0/sample.order/searchOrder/
-        url = 'https://api.rms.rakuten.co.jp/es/2.0/order/searchOrder/'
+    def _search_page(self,
+                     start_datetime: datetime,
+                     end_datetime: datetime,
+                     item_count_per_page: int,
+                     page: int) -> Tuple[List[str], int]:
         headers = {
             'Authorization': RakutenAPI.get_authz(),
             'content-type': 'application/json; charset=utf-8',
         }
+        post_data = build_order_search_request(start_datetime=start_datetime,
+                                               end_datetime=end_datetime,
+                                               item_count_per_page=item_count_per_page,
+                                               page=page)
+        try:
+            res = self._api.request_post(url=RakutenOrderAPI.search_url,
+                                         headers=headers,
+                                         data=post_data)
+            if res.status_code != 200:
+                self.log.error('Failed to post request to search order list error=%s', res.text)
+                raise RakutenAPIError('Failed to post request to search order list status not 200')
+        except Exception:
+            self.log.exception('Failed to post request to search order list')
+            raise RakutenAPIError('Failed to post request to search order list')
 
-        page_count = 1
-        total_pages = 1
-        order_numbers = []
-        while page_count <= total_pages:
-            post_data['PaginationRequestModel']['requestPage'] = page_count
-            try:
-                res = self._api.request_post(url=url,
-                                             headers=headers,
-                                             data=json.dumps(post_data).encode('utf-8'))
-                if res.status_code != 200:
-                    self.log.error('Failed to post request to search order list error=%s', res.text)
-                    raise RakutenAPIError('Failed to post request to search order list status not 200')
-            except Exception:
-                self.log.exception('Failed to post request to search order list')
-                raise RakutenAPIError('Failed to post request to search order list')
+        return parse_order_search(res.json())
 
-            res_json = res.json()
-            order_numbers.extend(res_json.get('orderNumberList', []))
+    def search(self,
+               start_datetime: datetime,
+               end_datetime: datetime,
+               item_count_per_page: int = 1000,
+               max_workers: int = const.API_PAGE_MAX_WORKERS) -> List[str]:
+        # 1ページ目で総ページ数を取得し、残りのページは並列で取得する(結果はページ順)
+        pages = iter_pages(fetch_page=lambda page: self._search_page(start_datetime=start_datetime,
+                                                                     end_datetime=end_datetime,
+                                                                     item_count_per_page=item_count_per_page,
+                                                                     page=page),
+                           get_total_pages=lambda result: result[1],
+                           max_workers=max_workers)
 
-            total_pages_1 = res_json.get('PaginationResponseModel', {}).get('totalPages')
-            total_pages = 0 if not total_pages_1 else total_pages_1
-            page_count += 1
+        order_numbers = []
+        for order_numbers_1, _ in pages:
+            order_numbers.extend(order_numbers_1)
 
         return order_numbers
 
-    def get(self, order_number_list: List[str], chunk_size: int = 100) -> List[OrderData]:
-        # リストを分割
-        order_number_list_n = [order_number_list[i:i + chunk_size]
-                               for i in range(0, len(order_number_list), chunk_size)]
-
-        url = 'https://api.rms.rakuten.co.jp/es/2.0/order/getOrder/'
+    def _get_chunk(self, order_number_list: List[str]) -> List[OrderData]:
         headers = {
             'Authorization': RakutenAPI.get_authz(),
             'content-type': 'application/json; charset=utf-8',
         }
+        post_data = build_order_get_request(order_number_list=order_number_list)
+        try:
+            res = self._api.request_post(url=RakutenOrderAPI.get_url,
+                                         headers=headers,
+                                         data=post_data)
+            if res.status_code != 200:
+                self.log.error('Failed to post request to search order get error=%s', res.text)
+                raise RakutenAPIError('Failed to post request to search order get status not 200')
+        except Exception:
+            self.log.exception('Failed to post request to get order')
+            raise RakutenAPIError('Failed to post request to get order')
+
+        return parse_order_get(res.json())
+
+    def get(self, order_number_list: List[str], chunk_size: int = 100) -> List[OrderData]:
+        # リストを分割
+        order_number_list_n = [order_number_list[i:i + chunk_size]
+                               for i in range(0, len(order_number_list), chunk_size)]
 
         orders = []
         for order_number_list_1 in order_number_list_n:
-            post_data = {
-                'orderNumberList': order_number_list_1,
-                'version': 5,
-            }
-            try:
-                res = self._api.request_post(url=url,
-                                             headers=headers,
-                                             data=json.dumps(post_data).encode('utf-8'))
-                if res.status_code != 200:
-                    self.log.error('Failed to post request to search order get error=%s', res.text)
-                    raise RakutenAPIError('Failed to post request to search order get status not 200')
-            except Exception:
-                self.log.exception('Failed to post request to get order')
-                raise RakutenAPIError('Failed to post request to get order')
-
-            res_json = res.json()
-            for order_model in res_json.get('OrderModelList', []):
-                order_number = order_model['orderNumber']
-                order_progress = order_model['orderProgress']
+            orders.extend(self._get_chunk(order_number_list_1))
 
-                order_items = []
-                for package_model in order_model['PackageModelList']:
-                    for item_model in package_model['ItemModelList']:
-                        item_name = item_model['itemName']
-                        manage_number = item_model['manageNumber']
-                        order_items.append(OrderItemData(item_name=item_name, manage_number=manage_number))
+        return orders
 
-                orders.append(OrderData(order_number=order_number,
-                                        order_progress=order_progress,
-                                        order_items=order_items))
+    def search_and_get(self,
+                       start_datetime: datetime,
+                       end_datetime: datetime,
+                       order_filter: Optional[Callable[[str], bool]] = None,
+                       item_count_per_page: int = 1000,
+                       chunk_size: int = 100,
+                       max_workers: int = const.RMS_ORDER_GET_MAX_WORKERS) -> Iterator[OrderData]:
+        # 注文検索の各ページを取得するごとに、その注文番号の詳細取得を並列で開始し、
+        # 取得できた注文から返す(検索と詳細取得を並行する。順序は検索結果の順)
+        # order_filterがFalseを返した注文番号は詳細を取得しない(同じ注文番号は1度だけ判定する)
+        order_numbers_seen = set()
+        futures = deque()
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            try:
+                for order_numbers, _ in iter_pages(
+                        fetch_page=lambda page: self._search_page(start_datetime=start_datetime,
+                                                                  end_datetime=end_datetime,
+                                                                  item_count_per_page=item_count_per_page,
+                                                                  page=page),
+                        get_total_pages=lambda result: result[1]):
+                    # 取得中に注文が増えるとページがずれて同じ注文が再度含まれるため除外する
+                    order_number_list = []
+                    for order_number in order_numbers:
+                        if order_number in order_numbers_seen:
+                            continue
+                        order_numbers_seen.add(order_number)
+                        if order_filter is None or order_filter(order_number):
+                            order_number_list.append(order_number)
+
+                    for i in range(0, len(order_number_list), chunk_size):
+                        futures.append(executor.submit(self._get_chunk, order_number_list[i:i + chunk_size]))
+
+                    # 取得済みの詳細を返す
+                    while futures and futures[0].done():
+                        yield from futures.popleft().result()
+
+                while futures:
+                    yield from futures.popleft().result()
+            finally:
+                # 途中で終了・失敗した場合は未実行の詳細取得を取り消す
+                for future in futures:
+                    future.cancel()
+
+
+class RakutenInventoryClient:
+    # WSDLの解析結果と型はプロセス内で1度だけ生成して使い回す
+    _instance: Optional['RakutenInventoryClient'] = None
+    _lock = threading.Lock()
+
+    def __init__(self):
+        # zeepはセッションのヘッダー・アダプターを変更するため専用のセッションを使う(接続は同じホストのREST APIと共有)
+        session = create_session(url=RakutenInventoryAPI.endpoint_url, **const.HTTP_POOL_SETTING['rakuten'])
+        transport = Transport(session=session)
+        self.client = zeep.Client(wsdl=const.RMS_WSDL_FILE, transport=transport)
+        self.factory = self.client.type_factory('ns1')
+        self.array_of_string = self.client.get_type('ns0:ArrayOfString')
+        _xsd_types = dict(((t.name, t) for t in self.client.wsdl.types.types))
+        self.update_request_external_item = _xsd_types['UpdateRequestExternalItem']
+        self.external_user_auth_model = self.client.get_type('ns1:ExternalUserAuthModel')(
+            authKey=RakutenAPI.get_authz(),
+            userName="フクワウチ",
+            shopUrl="page-to-sell-a-used",
+        )
 
-        return orders
+    @classmethod
+    def get_instance(cls) -> 'RakutenInventoryClient':
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = cls()
+        return cls._instance
 
 
 class RakutenInventoryAPI:
-    def __init__(self, log: Logger):
+    # SOAPエンドポイント(流量制限のキー)
+    endpoint_url: str = 'https://api.rms.rakuten.co.jp/es/1.0/inventory/ws'
+
+    def __init__(self,
+                 log: Logger,
+                 rate_limiter: Optional[ratelimit.RateLimiter] = None,
+                 circuit_breaker: Optional[circuit.CircuitBreaker] = None):
         self.log = log
-        self._client = zeep.Client(wsdl=const.RMS_WSDL_FILE)
+        self.rate_limiter = rate_limiter
+        self.circuit_breaker = circuit_breaker
+        self._inventory_client = RakutenInventoryClient.get_instance()
+        self._client = self._inventory_client.client
+
+    def _wait_rate_limit(self):
+        if self.circuit_breaker and not self.circuit_breaker.allow_request():
+            raise CircuitOpenError(f'Circuit is open mall={self.circuit_breaker.name}, url={self.endpoint_url}')
+        if self.rate_limiter:
+            self.rate_limiter.acquire(self.endpoint_url)
+
+    def _record_result(self, succeeded: bool):
+        if self.circuit_breaker:
+            if succeeded:
+                self.circuit_breaker.record_success()
+            else:
+                self.circuit_breaker.record_failure()
 
     def get(self, item_urls: List[str], chunk_size: int = 1000):
         # リストを分割
         item_urls_n = [item_urls[i:i + chunk_size] for i in range(0, len(item_urls), chunk_size)]
 
-        external_user_auth_model = self._client.get_type('ns1:ExternalUserAuthModel')(
-            authKey=RakutenAPI.get_authz(),
-            userName="フクワウチ",
-            shopUrl="page-to-sell-a-used",
-        )
-
-        factory = self._client.type_factory('ns1')
-        array_of_string = self._client.get_type('ns0:ArrayOfString')
+        external_user_auth_model = self._inventory_client.external_user_auth_model
+        factory = self._inventory_client.factory
+        array_of_string = self._inventory_client.array_of_string
 
         inventories = []
         for item_urls_1 in item_urls_n:
+            self._wait_rate_limit()
             try:
                 response = self._client.service.getInventoryExternal(
                     externalUserAuthModel=external_user_auth_model,
                     getRequestExternalModel=factory.GetRequestExternalModel(
                         itemUrl=array_of_string(item_urls_1)))
-                # N00-000:正常終了 W00-201:商品エラーがあります E00-202:商品データがありません
-                if response.errCode != 'N00-000':
-                    continue
             except Exception:
+                self._record_result(succeeded=False)
                 self.log.exception('Failed to get inventory')
                 raise RakutenAPIError('Failed to get inventory')
+            self._record_result(succeeded=True)
+
+            # N00-000:正常終了 W00-201:商品エラーがあります E00-202:商品データがありません
+            if response.errCode != 'N00-000':
+                continue
 
             get_external_item_array = getattr(response, 'getResponseExternalItem', None)
             get_external_item = getattr(get_external_item_array, 'GetResponseExternalItem', None)
@@ -341,8 +445,12 @@ class RakutenInventoryAPI:
         return inventories
 
     def update(self, update_items: List[InventoryUpdateData]) -> List[InventoryUpdateErrorResponseItemData]:
-        _xsd_types = _xsd_types = dict(((t.name, t) for t in self._client.wsdl.types.types))
-        update_request_external_item = _xsd_types['UpdateRequestExternalItem']
+        return list(self.update_result(update_items=update_items).error_items)
+
+    def update_result(self, update_items: List[InventoryUpdateData]) -> InventoryUpdateResultData:
+        # 全体の処理結果コードと、商品ごとのエラーを返す
+        # (正常終了以外で商品ごとのエラーが返らない場合、更新できたかは不明)
+        update_request_external_item = self._inventory_client.update_request_external_item
 
         update_request_items = []
         for item in update_items:
@@ -365,35 +473,214 @@ class RakutenInventoryAPI:
             )
             update_request_items.append(update_request)
 
-        factory = self._client.type_factory('ns1')
-        external_user_auth_model = self._client.get_type('ns1:ExternalUserAuthModel')(
-            authKey=RakutenAPI.get_authz(),
-            userName="フクワウチ",
-            shopUrl="page-to-sell-a-used",
-        )
+        factory = self._inventory_client.factory
+        external_user_auth_model = self._inventory_client.external_user_auth_model
+        self._wait_rate_limit()
         try:
             response = self._client.service.updateInventoryExternal(
                 externalUserAuthModel=external_user_auth_model,
                 updateRequestExternalModel=factory.UpdateRequestExternalModel(
                     factory.ArrayOfUpdateRequestExternalItem(update_request_items)))
         except Exception:
+            self._record_result(succeeded=False)
             self.log.exception('Failed to update inventory')
             raise RakutenAPIError('Failed to update inventory')
+        self._record_result(succeeded=True)
 
         # N00-000:正常終了
         if response.errCode == 'N00-000':
-            return []
+            return InventoryUpdateResultData(err_code=response.errCode, error_items=())
 
         update_response_external_model = getattr(response, 'updateResponseExternalItem', None)
         update_response_external_item = getattr(update_response_external_model, 'UpdateResponseExternalItem', None)
-        if not update_response_external_item:
-            return []
+        error_items = tuple(InventoryUpdateErrorResponseItemData(item_url=item.itemUrl,
+                                                                 error_code=item.itemErrCode,
+                                                                 error_message=item.itemErrMessage)
+                            for item in update_response_external_item or [])
+        return InventoryUpdateResultData(err_code=response.errCode, error_items=error_items)
+
+
+class AsyncRakutenAPI:
+    # RakutenAPIの非同期版(結果のデータは同期版と同じ)
+    def __init__(self,
+                 log: Logger,
+                 retry_total: int = 5,
+                 backoff_factor: int = 2,
+                 connect_timeout: float = 30.0,
+                 read_timeout: float = 60.0,
+                 max_concurrency: int = const.ASYNC_API_MAX_CONCURRENCY):
+        rate_limiter = ratelimit.get_rate_limiter('rakuten')
+        circuit_breaker = circuit.get_circuit_breaker('rakuten')
+        self.api = AsyncAPIRequests(retry_total=retry_total,
+                                    backoff_factor=backoff_factor,
+                                    connect_timeout=connect_timeout,
+                                    read_timeout=read_timeout,
+                                    rate_limiter=rate_limiter,
+                                    circuit_breaker=circuit_breaker,
+                                    max_concurrency=max_concurrency,
+                                    **const.HTTP_POOL_SETTING['rakuten'])
+
+        # 商品API
+        self.item = AsyncRakutenItemAPI(api=self.api, log=log)
+        # 注文API
+        self.order = AsyncRakutenOrderAPI(api=self.api, log=log)
+        # 在庫API(SOAPは同期版をスレッドで実行する)
+        self.inventory = AsyncRakutenInventoryAPI(api=self.api,
+                                                  inventory=RakutenInventoryAPI(log=log,
+                                                                                rate_limiter=rate_limiter,
+                                                                                circuit_breaker=circuit_breaker))
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self.api.close()
+
+    def reset(self):
+        # 接続を破棄し、次のリクエストで再接続する
+        self.api.reset()
+
+
+class AsyncRakutenItemAPI:
+    def __init__(self, api: AsyncAPIRequests, log: Logger):
+        self._api = api
+        self.log = log
+
+    async def get(self, item_url: str) -> Optional[RakutenApiGetItemData]:
+        headers = {
+            'Authorization': RakutenAPI.get_authz(),
+            'Content-Type': 'application/json; charset=utf-8',
+        }
+        payload = {
+            "itemUrl": item_url
+        }
+        try:
+            url = 'https://api.rms.rakuten.co.jp/es/1.0/item/get'
+            response = await self._api.request_get(url=url,
+                                                   headers=headers,
+                                                   payload=payload)
+            if response.status_code != 200:
+                self.log.error('Failed to post request to item get error=%s', response.text)
+                raise RakutenAPIError('Failed to post request to item get status not 200')
+        except Exception:
+            self.log.exception('Failed to get request to get item')
+            raise RakutenAPIError('Failed to get request to get item')
+
+        return parse_item_get(response.content)
+
+    async def update(self, item_url: str, inventory_count: int) -> bool:
+        data = build_item_update_request(item_url=item_url, inventory_count=inventory_count)
+        headers = {
+            'Authorization': RakutenAPI.get_authz(),
+            'content-type': 'text/xml; charset=utf-8',
+        }
+        try:
+            url = 'https://api.rms.rakuten.co.jp/es/1.0/item/update'
+            res = await self._api.request_post(url=url,
+                                               headers=headers,
+                                               data=data)
+            if res.status_code != 200:
+                self.log.error('Failed to post request to item update error=%s', res.text)
+                raise RakutenAPIError('Failed to post request to item update status not 200')
+        except Exception:
+            self.log.exception('Failed to post request to update item')
+            raise RakutenAPIError('Failed to post request to update item')
+
+        status_code = parse_item_update(res.content)
+        if status_code == 'N000':
+            return False
+        return True
+
+
+class AsyncRakutenOrderAPI:
+    def __init__(self, api: AsyncAPIRequests, log: Logger):
+        self._api = api
+        self.log = log
+
+    async def _search_page(self,
+                           start_datetime: datetime,
+                           end_datetime: datetime,
+                           item_count_per_page: int,
+                           page: int) -> Tuple[List[str], int]:
+        headers = {
+            'Authorization': RakutenAPI.get_authz(),
+            'content-type': 'application/json; charset=utf-8',
+        }
+        post_data = build_order_search_request(start_datetime=start_datetime,
+                                               end_datetime=end_datetime,
+                                               item_count_per_page=item_count_per_page,
+                                               page=page)
+        try:
+            res = await self._api.request_post(url=RakutenOrderAPI.search_url,
+                                               headers=headers,
+                                               data=post_data)
+            if res.status_code != 200:
+                self.log.error('Failed to post request to search order list error=%s', res.text)
+                raise RakutenAPIError('Failed to post request to search order list status not 200')
+        except Exception:
+            self.log.exception('Failed to post request to search order list')
+            raise RakutenAPIError('Failed to post request to search order list')
+
+        return parse_order_search(res.json())
+
+    async def search(self,
+                     start_datetime: datetime,
+                     end_datetime: datetime,
+                     item_count_per_page: int = 1000) -> List[str]:
+        # 1ページ目で総ページ数を取得し、残りのページは同時に取得する(結果はページ順)
+        pages = await gather_pages(fetch_page=lambda page: self._search_page(start_datetime=start_datetime,
+                                                                             end_datetime=end_datetime,
+                                                                             item_count_per_page=item_count_per_page,
+                                                                             page=page),
+                                   get_total_pages=lambda result: result[1])
+
+        order_numbers = []
+        for order_numbers_1, _ in pages:
+            order_numbers.extend(order_numbers_1)
+
+        return order_numbers
+
+    async def _get_chunk(self, order_number_list: List[str]) -> List[OrderData]:
+        headers = {
+            'Authorization': RakutenAPI.get_authz(),
+            'content-type': 'application/json; charset=utf-8',
+        }
+        post_data = build_order_get_request(order_number_list=order_number_list)
+        try:
+            res = await self._api.request_post(url=RakutenOrderAPI.get_url,
+                                               headers=headers,
+                                               data=post_data)
+            if res.status_code != 200:
+                self.log.error('Failed to post request to search order get error=%s', res.text)
+                raise RakutenAPIError('Failed to post request to search order get status not 200')
+        except Exception:
+            self.log.exception('Failed to post request to get order')
+            raise RakutenAPIError('Failed to post request to get order')
+
+        return parse_order_get(res.json())
+
+    async def get(self, order_number_list: List[str], chunk_size: int = 100) -> List[OrderData]:
+        # 分割したリストを同時に取得する(結果は指定順)
+        order_number_list_n = [order_number_list[i:i + chunk_size]
+                               for i in range(0, len(order_number_list), chunk_size)]
+        chunks = await asyncio.gather(*(self._get_chunk(order_number_list_1)
+                                        for order_number_list_1 in order_number_list_n))
+        return [order for orders in chunks for order in orders]
+
+
+class AsyncRakutenInventoryAPI:
+    def __init__(self, api: AsyncAPIRequests, inventory: RakutenInventoryAPI):
+        self._api = api
+        self._inventory = inventory
+
+    async def get(self, item_urls: List[str], chunk_size: int = 1000) -> List[InventoryData]:
+        return await self._api.run(self._inventory.get, item_urls=item_urls, chunk_size=chunk_size)
 
-        error_items = []
-        for item in update_response_external_item:
-            error_items.append(
-                InventoryUpdateErrorResponseItemData(item_url=item.itemUrl,
-                                                     error_code=item.itemErrCode,
-                                                     error_message=item.itemErrMessage))
+    async def update(self, update_items: List[InventoryUpdateData]) -> List[InventoryUpdateErrorResponseItemData]:
+        return await self._api.run(self._inventory.update, update_items=update_items)
 
-        return error_items
+    async def update_result(self, update_items: List[InventoryUpdateData]) -> InventoryUpdateResultData:
+        return await self._api.run(self._inventory.update_result, update_items=update_items)
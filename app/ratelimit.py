@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import json
+import threading
+import time
+import urllib.parse
+from typing import Dict, Optional, Tuple
+
+import const
+from utils import FileLock
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+
+        self._tokens = float(burst)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens: float = 1.0) -> float:
+        # トークンを消費し、送信可能になるまでの待機秒数を返す(不足分は前借りする)
+        if self.rate <= 0:
+            return 0.0
+
+        with self._lock:
+            now = time.monotonic()
+            # 前回から経過した時間分(リクエスト処理時間を含む)を補充
+            self._tokens = min(float(self.burst), self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            self._tokens -= tokens
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def acquire(self, tokens: float = 1.0) -> float:
+        wait = self.reserve(tokens=tokens)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+class FileTokenBucket(TokenBucket):
+    # 複数プロセスで共有するトークンバケット(状態をファイルに保存する)
+    def __init__(self, rate: float, burst: int, state_file: str):
+        super().__init__(rate=rate, burst=burst)
+        self.state_file = state_file
+        self._file_lock = FileLock(lock_file=f'{state_file}.lock')
+
+    def _load_state(self, now: float) -> Tuple[float, float]:
+        try:
+            with open(self.state_file) as f:
+                data = json.load(f)
+            return float(data['tokens']), float(data['updated_at'])
+        except Exception:
+            # 未作成・破損時は満タンから開始
+            return float(self.burst), now
+
+    def _save_state(self, tokens: float, updated_at: float):
+        with open(self.state_file, 'w') as f:
+            json.dump({'tokens': tokens, 'updated_at': updated_at}, f)
+
+    def reserve(self, tokens: float = 1.0) -> float:
+        if self.rate <= 0:
+            return 0.0
+
+        with self._lock, self._file_lock:
+            # プロセス間で共有するため壁時計を使用
+            now = time.time()
+            tokens_, updated_at = self._load_state(now)
+            tokens_ = min(float(self.burst), tokens_ + max(0.0, now - updated_at) * self.rate)
+            tokens_ -= tokens
+            self._save_state(tokens=tokens_, updated_at=now)
+
+        if tokens_ >= 0:
+            return 0.0
+        return -tokens_ / self.rate
+
+
+class RateLimiter:
+    def __init__(self,
+                 name: str,
+                 rate: float,
+                 burst: int,
+                 per_endpoint: bool = True,
+                 shared: bool = False,
+                 state_dir: Optional[str] = None):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.per_endpoint = per_endpoint
+        self.shared = shared
+        self.state_dir = state_dir
+
+        self._buckets: Dict[Tuple[str, str], TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, url: str) -> Tuple[str, str]:
+        url_p = urllib.parse.urlsplit(url)
+        # エンドポイント単位で制限しない場合はホスト単位
+        path = url_p.path.rstrip('/') if self.per_endpoint else ''
+        return url_p.netloc, path
+
+    def _state_file(self, key: Tuple[str, str]) -> str:
+        filename = re.sub(r'[^0-9A-Za-z_.-]', '_', '_'.join((self.name, *key)))
+        return os.path.join(self.state_dir, f'{filename}.json')
+
+    def bucket(self, url: str) -> TokenBucket:
+        key = self._key(url)
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if self.shared:
+                    bucket = FileTokenBucket(rate=self.rate,
+                                             burst=self.burst,
+                                             state_file=self._state_file(key))
+                else:
+                    bucket = TokenBucket(rate=self.rate, burst=self.burst)
+                self._buckets[key] = bucket
+        return bucket
+
+    def reserve(self, url: str) -> float:
+        return self.bucket(url).reserve()
+
+    def acquire(self, url: str) -> float:
+        return self.bucket(url).acquire()
+
+
+# モール単位でプロセス内共有
+_rate_limiters: Dict[str, RateLimiter] = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(mall: str) -> RateLimiter:
+    with _rate_limiters_lock:
+        rate_limiter = _rate_limiters.get(mall)
+        if rate_limiter is None:
+            rate_limiter = RateLimiter(name=mall, **const.RATE_LIMIT_SETTING[mall])
+            _rate_limiters[mall] = rate_limiter
+    return rate_limiter
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Optional
+
+import const
+from utils import FileLock, FileLockTimeout, write_json_atomic
+
+
+class ScanStateError(Exception):
+    pretext = ''
+
+    def __init__(self, message, *args):
+        if self.pretext:
+            message = f"{self.pretext}: {message}"
+        super().__init__(message, *args)
+
+
+@dataclass
+class ScanState:
+    last_scan_time: Optional[datetime] = None
+    # 処理済み注文ID: 処理日時
+    processed_order_ids: Dict[str, datetime] = field(default_factory=dict)
+
+    def get_start_time(self,
+                       end_time: datetime,
+                       last_days: int = const.ORDER_LIST_GET_LAST_DAYS,
+                       overlap_minutes: int = const.ORDER_SCAN_OVERLAP_MINUTES) -> datetime:
+        # 前回取得時刻から重複期間分さかのぼる(最大でx日前まで)
+        start_time = end_time - timedelta(days=last_days)
+        if self.last_scan_time:
+            start_time = max(start_time, self.last_scan_time - timedelta(minutes=overlap_minutes))
+        return start_time
+
+    def is_processed(self, order_id) -> bool:
+        return str(order_id) in self.processed_order_ids
+
+    def update(self,
+               scan_time: datetime,
+               order_ids: Iterable,
+               last_days: int = const.ORDER_LIST_GET_LAST_DAYS):
+        self.last_scan_time = scan_time
+        for order_id in order_ids:
+            self.processed_order_ids[str(order_id)] = scan_time
+
+        # 取得期間を過ぎた注文IDは削除
+        expire_time = scan_time - timedelta(days=last_days + 1)
+        self.processed_order_ids = {
+            order_id: processed_time for order_id, processed_time in self.processed_order_ids.items()
+            if processed_time >= expire_time
+        }
+
+    def merge(self, other: 'ScanState') -> 'ScanState':
+        # 同一モールの他のプロデューサーが先に保存した状態と合わせる(取得時刻は新しい方)
+        last_scan_times = [t for t in (self.last_scan_time, other.last_scan_time) if t]
+        processed_order_ids = dict(other.processed_order_ids)
+        for order_id, processed_time in self.processed_order_ids.items():
+            processed_order_ids[order_id] = max(processed_time, processed_order_ids.get(order_id, processed_time))
+        return ScanState(last_scan_time=max(last_scan_times) if last_scan_times else None,
+                         processed_order_ids=processed_order_ids)
+
+
+class ScanStateStore:
+    # モールごとの注文取得状態(ハイウォーターマーク)を保存する
+    # 状態ファイルの読み書きのみロックする(注文取得・送信中はロックしない)
+    def __init__(self,
+                 mall: str,
+                 state_dir: str = const.SCAN_STATE_DIR,
+                 lock_timeout: float = const.SCAN_STATE_LOCK_TIMEOUT):
+        filename = f'scan_state_{mall}.json' if const.IS_PRODUCTION else f'scan_state_{mall}_test.json'
+        self.state_file = os.path.join(state_dir, filename)
+        self._file_lock = FileLock(lock_file=f'{self.state_file}.lock', timeout=lock_timeout)
+
+    @contextmanager
+    def _lock(self):
+        try:
+            self._file_lock.acquire()
+        except FileLockTimeout:
+            raise ScanStateError(f'Failed to lock scan state file={self.state_file}')
+        try:
+            yield
+        finally:
+            self._file_lock.release()
+
+    def load(self) -> ScanState:
+        with self._lock():
+            return self._load()
+
+    def _load(self) -> ScanState:
+        if not os.path.exists(self.state_file):
+            return ScanState()
+
+        try:
+            with open(self.state_file, encoding='utf-8') as f:
+                data = json.load(f)
+            last_scan_time = data.get('last_scan_time')
+            return ScanState(
+                last_scan_time=datetime.fromisoformat(last_scan_time) if last_scan_time else None,
+                processed_order_ids={
+                    order_id: datetime.fromisoformat(processed_time)
+                    for order_id, processed_time in data.get('processed_order_ids', {}).items()
+                })
+        except Exception:
+            # 破損している場合は初期状態(x日前から全件取得)
+            return ScanState()
+
+    def save(self, scan_state: ScanState):
+        # 読み込み後に他のプロデューサーが保存した状態を上書きしないよう、保存済みの状態と合わせて保存する
+        with self._lock():
+            scan_state = scan_state.merge(self._load())
+            self._save(scan_state)
+
+    def _save(self, scan_state: ScanState):
+        data = {
+            'last_scan_time': scan_state.last_scan_time.isoformat() if scan_state.last_scan_time else None,
+            'processed_order_ids': {
+                order_id: processed_time.isoformat()
+                for order_id, processed_time in scan_state.processed_order_ids.items()
+            },
+        }
+        try:
+            write_json_atomic(self.state_file, data)
+        except Exception:
+            raise ScanStateError(f'Failed to save scan state file={self.state_file}')
@@ -2,7 +2,7 @@
 
 import argparse
 from datetime import datetime
-from typing import Dict
+from typing import Dict, List
 import functools
 
 import const
@@ -10,27 +10,43 @@ from logging import Logger
 import logger
 from mq import MQ, MQMsgData
 import auapi
+from ledger import StockoutLedger
 
 
-def _stockout(msg_data: MQMsgData, log: Logger):
-    set_list = []
-    item_ids = msg_data.item_ids
-    for item_id in item_ids:
-        set_data = auapi.AuUpdateStockData(item_code=item_id, stock_count=0)
-        set_list.append(set_data)
+def _stockout(item_ids: List[str], api: auapi.AuAPI, log: Logger):
+    # 重複を除く(旧形式のメッセージは注文明細ごとの商品IDを含む)
+    item_ids = list(dict.fromkeys(item_ids))
+    with StockoutLedger() as ledger:
+        # 在庫0に更新済みの商品は除外
+        target_item_ids = ledger.filter_not_zeroed(mall='au', item_codes=item_ids)
+        if not target_item_ids:
+            log.info('N/A update stock data due to already out of stock items=%s', item_ids)
+            return
+
+        set_list = []
+        for item_id in target_item_ids:
+            set_data = auapi.AuUpdateStockData(item_code=item_id, stock_count=0)
+            set_list.append(set_data)
 
-    with auapi.AuAPI(log=log) as api:
         try:
             log.info('Request to stock out list=%s', set_list)
             result = api.stock.update(update_items=set_list)
         except Exception:
             log.exception('Failed to update stock')
+            # 接続を破棄し、次のメッセージで再接続する
+            api.reset()
             raise
-    log.info('Updated stock items=%s', set_list)
-    log.info('Not updated stock items=%s', result)
+        log.info('Updated stock items=%s', set_list)
+        log.info('Not updated stock items=%s', result)
+
+        # 在庫0に更新できた商品を記録
+        error_item_codes = {error_data.item_code for error_data in result}
+        ledger.record(mall='au',
+                      item_codes={set_data.item_code for set_data in set_list
+                                  if set_data.item_code not in error_item_codes})
 
 
-def _relist_on_message(msg: Dict, log: Logger) -> bool:
+def _relist_on_message(msg: Dict, api: auapi.AuAPI, log: Logger) -> bool:
     log.info('Message data=%s', logger.var_dump(msg))
     try:
         msg_data = MQMsgData(**msg)
@@ -38,18 +54,40 @@ def _relist_on_message(msg: Dict, log: Logger) -> bool:
         raise Exception('Receive message parse error')
     log.info('Get queue message data=%s', msg_data)
 
-    _stockout(msg_data=msg_data, log=log)
+    _stockout(item_ids=msg_data.item_ids, api=api, log=log)
+    return True
+
+
+def _relist_on_messages(msgs: List[Dict], api: auapi.AuAPI, log: Logger) -> bool:
+    item_ids = []
+    for msg in msgs:
+        log.info('Message data=%s', logger.var_dump(msg))
+        try:
+            msg_data = MQMsgData(**msg)
+        except Exception:
+            raise Exception('Receive message parse error')
+        log.info('Get queue message data=%s', msg_data)
+        item_ids.extend(msg_data.item_ids)
+
+    # 重複を除いてまとめて在庫更新
+    _stockout(item_ids=list(dict.fromkeys(item_ids)), api=api, log=log)
     return True
 
 
 def _consumer(log: Logger):
     try:
-        with MQ(**const.MQ_CONNECT,
-                queue=const.MQ_AU_QUEUE,
-                routing_key=const.MQ_AU_ROUTING_KEY) as queue:
+        # APIは常駐中使い回す
+        with auapi.AuAPI(log=log) as api, \
+                MQ(**const.MQ_CONNECT,
+                   queue=const.MQ_AU_QUEUE,
+                   routing_key=const.MQ_AU_ROUTING_KEY) as queue:
             queue.open()
-            callback = functools.partial(_relist_on_message, log=log)
-            queue.receive_message(callback)
+            if const.MQ_CONSUMER_BATCH_SIZE > 1:
+                callback = functools.partial(_relist_on_messages, api=api, log=log)
+                queue.receive_message_batch(callback)
+            else:
+                callback = functools.partial(_relist_on_message, api=api, log=log)
+                queue.receive_message(callback)
 
     except Exception:
         log.exception('Failed to MQ connect')
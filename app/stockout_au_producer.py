@@ -1,44 +1,56 @@
 # -*- coding: utf-8 -*-
 
 import argparse
-from datetime import datetime, timedelta
+from datetime import datetime
 from dataclasses import asdict
-from typing import List
-import uuid
+from typing import Iterator, List, Tuple
+import functools
 
 import const
 from logging import Logger
 import logger
-from mq import MQ, MQMsgData
+from mq import MQ, MQMsgData, MQError, close_connections, process_connections
 import auapi
+from state import ScanState, ScanStateStore
+import daemon
 
 
 def _send_msg(send_data: MQMsgData,
-              queue_name: str,
-              routing_key: str,
+              targets: List[Tuple[str, str]],
               log: Logger):
     try:
-        with MQ(**const.MQ_CONNECT,
-                queue=queue_name,
-                routing_key=routing_key) as queue:
+        # 1つの接続・チャネルで各キューへ送信
+        with MQ(**const.MQ_CONNECT, pooled=True) as queue:
             msg = asdict(send_data)
-            queue.send_message(message=msg)
-            log.info('Send message queue=%(queue)s, data=%(data)s', {'queue': queue_name, 'data': msg})
+            for queue_name, routing_key in targets:
+                queue.bind(queue=queue_name, routing_key=routing_key)
+            # 全キューへ送信してから、送信できなかったものを確認する
+            failures = queue.send_messages(messages=[msg],
+                                           routing_keys=[routing_key for _queue_name, routing_key in targets])
+            if failures:
+                raise MQError(f'Failed to publish message failures={failures}')
+            for queue_name, _routing_key in targets:
+                log.info('Send message queue=%(queue)s, data=%(data)s', {'queue': queue_name, 'data': msg})
     except Exception:
         log.exception('Failed to send mq message error')
         raise
 
 
-def _get_order_item_id_list(log: Logger) -> List[str]:
-    end_time = datetime.now()
-    start_time = end_time - timedelta(days=const.ORDER_LIST_GET_LAST_DAYS)
-
-    with auapi.AuAPI(log=log) as api:
-        log.info('Request to get order')
-        orders = api.trade.search(start_time=start_time, end_time=end_time)
-
+def _iter_order_item_ids(start_time: datetime,
+                         end_time: datetime,
+                         scan_state: ScanState,
+                         api: auapi.AuAPI,
+                         log: Logger) -> Iterator[Tuple[List[str], List[int]]]:
+    # 注文検索の1ページごとに(商品IDリスト, 注文IDリスト)を返す
+    log.info('Request to get order start_time=%s, end_time=%s', start_time, end_time)
+    for orders in api.trade.search_pages(start_time=start_time, end_time=end_time):
         item_ids = []
+        order_ids = []
         for order in orders:
+            # 処理済みの注文は除外
+            if scan_state.is_processed(order.order_id):
+                continue
+
             order_status = order.order_status
             # 受注ステータスを確認
             if order_status not in ['新規受付', '発送前入金待ち', '与信待ち', '発送待ち', '発送後入金待ち', '完了',
@@ -48,34 +60,58 @@ def _get_order_item_id_list(log: Logger) -> List[str]:
                 # 各種カスタムステータス（受注管理で貴店舗が登録したステータス名）
                 # 不正取引審査中
                 # キャンセル受付中
+                # 審査中・カスタムステータスの注文は後で連動対象のステータスになることがあるため、処理済みにせず次回も確認する
                 continue
 
+            order_ids.append(order.order_id)
             for detail in order.details:
                 item_ids.append(detail.item_code)
 
-    log.info('Get order list: order_list=%s', item_ids)
-    return item_ids
-
+        log.info('Get order list: order_list=%s', item_ids)
+        yield item_ids, order_ids
 
-def _producer(log: Logger):
-    item_ids = _get_order_item_id_list(log=log)
-    if not item_ids:
-        return
 
-    send_data = MQMsgData(id=str(uuid.uuid4()),
-                          item_ids=item_ids,
-                          msg_send_time=datetime.now().isoformat())
-    log.info('Send MQ')
-    # Yahoo!ショッピング
-    _send_msg(send_data=send_data,
-              queue_name=const.MQ_YSHOP_QUEUE,
-              routing_key=const.MQ_YSHOP_ROUTING_KEY,
-              log=log)
-    # 楽天
-    _send_msg(send_data=send_data,
-              queue_name=const.MQ_RAKUTEN_QUEUE,
-              routing_key=const.MQ_RAKUTEN_ROUTING_KEY,
-              log=log)
+def _producer(api: auapi.AuAPI, log: Logger):
+    state_store = ScanStateStore(mall='au')
+    scan_state = state_store.load()
+    end_time = datetime.now()
+    start_time = scan_state.get_start_time(end_time=end_time)
+
+    # 次のページを取得する前に、取得済みのページ分を送信する
+    order_ids = []
+    for item_ids, order_ids_1 in _iter_order_item_ids(start_time=start_time,
+                                                      end_time=end_time,
+                                                      scan_state=scan_state,
+                                                      api=api,
+                                                      log=log):
+        order_ids.extend(order_ids_1)
+        if not item_ids:
+            continue
+
+        send_data = MQMsgData.create(item_ids=item_ids)
+        log.info('Send MQ')
+        _send_msg(send_data=send_data,
+                  targets=[
+                      # Yahoo!ショッピング
+                      (const.MQ_YSHOP_QUEUE, const.MQ_YSHOP_ROUTING_KEY),
+                      # 楽天
+                      (const.MQ_RAKUTEN_QUEUE, const.MQ_RAKUTEN_ROUTING_KEY),
+                  ],
+                  log=log)
+
+    # 全ページの送信完了後に取得状態を更新
+    scan_state.update(scan_time=end_time, order_ids=order_ids)
+    state_store.save(scan_state)
+
+
+def _daemon(log: Logger):
+    # APIの接続・MQ接続を保持したまま定期実行する
+    with auapi.AuAPI(log=log) as api:
+        daemon.run(task=functools.partial(_producer, api=api, log=log),
+                   interval=const.PRODUCER_POLL_INTERVAL,
+                   log=log,
+                   on_idle=process_connections,
+                   on_error=api.reset)
 
 
 def main():
@@ -84,6 +120,9 @@ def main():
                         required=True,
                         type=int,
                         help='input process No type integer')
+    parser.add_argument('--daemon',
+                        action='store_true',
+                        help='run periodically until stopped')
 
     arg_parser = parser.parse_args()
     log = logger.get_logger(task_name='stockout-au-producer',
@@ -92,9 +131,16 @@ def main():
                             task_no=arg_parser.task_no,
                             **const.LOG_SETTING)
     log.info('Start task')
-    log.info('Input args task_no=%s', arg_parser.task_no)
+    log.info('Input args task_no=%s, daemon=%s', arg_parser.task_no, arg_parser.daemon)
 
-    _producer(log=log)
+    try:
+        if arg_parser.daemon:
+            _daemon(log=log)
+        else:
+            with auapi.AuAPI(log=log) as api:
+                _producer(api=api, log=log)
+    finally:
+        close_connections()
     log.info('End task')
 
 
@@ -2,7 +2,7 @@
 
 import argparse
 from datetime import datetime
-from typing import Dict
+from typing import Dict, List
 import functools
 
 import const
@@ -10,41 +10,64 @@ from logging import Logger
 import logger
 from mq import MQ, MQMsgData
 import rapi
+from ledger import StockoutLedger
 
 
-def _stockout(msg_data: MQMsgData, log: Logger):
-    item_ids = msg_data.item_ids
-    with rapi.RakutenAPI(log=log) as api:
+def _stockout(item_ids: List[str], api: rapi.RakutenAPI, log: Logger):
+    # 重複を除く(旧形式のメッセージは注文明細ごとの商品IDを含む)
+    item_ids = list(dict.fromkeys(item_ids))
+    with StockoutLedger() as ledger:
+        # 在庫0に更新済みの商品は除外
+        target_item_ids = ledger.filter_not_zeroed(mall='rakuten', item_codes=item_ids)
+        if not target_item_ids:
+            log.info('N/A update stock data due to already out of stock items=%s', item_ids)
+            return
+
         try:
-            log.info('Request to get inventory')
-            inventories = api.inventory.get(item_urls=item_ids)
-        except Exception:
-            raise Exception('stockout error')
-
-        set_list = []
-        for inventory_data in inventories:
-            log.info('Inventory item data=%s', inventory_data)
-            if inventory_data.inventory_count > 0:
-                log.info('Out of stock item id=%s', inventory_data.item_url)
-                set_data = rapi.InventoryUpdateData(item_url=inventory_data.item_url,
-                                                    inventory_count=0)
-                set_list.append(set_data)
-
-        if set_list:
             try:
-                log.info('Request to stock out list=%s', set_list)
-                result = api.inventory.update(update_items=set_list)
+                log.info('Request to get inventory')
+                inventories = api.inventory.get(item_urls=target_item_ids)
             except Exception:
-                log.exception('Failed to update stock')
                 raise Exception('stockout error')
-            log.info('Updated stock items=%s', set_list)
-            log.info('Not updated stock items=%s', result)
-            return
 
-        log.info('N/A update stock data')
+            set_list = []
+            # 在庫0を確認できた商品
+            zeroed_item_urls = set()
+            for inventory_data in inventories:
+                log.info('Inventory item data=%s', inventory_data)
+                if inventory_data.inventory_count > 0:
+                    log.info('Out of stock item id=%s', inventory_data.item_url)
+                    set_data = rapi.InventoryUpdateData(item_url=inventory_data.item_url,
+                                                        inventory_count=0)
+                    set_list.append(set_data)
+                elif inventory_data.inventory_count == 0:
+                    zeroed_item_urls.add(inventory_data.item_url)
+
+            if set_list:
+                try:
+                    log.info('Request to stock out list=%s', set_list)
+                    result = api.inventory.update_result(update_items=set_list)
+                except Exception:
+                    log.exception('Failed to update stock')
+                    raise Exception('stockout error')
+                log.info('Updated stock items=%s', set_list)
+                log.info('Not updated stock items=%s, err_code=%s', result.error_items, result.err_code)
+                # 正常終了(全件更新済み)の場合のみ記録する
+                # 一部エラー・商品ごとの結果が無いエラーは、更新できたか不明なため記録しない(次回も在庫を確認する)
+                if result.succeeded:
+                    zeroed_item_urls.update(set_data.item_url for set_data in set_list)
+            else:
+                log.info('N/A update stock data')
+        except Exception:
+            # 接続を破棄し、次のメッセージで再接続する
+            api.reset()
+            raise
+
+        # 在庫0を確認・更新できた商品を記録
+        ledger.record(mall='rakuten', item_codes=zeroed_item_urls)
 
 
-def _relist_on_message(msg: Dict, log: Logger) -> bool:
+def _relist_on_message(msg: Dict, api: rapi.RakutenAPI, log: Logger) -> bool:
     log.info('Message data=%s', logger.var_dump(msg))
     try:
         msg_data = MQMsgData(**msg)
@@ -52,18 +75,40 @@ def _relist_on_message(msg: Dict, log: Logger) -> bool:
         raise Exception('Receive message parse error')
     log.info('Get queue message data=%s', msg_data)
 
-    _stockout(msg_data=msg_data, log=log)
+    _stockout(item_ids=msg_data.item_ids, api=api, log=log)
+    return True
+
+
+def _relist_on_messages(msgs: List[Dict], api: rapi.RakutenAPI, log: Logger) -> bool:
+    item_ids = []
+    for msg in msgs:
+        log.info('Message data=%s', logger.var_dump(msg))
+        try:
+            msg_data = MQMsgData(**msg)
+        except Exception:
+            raise Exception('Receive message parse error')
+        log.info('Get queue message data=%s', msg_data)
+        item_ids.extend(msg_data.item_ids)
+
+    # 重複を除いてまとめて在庫更新
+    _stockout(item_ids=list(dict.fromkeys(item_ids)), api=api, log=log)
     return True
 
 
 def _consumer(log: Logger):
     try:
-        with MQ(**const.MQ_CONNECT,
-                queue=const.MQ_RAKUTEN_QUEUE,
-                routing_key=const.MQ_RAKUTEN_ROUTING_KEY) as queue:
+        # APIは常駐中使い回す
+        with rapi.RakutenAPI(log=log) as api, \
+                MQ(**const.MQ_CONNECT,
+                   queue=const.MQ_RAKUTEN_QUEUE,
+                   routing_key=const.MQ_RAKUTEN_ROUTING_KEY) as queue:
             queue.open()
-            callback = functools.partial(_relist_on_message, log=log)
-            queue.receive_message(callback)
+            if const.MQ_CONSUMER_BATCH_SIZE > 1:
+                callback = functools.partial(_relist_on_messages, api=api, log=log)
+                queue.receive_message_batch(callback)
+            else:
+                callback = functools.partial(_relist_on_message, api=api, log=log)
+                queue.receive_message(callback)
 
     except Exception:
         log.exception('Failed to MQ connect')
@@ -1,89 +1,122 @@
 # -*- coding: utf-8 -*-
 
 import argparse
-from datetime import datetime, timedelta
+from datetime import datetime
 from dataclasses import asdict
-from typing import List
-import uuid
+from typing import List, Tuple
+import functools
 
 import const
 from logging import Logger
 import logger
-from mq import MQ, MQMsgData
+from mq import MQ, MQMsgData, MQError, close_connections, process_connections
 import rapi
+from state import ScanState, ScanStateStore
+import daemon
 
 
 def _send_msg(send_data: MQMsgData,
-              queue_name: str,
-              routing_key: str,
+              targets: List[Tuple[str, str]],
               log: Logger):
     try:
-        with MQ(**const.MQ_CONNECT,
-                queue=queue_name,
-                routing_key=routing_key) as queue:
+        # 1つの接続・チャネルで各キューへ送信
+        with MQ(**const.MQ_CONNECT, pooled=True) as queue:
             msg = asdict(send_data)
-            queue.send_message(message=msg)
-            log.info('Send message queue=%(queue)s, data=%(data)s', {'queue': queue_name, 'data': msg})
+            for queue_name, routing_key in targets:
+                queue.bind(queue=queue_name, routing_key=routing_key)
+            # 全キューへ送信してから、送信できなかったものを確認する
+            failures = queue.send_messages(messages=[msg],
+                                           routing_keys=[routing_key for _queue_name, routing_key in targets])
+            if failures:
+                raise MQError(f'Failed to publish message failures={failures}')
+            for queue_name, _routing_key in targets:
+                log.info('Send message queue=%(queue)s, data=%(data)s', {'queue': queue_name, 'data': msg})
     except Exception:
         log.exception('Failed to send mq message error')
         raise
 
 
-def _get_order_item_id_list(log: Logger) -> List[str]:
-    end_time = datetime.now()
-    start_time = end_time - timedelta(days=const.ORDER_LIST_GET_LAST_DAYS)
+def _get_order_item_id_list(start_time: datetime,
+                            end_time: datetime,
+                            scan_state: ScanState,
+                            api: rapi.RakutenAPI,
+                            log: Logger) -> Tuple[List[str], List[str]]:
+    log.info('Request to search Order start_time=%s, end_time=%s', start_time, end_time)
+    orders = []
+
+    def _order_filter(order_number: str) -> bool:
+        # 処理済みの注文は除外
+        if scan_state.is_processed(order_number):
+            return False
+        orders.append(order_number)
+        return True
+
+    # 検索結果のページごとに注文詳細の取得を開始する
+    order_data_list = api.order.search_and_get(start_datetime=start_time,
+                                               end_datetime=end_time,
+                                               order_filter=_order_filter)
+
+    item_ids = []
+    for order_data in order_data_list:
+        order_progress = order_data.order_progress
+        # 受注ステータス(在庫連動対象)
+        # 100: 注文確認待ち
+        # 200: 楽天処理中
+        # 300: 発送待ち
+        # 400: 変更確定待ち
+        # 500: 発送済
+        # 600: 支払手続き中
+        # 700: 支払手続き済
+        if order_progress not in [100, 200, 300, 400, 500, 600, 700]:
+            # 受注ステータス(在庫連動対象外)
+            # 800: キャンセル確定待ち
+            # 900: キャンセル確定
+            continue
+
+        for order_item in order_data.order_items:
+            item_ids.append(order_item.manage_number)
+
+    log.info('Get Order order=%s', orders)
+    log.info('Get order list: order_list=%s', item_ids)
+    return item_ids, orders
 
-    with rapi.RakutenAPI(log=log) as api:
-        log.info('Request to search Order')
-        orders = api.order.search(start_datetime=start_time, end_datetime=end_time)
-        order_data_list = []
-        if orders:
-            log.info('Request to get Order order=%s', orders)
-            order_data_list = api.order.get(order_number_list=orders)
-
-        item_ids = []
-        for order_data in order_data_list:
-            order_progress = order_data.order_progress
-            # 受注ステータス(在庫連動対象)
-            # 100: 注文確認待ち
-            # 200: 楽天処理中
-            # 300: 発送待ち
-            # 400: 変更確定待ち
-            # 500: 発送済
-            # 600: 支払手続き中
-            # 700: 支払手続き済
-            if order_progress not in [100, 200, 300, 400, 500, 600, 700]:
-                # 受注ステータス(在庫連動対象外)
-                # 800: キャンセル確定待ち
-                # 900: キャンセル確定
-                continue
-
-            for order_item in order_data.order_items:
-                item_ids.append(order_item.manage_number)
 
-    log.info('Get order list: order_list=%s', item_ids)
-    return item_ids
-
-
-def _producer(log: Logger):
-    item_ids = _get_order_item_id_list(log=log)
-    if not item_ids:
-        return
-
-    send_data = MQMsgData(id=str(uuid.uuid4()),
-                          item_ids=item_ids,
-                          msg_send_time=datetime.now().isoformat())
-    log.info('Send MQ')
-    # Yahoo!ショッピング
-    _send_msg(send_data=send_data,
-              queue_name=const.MQ_YSHOP_QUEUE,
-              routing_key=const.MQ_YSHOP_ROUTING_KEY,
-              log=log)
-    # AuPayマーケット
-    _send_msg(send_data=send_data,
-              queue_name=const.MQ_AU_QUEUE,
-              routing_key=const.MQ_AU_ROUTING_KEY,
-              log=log)
+def _producer(api: rapi.RakutenAPI, log: Logger):
+    state_store = ScanStateStore(mall='rakuten')
+    scan_state = state_store.load()
+    end_time = datetime.now()
+    start_time = scan_state.get_start_time(end_time=end_time)
+
+    item_ids, order_ids = _get_order_item_id_list(start_time=start_time,
+                                                  end_time=end_time,
+                                                  scan_state=scan_state,
+                                                  api=api,
+                                                  log=log)
+    if item_ids:
+        send_data = MQMsgData.create(item_ids=item_ids)
+        log.info('Send MQ')
+        _send_msg(send_data=send_data,
+                  targets=[
+                      # Yahoo!ショッピング
+                      (const.MQ_YSHOP_QUEUE, const.MQ_YSHOP_ROUTING_KEY),
+                      # AuPayマーケット
+                      (const.MQ_AU_QUEUE, const.MQ_AU_ROUTING_KEY),
+                  ],
+                  log=log)
+
+    # 送信完了後に取得状態を更新
+    scan_state.update(scan_time=end_time, order_ids=order_ids)
+    state_store.save(scan_state)
+
+
+def _daemon(log: Logger):
+    # APIの接続・MQ接続を保持したまま定期実行する
+    with rapi.RakutenAPI(log=log) as api:
+        daemon.run(task=functools.partial(_producer, api=api, log=log),
+                   interval=const.PRODUCER_POLL_INTERVAL,
+                   log=log,
+                   on_idle=process_connections,
+                   on_error=api.reset)
 
 
 def main():
@@ -92,6 +125,9 @@ def main():
                         required=True,
                         type=int,
                         help='input process No type integer')
+    parser.add_argument('--daemon',
+                        action='store_true',
+                        help='run periodically until stopped')
 
     arg_parser = parser.parse_args()
     log = logger.get_logger(task_name='stockout-rakuten-producer',
@@ -100,9 +136,16 @@ def main():
                             task_no=arg_parser.task_no,
                             **const.LOG_SETTING)
     log.info('Start task')
-    log.info('Input args task_no=%s', arg_parser.task_no)
+    log.info('Input args task_no=%s, daemon=%s', arg_parser.task_no, arg_parser.daemon)
 
-    _producer(log=log)
+    try:
+        if arg_parser.daemon:
+            _daemon(log=log)
+        else:
+            with rapi.RakutenAPI(log=log) as api:
+                _producer(api=api, log=log)
+    finally:
+        close_connections()
     log.info('End task')
 
 
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+import os
+import argparse
+import time
+from datetime import datetime
+from typing import List
+
+import const
+from logging import Logger
+import logger
+import ysapi
+
+
+def _create_api(application_id: str,
+                secret: str,
+                auth_file: str,
+                task_no: int,
+                log: Logger) -> ysapi.YahooAPI:
+    if const.IS_PRODUCTION:
+        profile_dirname = f'yshop_auth_{task_no}'
+    else:
+        profile_dirname = f'yshop_auth_test_{task_no}'
+    profile_dir = os.path.join(const.CHROME_PROFILE_DIR, profile_dirname)
+
+    # ブラウザでの再認証はこのタスクのみで行う
+    return ysapi.YahooAPI(profile_dir=profile_dir,
+                          log=log,
+                          application_id=application_id,
+                          secret=secret,
+                          auth_file=auth_file,
+                          business_id=const.YSHOP_BUSINESS_ID,
+                          business_password=const.YSHOP_BUSINESS_ID,
+                          yahoo_id=const.YSHOP_YAHOO_ID,
+                          yahoo_password=const.YSHOP_YAHOO_PASSWORD,
+                          reauth_mode='inline')
+
+
+def _check_auth(api: ysapi.YahooAPI, log: Logger):
+    auth = api.auth
+    try:
+        if auth.is_reauth_requested():
+            log.info('Start re-auth due to requested file=%s', auth.auth_file)
+            auth.re_auth(force=True)
+            log.info('End re-auth file=%s', auth.auth_file)
+        else:
+            # 他プロセスの更新を反映し、有効期限が近ければ更新する(リフレッシュトークンが無効なら再認証)
+            auth.reload()
+            auth.get_access_token()
+    except Exception:
+        log.exception('Failed to check auth file=%s', auth.auth_file)
+
+
+def _auth_service(task_no: int, log: Logger):
+    apis: List[ysapi.YahooAPI] = []
+    try:
+        for application_id, secret, auth_file in [
+            # プロデューサー
+            (const.YJDN_APP_ID_PRODUCER, const.YJDN_SECRET_PRODUCER, const.YJDN_AUTH_FILE_PRODUCER),
+            # コンシューマー
+            (const.YJDN_APP_ID_CONSUMER, const.YJDN_SECRET_CONSUMER, const.YJDN_AUTH_FILE_CONSUMER),
+        ]:
+            apis.append(_create_api(application_id=application_id,
+                                    secret=secret,
+                                    auth_file=auth_file,
+                                    task_no=task_no,
+                                    log=log))
+
+        while True:
+            for api in apis:
+                _check_auth(api=api, log=log)
+            time.sleep(const.YJDN_REAUTH_CHECK_INTERVAL)
+    finally:
+        for api in apis:
+            api.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='stockout_yshop_auth')
+    parser.add_argument('--task_no',
+                        required=True,
+                        type=int,
+                        help='input process No type integer')
+
+    arg_parser = parser.parse_args()
+    log = logger.get_logger(task_name='stockout-yshop-auth',
+                            sub_name='main',
+                            name_datetime=datetime.now(),
+                            task_no=arg_parser.task_no,
+                            **const.LOG_SETTING)
+    log.info('Start task')
+    log.info('Input args task_no=%s', arg_parser.task_no)
+
+    _auth_service(task_no=arg_parser.task_no, log=log)
+    log.info('End task')
+
+
+if __name__ == '__main__':
+    main()
@@ -3,7 +3,7 @@
 import os
 import argparse
 from datetime import datetime
-from typing import Dict
+from typing import Dict, List
 import functools
 
 import const
@@ -11,62 +11,84 @@ from logging import Logger
 import logger
 from mq import MQ, MQMsgData
 import ysapi
+from ledger import StockoutLedger
 
 
-def _stockout(msg_data: MQMsgData,
-              task_no: int,
-              log: Logger):
+def _create_api(task_no: int, log: Logger) -> ysapi.YahooAPI:
     if const.IS_PRODUCTION:
         profile_dirname = f'yshop_consumer_{task_no}'
     else:
         profile_dirname = f'yshop_consumer_test_{task_no}'
     profile_dir = os.path.join(const.CHROME_PROFILE_DIR, profile_dirname)
 
-    if const.IS_PRODUCTION:
-        auth_file = os.path.join(const.TMP_DIR, f'yshop_auth_consumer_{task_no}.json')
-    else:
-        auth_file = os.path.join(const.TMP_DIR, f'yshop_auth_consumer_test_{task_no}.json')
-
-    with ysapi.YahooAPI(profile_dir=profile_dir,
-                        log=log,
-                        application_id=const.YJDN_APP_ID_CONSUMER,
-                        secret=const.YJDN_SECRET_CONSUMER,
-                        auth_file=auth_file,
-                        business_id=const.YSHOP_BUSINESS_ID,
-                        business_password=const.YSHOP_BUSINESS_ID,
-                        yahoo_id=const.YSHOP_YAHOO_ID,
-                        yahoo_password=const.YSHOP_YAHOO_PASSWORD) as api:
+    return ysapi.YahooAPI(profile_dir=profile_dir,
+                          log=log,
+                          application_id=const.YJDN_APP_ID_CONSUMER,
+                          secret=const.YJDN_SECRET_CONSUMER,
+                          auth_file=const.YJDN_AUTH_FILE_CONSUMER,
+                          business_id=const.YSHOP_BUSINESS_ID,
+                          business_password=const.YSHOP_BUSINESS_ID,
+                          yahoo_id=const.YSHOP_YAHOO_ID,
+                          yahoo_password=const.YSHOP_YAHOO_PASSWORD,
+                          auto_refresh_token=True)
+
+
+def _stockout(item_ids: List[str],
+              api: ysapi.YahooAPI,
+              log: Logger):
+    # 重複を除く(旧形式のメッセージは注文明細ごとの商品IDを含む)
+    item_ids = list(dict.fromkeys(item_ids))
+    with StockoutLedger() as ledger:
+        # 在庫0に更新済みの商品は除外
+        target_item_ids = ledger.filter_not_zeroed(mall='yshop', item_codes=item_ids)
+        if not target_item_ids:
+            log.info('N/A update stock data due to already out of stock items=%s', item_ids)
+            return
+
         try:
-            log.info('Request to get stock item')
-            stock_list = api.shopping.stock.get(item_codes=msg_data.item_ids)
-        except Exception:
-            log.exception('Failed to update stock')
-            raise Exception('get stock error')
-
-        set_list = []
-        for stock_data in stock_list:
-            log.info('Stock item data=%s', stock_data)
-            item_id = stock_data.item_code
-            quantity = stock_data.quantity
-            if quantity > 0:
-                log.info('Out of stock item id=%s', item_id)
-                stock_data = ysapi.SetStockData(item_code=item_id, quantity=0)
-                set_list.append(stock_data)
-
-        if set_list:
             try:
-                result = api.shopping.stock.set(set_stock_list=set_list)
-                log.info('Updated stock items=%s', set_list)
-                log.info('Not Updated stock items=%s', result)
-                return
+                log.info('Request to get stock item')
+                stock_list = api.shopping.stock.get(item_codes=target_item_ids)
             except Exception:
                 log.exception('Failed to update stock')
-                raise Exception('stockout error')
-        log.info('N/A update stock data')
+                raise Exception('get stock error')
+
+            set_list = []
+            zeroed_item_ids = []
+            for stock_data in stock_list:
+                log.info('Stock item data=%s', stock_data)
+                item_id = stock_data.item_code
+                quantity = stock_data.quantity
+                if quantity > 0:
+                    log.info('Out of stock item id=%s', item_id)
+                    stock_data = ysapi.SetStockData(item_code=item_id, quantity=0)
+                    set_list.append(stock_data)
+                elif quantity == 0:
+                    zeroed_item_ids.append(item_id)
+
+            if set_list:
+                try:
+                    result = api.shopping.stock.set(set_stock_list=set_list)
+                    log.info('Updated stock items=%s', set_list)
+                    log.info('Not Updated stock items=%s', result)
+                except Exception:
+                    log.exception('Failed to update stock')
+                    raise Exception('stockout error')
+                zeroed_item_ids.extend(response_data.item_code for response_data in result
+                                       if response_data.quantity == 0)
+            else:
+                log.info('N/A update stock data')
+        except Exception:
+            # 接続を破棄し、次のメッセージで再接続する
+            api.reset()
+            raise
+
+        # 在庫0を確認・更新できた商品を記録
+        ledger.record(mall='yshop', item_codes=zeroed_item_ids)
 
 
 def _relist_on_message(msg: Dict,
-                       task_no: int,
+                       api: ysapi.YahooAPI,
                        log: Logger) -> bool:
     log.info('Message data=%s', logger.var_dump(msg))
     try:
@@ -75,22 +97,50 @@ def _relist_on_message(msg: Dict,
         raise Exception('Receive message parse error')
     log.info('Get queue message data=%s', msg_data)
 
-    _stockout(msg_data=msg_data,
-              task_no=task_no,
+    _stockout(item_ids=msg_data.item_ids,
+              api=api,
+              log=log)
+    return True
+
+
+def _relist_on_messages(msgs: List[Dict],
+                        api: ysapi.YahooAPI,
+                        log: Logger) -> bool:
+    item_ids = []
+    for msg in msgs:
+        log.info('Message data=%s', logger.var_dump(msg))
+        try:
+            msg_data = MQMsgData(**msg)
+        except Exception:
+            raise Exception('Receive message parse error')
+        log.info('Get queue message data=%s', msg_data)
+        item_ids.extend(msg_data.item_ids)
+
+    # 重複を除いてまとめて在庫更新
+    _stockout(item_ids=list(dict.fromkeys(item_ids)),
+              api=api,
               log=log)
     return True
 
 
 def _consumer(task_no: int, log: Logger):
     try:
-        with MQ(**const.MQ_CONNECT,
-                queue=const.MQ_YSHOP_QUEUE,
-                routing_key=const.MQ_YSHOP_ROUTING_KEY) as queue:
+        # APIは常駐中使い回す
+        with _create_api(task_no=task_no, log=log) as api, \
+                MQ(**const.MQ_CONNECT,
+                   queue=const.MQ_YSHOP_QUEUE,
+                   routing_key=const.MQ_YSHOP_ROUTING_KEY) as queue:
             queue.open()
-            callback = functools.partial(_relist_on_message,
-                                         task_no=task_no,
-                                         log=log)
-            queue.receive_message(callback)
+            if const.MQ_CONSUMER_BATCH_SIZE > 1:
+                callback = functools.partial(_relist_on_messages,
+                                             api=api,
+                                             log=log)
+                queue.receive_message_batch(callback)
+            else:
+                callback = functools.partial(_relist_on_message,
+                                             api=api,
+                                             log=log)
+                queue.receive_message(callback)
 
     except Exception:
         log.exception('Failed to MQ connect')
@@ -2,112 +2,138 @@
 
 import os
 import argparse
-from datetime import datetime, timedelta
+from datetime import datetime
 from dataclasses import asdict
-from typing import List
-import uuid
+from typing import List, Tuple
+import functools
 
 import const
 from logging import Logger
 import logger
-from mq import MQ, MQMsgData
+from mq import MQ, MQMsgData, MQError, close_connections, process_connections
 import ysapi
+from state import ScanState, ScanStateStore
+import daemon
 
 
 def _send_msg(send_data: MQMsgData,
-              queue_name: str,
-              routing_key: str,
+              targets: List[Tuple[str, str]],
               log: Logger):
     try:
-        with MQ(**const.MQ_CONNECT,
-                queue=queue_name,
-                routing_key=routing_key) as queue:
+        # 1つの接続・チャネルで各キューへ送信
+        with MQ(**const.MQ_CONNECT, pooled=True) as queue:
             msg = asdict(send_data)
-            queue.send_message(message=msg)
-            log.info('Send message queue=%(queue)s, data=%(data)s', {'queue': queue_name, 'data': msg})
+            for queue_name, routing_key in targets:
+                queue.bind(queue=queue_name, routing_key=routing_key)
+            # 全キューへ送信してから、送信できなかったものを確認する
+            failures = queue.send_messages(messages=[msg],
+                                           routing_keys=[routing_key for _queue_name, routing_key in targets])
+            if failures:
+                raise MQError(f'Failed to publish message failures={failures}')
+            for queue_name, _routing_key in targets:
+                log.info('Send message queue=%(queue)s, data=%(data)s', {'queue': queue_name, 'data': msg})
     except Exception:
         log.exception('Failed to send mq message error')
         raise
 
 
-def _get_order_item_id_list(task_no: int, log: Logger) -> List[str]:
-    log.info('Start get order list')
-    end_time = datetime.now()
-    start_time = end_time - timedelta(days=const.ORDER_LIST_GET_LAST_DAYS)
-
+def _create_api(task_no: int, log: Logger, auto_refresh_token: bool = False) -> ysapi.YahooAPI:
     if const.IS_PRODUCTION:
         profile_dirname = f'yshop_producer_{task_no}'
     else:
         profile_dirname = f'yshop_producer_test_{task_no}'
     profile_dir = os.path.join(const.CHROME_PROFILE_DIR, profile_dirname)
 
-    if const.IS_PRODUCTION:
-        auth_file = os.path.join(const.TMP_DIR, f'yshop_auth_producer_{task_no}.json')
-    else:
-        auth_file = os.path.join(const.TMP_DIR, f'yshop_auth_producer_test_{task_no}.json')
-
     cert = (const.YSHOP_CERT_CRT_FILE, const.YSHOP_CERT_PKEY_FILE)
 
-    with ysapi.YahooAPI(profile_dir=profile_dir,
-                        log=log,
-                        application_id=const.YJDN_APP_ID_PRODUCER,
-                        secret=const.YJDN_SECRET_PRODUCER,
-                        auth_file=auth_file,
-                        business_id=const.YSHOP_BUSINESS_ID,
-                        business_password=const.YSHOP_BUSINESS_ID,
-                        yahoo_id=const.YSHOP_YAHOO_ID,
-                        yahoo_password=const.YSHOP_YAHOO_PASSWORD,
-                        cert=cert) as api:
-        log.info('Request to get order list')
-        order_list = api.shopping.order.list.get(order_time_from=start_time, order_time_to=end_time)
-
-        item_ids = []
-        for order_list_data in order_list:
-            order_id = order_list_data.order_id
-            log.info('Request to get order info order_id=%s', order_id)
-            order_info_list = api.shopping.order.info.get(order_id=order_id)
-
-            for order_info in order_info_list:
-                order_status = order_info.order_status
-                # 受注ステータス(在庫連動対象)
-                # 1 : 予約中
-                # 2 : 処理中
-                # 3 : 保留
-                # 5 : 完了
-                if order_status not in [1, 2, 3, 5]:
-                    # 受注ステータス(在庫連動対象外)
-                    # 4 : キャンセル
-                    continue
-
-                order_items = order_info.items
-                if order_items:
-                    for order_item in order_items:
-                        item_id = order_item.item_id
-                        item_ids.append(item_id)
+    return ysapi.YahooAPI(profile_dir=profile_dir,
+                          log=log,
+                          application_id=const.YJDN_APP_ID_PRODUCER,
+                          secret=const.YJDN_SECRET_PRODUCER,
+                          auth_file=const.YJDN_AUTH_FILE_PRODUCER,
+                          business_id=const.YSHOP_BUSINESS_ID,
+                          business_password=const.YSHOP_BUSINESS_ID,
+                          yahoo_id=const.YSHOP_YAHOO_ID,
+                          yahoo_password=const.YSHOP_YAHOO_PASSWORD,
+                          cert=cert,
+                          auto_refresh_token=auto_refresh_token)
+
+
+def _get_order_item_id_list(start_time: datetime,
+                            end_time: datetime,
+                            scan_state: ScanState,
+                            api: ysapi.YahooAPI,
+                            log: Logger) -> Tuple[List[str], List[str]]:
+    log.info('Start get order list start_time=%s, end_time=%s', start_time, end_time)
+
+    log.info('Request to get order list')
+    order_list = api.shopping.order.list.get(order_time_from=start_time, order_time_to=end_time)
+
+    # 処理済みの注文は除外
+    order_ids = [order_list_data.order_id for order_list_data in order_list
+                 if not scan_state.is_processed(order_list_data.order_id)]
+    log.info('Request to get order info order_ids=%s', order_ids)
+    order_info_list = api.shopping.order.info.get_bulk(order_ids=order_ids)
+
+    item_ids = []
+    for order_info in order_info_list:
+        order_status = order_info.order_status
+        # 受注ステータス(在庫連動対象)
+        # 1 : 予約中
+        # 2 : 処理中
+        # 3 : 保留
+        # 5 : 完了
+        if order_status not in [1, 2, 3, 5]:
+            # 受注ステータス(在庫連動対象外)
+            # 4 : キャンセル
+            continue
+
+        order_items = order_info.items
+        if order_items:
+            for order_item in order_items:
+                item_id = order_item.item_id
+                item_ids.append(item_id)
 
     log.info('Get order list: order_list=%s', item_ids)
-    return item_ids
-
-
-def _producer(task_no: int, log: Logger):
-    item_ids = _get_order_item_id_list(task_no=task_no, log=log)
-    if not item_ids:
-        return
-
-    send_data = MQMsgData(id=str(uuid.uuid4()),
-                          item_ids=item_ids,
-                          msg_send_time=datetime.now().isoformat())
-    log.info('Send MQ')
-    # 楽天
-    _send_msg(send_data=send_data,
-              queue_name=const.MQ_RAKUTEN_QUEUE,
-              routing_key=const.MQ_RAKUTEN_ROUTING_KEY,
-              log=log)
-    # AuPayマーケット
-    _send_msg(send_data=send_data,
-              queue_name=const.MQ_AU_QUEUE,
-              routing_key=const.MQ_AU_ROUTING_KEY,
-              log=log)
+    return item_ids, order_ids
+
+
+def _producer(api: ysapi.YahooAPI, log: Logger):
+    state_store = ScanStateStore(mall='yshop')
+    scan_state = state_store.load()
+    end_time = datetime.now()
+    start_time = scan_state.get_start_time(end_time=end_time)
+
+    item_ids, order_ids = _get_order_item_id_list(start_time=start_time,
+                                                  end_time=end_time,
+                                                  scan_state=scan_state,
+                                                  api=api,
+                                                  log=log)
+    if item_ids:
+        send_data = MQMsgData.create(item_ids=item_ids)
+        log.info('Send MQ')
+        _send_msg(send_data=send_data,
+                  targets=[
+                      # 楽天
+                      (const.MQ_RAKUTEN_QUEUE, const.MQ_RAKUTEN_ROUTING_KEY),
+                      # AuPayマーケット
+                      (const.MQ_AU_QUEUE, const.MQ_AU_ROUTING_KEY),
+                  ],
+                  log=log)
+
+    # 送信完了後に取得状態を更新
+    scan_state.update(scan_time=end_time, order_ids=order_ids)
+    state_store.save(scan_state)
+
+
+def _daemon(task_no: int, log: Logger):
+    # APIの接続・アクセストークン・MQ接続を保持したまま定期実行する
+    with _create_api(task_no=task_no, log=log, auto_refresh_token=True) as api:
+        daemon.run(task=functools.partial(_producer, api=api, log=log),
+                   interval=const.PRODUCER_POLL_INTERVAL,
+                   log=log,
+                   on_idle=process_connections,
+                   on_error=api.reset)
 
 
 def main():
@@ -116,6 +142,9 @@ def main():
                         required=True,
                         type=int,
                         help='input process No type integer')
+    parser.add_argument('--daemon',
+                        action='store_true',
+                        help='run periodically until stopped')
 
     arg_parser = parser.parse_args()
     log = logger.get_logger(task_name='stockout-yshop-producer',
@@ -124,9 +153,16 @@ def main():
                             task_no=arg_parser.task_no,
                             **const.LOG_SETTING)
     log.info('Start task')
-    log.info('Input args task_no=%s', arg_parser.task_no)
+    log.info('Input args task_no=%s, daemon=%s', arg_parser.task_no, arg_parser.daemon)
 
-    _producer(task_no=arg_parser.task_no, log=log)
+    try:
+        if arg_parser.daemon:
+            _daemon(task_no=arg_parser.task_no, log=log)
+        else:
+            with _create_api(task_no=arg_parser.task_no, log=log) as api:
+                _producer(api=api, log=log)
+    finally:
+        close_connections()
     log.info('End task')
 
 
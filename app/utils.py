@@ -1 +1,103 @@
 # -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+from typing import Optional
+
+if os.name == 'nt':
+    import msvcrt
+else:
+    import fcntl
+
+
+class FileLockTimeout(Exception):
+    pass
+
+
+class FileLock:
+    # プロセス間の排他制御(ロックファイルの先頭1バイトをロックする)
+    # 同一インスタンスでの多重取得は、取得した回数だけ解放するまで保持する
+    def __init__(self,
+                 lock_file: str,
+                 timeout: Optional[float] = None,
+                 poll_interval: float = 0.05):
+        self.lock_file = lock_file
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self._fd: Optional[int] = None
+        self._count = 0
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+    def is_locked(self) -> bool:
+        return self._fd is not None
+
+    def acquire(self):
+        if self._fd is not None:
+            self._count += 1
+            return
+
+        os.makedirs(os.path.dirname(self.lock_file), exist_ok=True)
+        fd = os.open(self.lock_file, os.O_RDWR | os.O_CREAT)
+        start_time = time.monotonic()
+        while True:
+            try:
+                self._lock(fd)
+                break
+            except OSError:
+                if self.timeout is not None and time.monotonic() - start_time >= self.timeout:
+                    os.close(fd)
+                    raise FileLockTimeout(f'Failed to lock file={self.lock_file}')
+                time.sleep(self.poll_interval)
+        self._fd = fd
+        self._count = 1
+
+    def release(self):
+        if self._fd is None:
+            return
+        self._count -= 1
+        if self._count > 0:
+            return
+
+        try:
+            self._unlock(self._fd)
+        finally:
+            os.close(self._fd)
+            self._fd = None
+
+    @staticmethod
+    def _lock(fd: int):
+        if os.name == 'nt':
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        else:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    @staticmethod
+    def _unlock(fd: int):
+        if os.name == 'nt':
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+        else:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+def write_json_atomic(file: str, data):
+    # 一時ファイルに書き出してから置き換える(書き込み途中のファイルを読ませない)
+    os.makedirs(os.path.dirname(file), exist_ok=True)
+    tmp_file = f'{file}.{os.getpid()}.tmp'
+    try:
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=4, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, file)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
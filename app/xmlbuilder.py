@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+
+from typing import Dict, Iterable, Iterator, Optional
+from xml.sax.saxutils import escape, quoteattr
+
+XML_DECLARATION = "<?xml version='1.0' encoding='utf-8'?>\n"
+
+
+def text_element(tag: str, value) -> str:
+    # 値はエスケープして出力する(None・空文字は空要素)
+    if value is None or value == '':
+        return f'<{tag} />'
+    return f'<{tag}>{escape(str(value))}</{tag}>'
+
+
+def element(tag: str, *children: str) -> str:
+    return f'<{tag}>{"".join(children)}</{tag}>'
+
+
+def iter_document(root_tag: str,
+                  children: Iterable[str],
+                  attrs: Optional[Dict[str, str]] = None,
+                  chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+    # 宣言・ルート要素・子要素を順に書き出し、chunk_sizeごとにバイト列で返す
+    # 子要素はジェネレーターで渡せば、全体を組み立てずに出力できる
+    attrs_text = ''.join(f' {name}={quoteattr(value)}' for name, value in (attrs or {}).items())
+    buffer = [XML_DECLARATION, f'<{root_tag}{attrs_text}>']
+    size = 0
+    for child in children:
+        buffer.append(child)
+        size += len(child)
+        if size >= chunk_size:
+            yield ''.join(buffer).encode('utf-8')
+            buffer = []
+            size = 0
+    buffer.append(f'</{root_tag}>')
+    yield ''.join(buffer).encode('utf-8')
+
+
+def build_document(root_tag: str,
+                   children: Iterable[str],
+                   attrs: Optional[Dict[str, str]] = None) -> bytes:
+    return b''.join(iter_document(root_tag=root_tag, children=children, attrs=attrs))
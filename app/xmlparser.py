@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+
+from io import BytesIO
+from typing import Dict, Iterator, Sequence
+
+from lxml import etree
+
+
+class XmlParseError(Exception):
+    pretext = 'XML解析エラー'
+
+    def __init__(self, message, *args):
+        if self.pretext:
+            message = f"{self.pretext}: {message}"
+        super().__init__(message, *args)
+
+
+def iterparse(content: bytes, tags: Sequence[str]) -> Iterator[etree._Element]:
+    # レスポンスのバイト列を先頭から解析し、指定タグの要素が閉じるごとに返す
+    # 返した要素(と処理済みの兄弟要素)は呼び出し元の処理後に解放する
+    # 指定タグの要素の中にある要素は、外側の要素の処理が終わるまで解放しない
+    tag_set = set(tags)
+    context = etree.iterparse(BytesIO(content),
+                              events=('end',),
+                              tag=tags,
+                              resolve_entities=False,
+                              no_network=True)
+    try:
+        for _, el in context:
+            yield el
+
+            if any(ancestor.tag in tag_set for ancestor in el.iterancestors()):
+                continue
+            el.clear()
+            parent = el.getparent()
+            if parent is not None:
+                while el.getprevious() is not None:
+                    del parent[0]
+    except etree.XMLSyntaxError as e:
+        raise XmlParseError(f'Failed to parse xml error={e}')
+    finally:
+        del context
+
+
+def find_texts(content: bytes, tags: Sequence[str], default: str = '') -> Dict[str, str]:
+    # 各タグで最初に見つかった要素のテキストを1回の解析で取得する(エラーレスポンスのコード・メッセージなど)
+    texts = {}
+    try:
+        for el in iterparse(content, tags=tags):
+            if el.tag not in texts:
+                texts[el.tag] = el.text if el.text is not None else default
+                if len(texts) == len(tags):
+                    break
+    except XmlParseError:
+        pass
+    return {tag: texts.get(tag, default) for tag in tags}
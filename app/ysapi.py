@@ -1,15 +1,20 @@
 # -*- coding: utf-8 -*-
 
+import asyncio
 import os
 import time
+import threading
+import atexit
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+import math
 import re
-import xml.etree.ElementTree as ET
 from retry import retry
 import urllib.parse
 import uuid
 from dataclasses import dataclass
-from typing import List, Optional, Tuple
+from typing import Dict, Iterator, List, Optional, Tuple
 import json
 from json import JSONDecodeError
 from selenium import webdriver
@@ -20,7 +25,15 @@ from selenium.webdriver.common.by import By
 
 from logging import Logger
 import const
-from apireq import APIRequests
+from requests import Response
+from apireq import APIRequests, AsyncAPIRequests, retry_async, iter_pages, gather_pages
+import ratelimit
+import circuit
+import xmlparser
+import xmlbuilder
+from models import (OrderListData, OrderInfoItemData, OrderInfoData, GetStockData, SetStockResponseData,
+                    SetStockData)
+from utils import FileLock, write_json_atomic
 
 os.environ['WDM_LOG_LEVEL'] = '0'
 os.environ['WDM_LOCAL'] = '1'
@@ -35,40 +48,110 @@ class YahooAPIAuth:
 
 
 @dataclass
-class OrderListData:
-    order_id: str
-
-
-@dataclass
-class OrderInfoItemData:
-    item_id: str
-    title: str
-
-
-@dataclass
-class OrderInfoData:
-    order_id: str
-    order_status: int
-    items: List[OrderInfoItemData]
-
-
-@dataclass
-class GetStockData:
-    item_code: str
-    status: int
-    quantity: int
-
-
-@dataclass
-class SetStockResponseData:
-    item_code: str
-    quantity: int
-
-
-@dataclass
-class SetStockData:
-    item_code: str
-    quantity: int
+class OrderListResult:
+    total_count: Optional[int]
+    orders: List[OrderListData]
+
+
+def parse_error(content: bytes) -> Tuple[str, str]:
+    texts = xmlparser.find_texts(content, tags=('Code', 'Message'))
+    return texts['Code'], texts['Message']
+
+
+def get_bearer_token(headers: Dict) -> Optional[str]:
+    # リクエストに使用したアクセストークン
+    authorization = headers.get('Authorization', '')
+    if not authorization.startswith('Bearer '):
+        return None
+    return authorization[len('Bearer '):]
+
+
+def parse_order_list(content: bytes) -> OrderListResult:
+    result = OrderListResult(total_count=None, orders=[])
+    for el in xmlparser.iterparse(content, tags=('OrderInfo', 'TotalCount')):
+        if el.tag == 'TotalCount':
+            if el.text:
+                result.total_count = int(el.text)
+            continue
+
+        result.orders.append(OrderListData(order_id=el.findtext('.//OrderId')))
+    return result
+
+
+def get_order_list_total_pages(result: OrderListResult, result_count: int) -> int:
+    # 総数が返らない場合は1ページのみ
+    if result.total_count is None:
+        return 1
+    return math.ceil(result.total_count / result_count)
+
+
+def parse_order_info(content: bytes) -> Iterator[OrderInfoData]:
+    for el_order_info in xmlparser.iterparse(content, tags=('OrderInfo',)):
+        order_items = tuple(OrderInfoItemData(item_id=el_item.findtext('.//ItemId'),
+                                              title=el_item.findtext('.//Title'))
+                            for el_item in el_order_info.iterfind('.//Item'))
+        yield OrderInfoData(order_id=el_order_info.findtext('.//OrderId'),
+                            order_status=int(el_order_info.findtext('.//OrderStatus')),
+                            items=order_items)
+
+
+def parse_get_stock(content: bytes) -> Iterator[GetStockData]:
+    for el_item in xmlparser.iterparse(content, tags=('Result',)):
+        status = el_item.findtext('.//Status')
+        if status != '1':
+            continue
+
+        quantity = el_item.findtext('.//Quantity')
+        if not quantity:
+            # 在庫無限大は、-1にする
+            quantity = -1
+        else:
+            quantity = int(quantity)
+        yield GetStockData(item_code=el_item.findtext('.//ItemCode'),
+                           status=int(status),
+                           quantity=quantity)
+
+
+def parse_set_stock(content: bytes) -> Iterator[SetStockResponseData]:
+    for el_item in xmlparser.iterparse(content, tags=('Result',)):
+        quantity = el_item.find('.//Quantity')
+        if quantity is None:
+            continue
+
+        if not quantity.text:
+            # 空白は在庫無限大。-1にする
+            quantity = -1
+        else:
+            quantity = int(quantity.text)
+        yield SetStockResponseData(item_code=el_item.findtext('.//ItemCode'),
+                                   quantity=quantity)
+
+
+def build_order_list_request(order_time_from: datetime,
+                             order_time_to: datetime,
+                             result_count: int,
+                             start: Optional[int] = None) -> bytes:
+    search = xmlbuilder.element(
+        'Search',
+        xmlbuilder.text_element('Result', result_count),
+        xmlbuilder.text_element('Start', start),
+        xmlbuilder.text_element('Sort', '+order_time'),
+        xmlbuilder.element('Condition',
+                           xmlbuilder.text_element('OrderTimeFrom', order_time_from.strftime('%Y%m%d%H%M%S')),
+                           xmlbuilder.text_element('OrderTimeTo', order_time_to.strftime('%Y%m%d%H%M%S'))),
+        xmlbuilder.text_element('Field', 'OrderId,OrderTime,IsYahooAuctionOrder'))
+    return xmlbuilder.build_document(root_tag='Req',
+                                     children=[search, xmlbuilder.text_element('SellerId', YahooAPI.seller_id)],
+                                     attrs={'version': '1.0', 'encoding': 'UTF-8'})
+
+
+def build_order_info_request(order_id: str) -> bytes:
+    target = xmlbuilder.element('Target',
+                                xmlbuilder.text_element('OrderId', order_id),
+                                xmlbuilder.text_element('Field', 'OrderId,OrderStatus,ItemId,Title'))
+    return xmlbuilder.build_document(root_tag='Req',
+                                     children=[target, xmlbuilder.text_element('SellerId', YahooAPI.seller_id)],
+                                     attrs={'version': '1.0', 'encoding': 'UTF-8'})
 
 
 class YahooBaseError(Exception):
@@ -92,10 +175,32 @@ class YahooAuthError(YahooBaseError):
     pretext = '接続エラー'
 
 
+class YahooReauthPendingError(YahooAuthError):
+    pretext = '再認証待ち'
+
+
 class YahooShoppingApiError(YahooBaseError):
     pretext = 'ショッピングAPIエラー'
 
 
+class YahooTokenExpiredError(YahooShoppingApiError):
+    # トークンを更新・再認証したため、リクエストを再試行する
+    pretext = 'ショッピングAPIトークン期限切れ'
+
+
+_chrome_driver_path: Optional[str] = None
+_chrome_driver_path_lock = threading.Lock()
+
+
+def _get_chrome_driver_path() -> str:
+    # chromedriverのバージョン確認・ダウンロードはプロセス内で1度だけ行う
+    global _chrome_driver_path
+    with _chrome_driver_path_lock:
+        if _chrome_driver_path is None:
+            _chrome_driver_path = ChromeDriverManager().install()
+    return _chrome_driver_path
+
+
 class YahooWebDriver:
     def __init__(self,
                  profile_dir: str,
@@ -156,13 +261,11 @@ class YahooWebDriver:
         driver = None
         try:
             driver = webdriver.Chrome(
-                ChromeDriverManager().install(),
+                _get_chrome_driver_path(),
                 options=options)
             driver.implicitly_wait(1)
             driver.set_page_load_timeout(60)
             driver.set_script_timeout(60)
-            driver.get('https://www.yahoo.co.jp/')
-            WebDriverWait(driver, 30).until(EC.presence_of_all_elements_located)
         except Exception:
             if driver is not None:
                 driver.close()
@@ -188,6 +291,64 @@ class YahooWebDriver:
         except Exception:
             raise YahooAuthWebDriverError('Failed to get page due to occurred exception error')
 
+    def is_alive(self) -> bool:
+        if not self.driver:
+            return False
+        try:
+            # ブラウザが終了している場合は例外になる
+            _ = self.driver.current_url
+        except Exception:
+            return False
+        return True
+
+
+class YahooWebDriverPool:
+    # プロファイルディレクトリごとにブラウザを起動したまま再認証で使い回す
+    _drivers: Dict[str, YahooWebDriver] = {}
+    _driver_locks: Dict[str, threading.Lock] = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    @contextmanager
+    def borrow(cls, profile_dir: str, headless: bool = True) -> Iterator[YahooWebDriver]:
+        with cls._lock:
+            driver_lock = cls._driver_locks.setdefault(profile_dir, threading.Lock())
+
+        # 同じプロファイルのブラウザは同時に1つの処理のみ使用する
+        with driver_lock:
+            driver = cls._drivers.get(profile_dir)
+            if driver is None or (driver.driver and not driver.is_alive()):
+                if driver is not None:
+                    cls._close_driver(driver)
+                driver = YahooWebDriver(profile_dir=profile_dir, headless=headless)
+                cls._drivers[profile_dir] = driver
+
+            try:
+                yield driver
+            except Exception:
+                # 状態が不明なブラウザは破棄し、次回起動し直す
+                cls._drivers.pop(profile_dir, None)
+                cls._close_driver(driver)
+                raise
+
+    @staticmethod
+    def _close_driver(driver: YahooWebDriver):
+        try:
+            driver.close()
+        except Exception:
+            pass
+
+    @classmethod
+    def close_all(cls):
+        with cls._lock:
+            drivers = list(cls._drivers.values())
+            cls._drivers.clear()
+        for driver in drivers:
+            cls._close_driver(driver)
+
+
+atexit.register(YahooWebDriverPool.close_all)
+
 
 class YahooAuth:
     def __init__(self,
@@ -201,6 +362,10 @@ class YahooAuth:
                  business_password: str,
                  yahoo_id: str,
                  yahoo_password: str,
+                 refresh_margin: float = const.YJDN_TOKEN_REFRESH_MARGIN,
+                 default_lifetime: float = const.YJDN_TOKEN_DEFAULT_LIFETIME,
+                 min_refresh_interval: float = const.YJDN_TOKEN_MIN_REFRESH_INTERVAL,
+                 reauth_mode: str = const.YJDN_REAUTH_MODE,
                  ):
         self.api: APIRequests = api
         self.profile_dir: str = profile_dir
@@ -208,19 +373,97 @@ class YahooAuth:
         self.secret = secret
         self.authz_code: Optional[str] = None
         self.access_token: Optional[str] = None
+        self.access_token_expires_at: Optional[float] = None
         self.refresh_token: Optional[str] = None
+        self.refresh_margin = refresh_margin
+        self.default_lifetime = default_lifetime
+        self.min_refresh_interval = min_refresh_interval
         self.log: Logger = log
         self.business_id = business_id
         self.business_password = business_password
         self.yahoo_id = yahoo_id
         self.yahoo_password = yahoo_password
         self.auth_file = auth_file
-
-        self._load_auth()
-        self.update_token()
+        # 再認証サービスへの依頼ファイル
+        self.reauth_request_file = f'{auth_file}.reauth'
+        self.reauth_mode = reauth_mode
+        # 並列リクエスト時のトークン更新を直列化
+        self._lock = threading.RLock()
+        # 同一アプリケーションの認証ファイルを共有する他プロセスとのトークン更新を直列化
+        self._file_lock = FileLock(lock_file=f'{auth_file}.lock')
+        # ブラウザでの再認証を他プロセスと直列化(認証ファイルのロックとは分け、ログイン中も認証ファイルは読み書きできる)
+        self._login_lock = FileLock(lock_file=f'{auth_file}.login.lock')
+        self._refresh_timer: Optional[threading.Timer] = None
+        self._auto_refresh = False
+
+        self.reload()
+        # 有効期限内のアクセストークンはそのまま使用
+        if not self.is_token_valid():
+            self.update_token()
+
+    def is_token_valid(self) -> bool:
+        if not self.access_token or not self.access_token_expires_at:
+            return False
+        return time.time() < self.access_token_expires_at - self.refresh_margin
+
+    def get_access_token(self) -> str:
+        with self._lock:
+            if not self.is_token_valid():
+                self.update_token()
+            return self.access_token
+
+    def _set_access_token(self, res_json: dict):
+        self.access_token = res_json["access_token"]
+        # 有効期限が返されない場合は既定の有効期間とする
+        expires_in = res_json.get("expires_in") or self.default_lifetime
+        self.access_token_expires_at = time.time() + int(expires_in)
+
+    def start_auto_refresh(self):
+        # 有効期限が切れる前にバックグラウンドで更新する
+        with self._lock:
+            self._auto_refresh = True
+            self._schedule_refresh()
+
+    def stop_auto_refresh(self):
+        with self._lock:
+            self._auto_refresh = False
+            if self._refresh_timer:
+                self._refresh_timer.cancel()
+                self._refresh_timer = None
+
+    def _schedule_refresh(self, delay: Optional[float] = None):
+        if not self._auto_refresh:
+            return
+        if self._refresh_timer:
+            self._refresh_timer.cancel()
+
+        if delay is None:
+            if self.access_token_expires_at:
+                delay = self.access_token_expires_at - self.refresh_margin - time.time()
+            else:
+                # 有効期限が不明な場合は既定の有効期間で更新する
+                delay = self.default_lifetime - self.refresh_margin
+        # 更新に失敗し続けてもタイマーが連続で動かないよう、最小間隔を設ける
+        delay = max(self.min_refresh_interval, delay)
+        timer = threading.Timer(delay, self._on_refresh_timer)
+        timer.daemon = True
+        timer.start()
+        self._refresh_timer = timer
+
+    def _on_refresh_timer(self):
+        try:
+            with self._lock:
+                if not self.is_token_valid():
+                    self.log.debug('Token refresh in background')
+                    self.update_token()
+                self._schedule_refresh()
+        except Exception:
+            self.log.exception('Failed to refresh access token in background')
+            with self._lock:
+                self._schedule_refresh()
 
     def _get_az_code(self):
-        with YahooWebDriver(profile_dir=self.profile_dir, headless=const.DRIVER_HEADLESS) as driver:
+        with YahooWebDriverPool.borrow(profile_dir=self.profile_dir, headless=const.DRIVER_HEADLESS) as driver:
             try:
                 driver.setup(business_id=self.business_id,
                              business_password=self.business_password,
@@ -302,7 +545,7 @@ class YahooAuth:
             if res.status_code != 200:
                 return False
             res_json = res.json()
-            self.access_token = res_json["access_token"]
+            self._set_access_token(res_json)
             self.refresh_token = res_json["refresh_token"]
         except Exception:
             self.log.exception('Failed to request to get access token')
@@ -311,6 +554,7 @@ class YahooAuth:
     def _clear_auth(self):
         self.authz_code = None
         self.access_token = None
+        self.access_token_expires_at = None
         self.refresh_token = None
 
     def _load_auth(self):
@@ -321,6 +565,7 @@ class YahooAuth:
                     data = json.load(f)
                     self.authz_code = data.get('authorization_code', None)
                     self.access_token = data.get('access_token', None)
+                    self.access_token_expires_at = data.get('access_token_expires_at', None)
                     self.refresh_token = data.get('refresh_token', None)
             except JSONDecodeError:
                 self.log.info('yahoo auth file is not json file')
@@ -330,35 +575,115 @@ class YahooAuth:
                 self.log.exception('can not open yahoo auth file')
                 raise YahooAuthError('can not open yahoo auth file')
 
+    def reload(self):
+        with self._lock, self._file_lock:
+            if os.path.exists(self.auth_file):
+                self._load_auth()
+
+    def _adopt_stored_token(self, access_token: Optional[str]) -> bool:
+        # 他プロセスが更新したトークンが認証ファイルにあれば、それを使用する
+        self.reload()
+        if self.access_token != access_token and self.is_token_valid():
+            self.log.debug('Use access token updated by other process')
+            return True
+        return False
+
     def _output_auth_file(self):
         data = {
             'authorization_code': self.authz_code,
             'access_token': self.access_token,
+            'access_token_expires_at': self.access_token_expires_at,
             'refresh_token': self.refresh_token,
         }
         try:
-            os.makedirs(os.path.dirname(self.auth_file), exist_ok=True)
-            with open(self.auth_file, 'w') as f:
-                json.dump(data, f, indent=4, ensure_ascii=False)
+            # 他プロセスが読み込み途中のファイルを壊さないよう一時ファイルから置き換える
+            write_json_atomic(self.auth_file, data)
         except Exception:
             self.log.exception('Failed to output auth file')
             raise YahooAuthError('Failed to output auth file')
 
-    def re_auth(self):
+    def is_reauth_requested(self) -> bool:
+        return os.path.exists(self.reauth_request_file)
+
+    def _request_reauth(self):
+        data = {
+            'pid': os.getpid(),
+            'requested_at': datetime.now().isoformat(),
+        }
         try:
-            self._get_az_code()
-            self._get_access_token()
-            self._output_auth_file()
+            write_json_atomic(self.reauth_request_file, data)
         except Exception:
-            self.log.exception('Failed to get az code')
-            raise YahooAuthError('Failed to get az code')
+            self.log.exception('Failed to output re-auth request file')
+            raise YahooAuthError('Failed to output re-auth request file')
+
+    def _request_reauth_service(self):
+        # ブラウザでの認証は再認証サービスに任せる
+        # ロックを保持したまま待機すると他スレッドも止まるため、依頼後は待たずに失敗させる
+        # (更新されたトークンは次回のget_access_token・update_tokenで認証ファイルから読み込む)
+        with self._file_lock:
+            if self._adopt_stored_token(access_token=self.access_token):
+                return
+            if not self.is_reauth_requested():
+                self._request_reauth()
+        self.log.info('Requested re-auth to service file=%s', self.auth_file)
+        raise YahooReauthPendingError(f'Waiting for re-auth service file={self.auth_file}')
+
+    def re_auth(self, force: bool = False):
+        with self._lock:
+            if self.reauth_mode == 'service' and not force:
+                self._request_reauth_service()
+                return
+            self._re_auth_inline(force=force)
 
     @retry(tries=3, delay=3, backoff=2, jitter=1)
-    def update_token(self):
+    def _re_auth_inline(self, force: bool):
+        access_token = self.access_token
+        with self._lock, self._login_lock:
+            with self._file_lock:
+                # 他プロセスが再認証済み(ログインの順番待ちの間を含む)であれば、ブラウザでの認証は行わない
+                if not force and self._adopt_stored_token(access_token=access_token):
+                    return
+
+            # ブラウザでのログイン中は認証ファイルをロックしない
+            try:
+                self._get_az_code()
+                self._get_access_token()
+            except Exception:
+                self.log.exception('Failed to get az code')
+                raise YahooAuthError('Failed to get az code')
+
+            with self._file_lock:
+                self._output_auth_file()
+                # 再認証できたので依頼を取り消す
+                if self.is_reauth_requested():
+                    os.remove(self.reauth_request_file)
+
+    def update_token(self, failed_token: Optional[str] = None):
+        # failed_token: 無効と判定されたアクセストークン(ロック待ちの間に他スレッドが更新済みであれば何もしない)
+        with self._lock:
+            if failed_token is not None and self.access_token != failed_token and self.is_token_valid():
+                self.log.debug('Access token has already been updated by other thread')
+                return
+            if self._refresh_access_token():
+                return
+            # 再認証の再試行は再認証方法ごとに行う(再認証サービスへの依頼は再試行しない)
+            self.re_auth()
+
+    @retry(tries=3, delay=3, backoff=2, jitter=1)
+    def _refresh_access_token(self) -> bool:
+        # 再認証が必要な場合はFalseを返す
+        # 再認証サービスが認証ファイルを更新できるよう、ファイルロックは再認証前に解放する
+        with self._file_lock:
+            # 他プロセスが更新済みであれば、リフレッシュトークンは使用しない
+            if self._adopt_stored_token(access_token=self.access_token):
+                return True
+            return self._update_token()
+
+    def _update_token(self) -> bool:
+        # 再認証が必要な場合はFalseを返す
         if not self.refresh_token:
             self.log.debug('exec auth due to not set refresh token')
-            self.re_auth()
-            return
+            return False
 
         headers = {
             'Host': 'auth.login.yahoo.co.jp',
@@ -382,12 +707,11 @@ class YahooAuth:
             if 'invalid_grant' not in res.text:
                 raise YahooAuthError('Failed to update access token not invalid grant')
             self.log.debug('exec auth due to invalid grant')
-            self.re_auth()
-            return
+            return False
 
         try:
             res_json = res.json()
-            self.access_token = res_json["access_token"]
+            self._set_access_token(res_json)
         except Exception:
             self.log.exception('Failed to get access token')
             raise YahooAuthError('Failed to get access token')
@@ -397,6 +721,7 @@ class YahooAuth:
         except Exception:
             self.log.exception('Failed to output auth file')
             raise YahooAuthError('Failed to output auth file')
+        return True
 
 
 class OrderListAPI:
@@ -408,86 +733,76 @@ class OrderListAPI:
         self.auth = auth
         self.log = log
 
-    @retry(tries=3, delay=2, backoff=2, jitter=1)
+    def _get_page(self,
+                  url: str,
+                  headers: Dict,
+                  order_time_from: datetime,
+                  order_time_to: datetime,
+                  result_count: int,
+                  page: int) -> OrderListResult:
+        # リクエスト(初回は開始位置を指定しない)
+        start = 1 + (page - 1) * result_count
+        post_data = build_order_list_request(order_time_from=order_time_from,
+                                             order_time_to=order_time_to,
+                                             result_count=result_count,
+                                             start=start if start > 1 else None)
+        try:
+            res = self.api.request_post(url=url, headers=headers, data=post_data)
+            if res.status_code != 200:
+                if res.status_code == 401:
+                    www_auth = res.headers.get('WWW-Authenticate', '')
+                    re_ = re.search(r'error="(?P<error_msg>[a-zA-Z_]+)"', www_auth)
+                    if re_:
+                        error_msg = re_.group('error_msg')
+                        if error_msg in ['invalid_token']:
+                            self.log.debug('Token refresh in OrderListAPI.get')
+                            self.auth.update_token(failed_token=get_bearer_token(headers))
+                            raise YahooTokenExpiredError('Failed to post request due to invalid token')
+
+                error_code, error_msg = parse_error(res.content)
+                if error_code == 'px-04102':
+                    self.log.debug('Re auth in OrderListAPI.get')
+                    self.auth.re_auth()
+                    raise YahooTokenExpiredError(
+                        f'Failed to post request due to AccessToken has been expired code={error_code}, message={error_msg}')
+                raise YahooShoppingApiError(
+                    f'Failed to post request code={error_code}, message={error_msg}')
+        except YahooTokenExpiredError:
+            raise
+        except Exception:
+            self.log.exception('Failed to post request get order list')
+            raise YahooShoppingApiError('Failed to post request to get order list')
+
+        return parse_order_list(res.content)
+
+    @retry(YahooTokenExpiredError, tries=2)
     def get(self,
             order_time_from: datetime,
             order_time_to: datetime,
-            result_count: Optional[int] = 2000) -> List[OrderListData]:
+            result_count: Optional[int] = 2000,
+            max_workers: int = const.API_PAGE_MAX_WORKERS) -> List[OrderListData]:
 
         url = "https://circus.shopping.yahooapis.jp/ShoppingWebService/V1/orderList" \
             if const.IS_PRODUCTION else 'https://test.circus.shopping.yahooapis.jp/ShoppingWebService/V1/orderList'
 
         headers = {
             'HTTP-Version': 'http_version',
-            'Authorization': f'Bearer {self.auth.access_token}',
+            'Authorization': f'Bearer {self.auth.get_access_token()}',
             'Host': 'circus.shopping.yahooapis.jp' if const.IS_PRODUCTION else 'test.circus.shopping.yahooapis.jp',
         }
-        data = f"""
-           <Req>
-               <Search>
-                   <Result>{result_count}</Result>
-                   <Start></Start>
-                   <Sort>+order_time</Sort>
-                   <Condition>
-                       <OrderTimeFrom>{order_time_from.strftime('%Y%m%d%H%M%S')}</OrderTimeFrom>
-                       <OrderTimeTo>{order_time_to.strftime('%Y%m%d%H%M%S')}</OrderTimeTo>
-                   </Condition>
-                   <Field>OrderId,OrderTime,IsYahooAuctionOrder</Field>
-               </Search>
-               <SellerId>{YahooAPI.seller_id}</SellerId>
-           </Req>
-           """
-        root_post = ET.fromstring(data)
-        root_post.set('version', '1.0')
-        root_post.set('encoding', 'UTF-8')
-
-        item_count = 1
-        total_count = 1
-        order_list = []
-        while item_count <= total_count:
-            # リクエスト
-            post_data = ET.tostring(element=root_post, encoding="utf-8", method='xml')
-            try:
-                res = self.api.request_post(url=url, headers=headers, data=post_data)
-                if res.status_code != 200:
-                    if res.status_code == 401:
-                        www_auth = res.headers.get('WWW-Authenticate', '')
-                        re_ = re.search(r'error="(?P<error_msg>[a-zA-Z_]+)"', www_auth)
-                        if re_:
-                            error_msg = re_.group('error_msg')
-                            if error_msg in ['invalid_token']:
-                                self.log.debug('Token refresh in OrderListAPI.get')
-                                self.auth.update_token()
-                                raise YahooShoppingApiError('Failed to post request due to invalid token')
-
-                    root_res = ET.fromstring(res.text)
-                    error_code = root_res.find('.//Code').text if root_res.findall('.//Code') else ''
-                    error_msg = root_res.find('.//Message').text if root_res.findall('.//Message') else ''
-                    if error_code == 'px-04102':
-                        self.log.debug('Re auth in OrderListAPI.get')
-                        self.auth.re_auth()
-                    raise YahooShoppingApiError(
-                        f'Failed to post request due to AccessToken has been expired code={error_code}, message={error_msg}')
-            except Exception:
-                self.log.exception('Failed to post request get order list')
-                raise YahooShoppingApiError('Failed to post request to get order list')
-
-            root_response = ET.fromstring(res.text)
-            for el_order_info in root_response.findall('.//OrderInfo'):
-                # OrderId取得
-                order_id = el_order_info.find('.//OrderId').text
+        # 1ページ目で総数を取得し、残りのページは並列で取得する(結果はページ順)
+        results = iter_pages(fetch_page=lambda page: self._get_page(url=url,
+                                                                    headers=headers,
+                                                                    order_time_from=order_time_from,
+                                                                    order_time_to=order_time_to,
+                                                                    result_count=result_count,
+                                                                    page=page),
+                             get_total_pages=lambda result: get_order_list_total_pages(result, result_count),
+                             max_workers=max_workers)
 
-                order_data = OrderListData(order_id=order_id)
-                order_list.append(order_data)
-
-            # 総数更新
-            total_1 = root_response.find('.//TotalCount').text
-            if total_1:
-                total_count = int(total_1)
-
-            # 開始位置をxmlに反映
-            item_count += result_count
-            root_post.find('.//Start').text = str(item_count)
+        order_list = []
+        for result in results:
+            order_list.extend(result.orders)
 
         return order_list
 
@@ -501,32 +816,19 @@ class OrderInfoAPI:
         self.auth = auth
         self.log = log
 
-    @retry(tries=3, delay=2, backoff=2, jitter=1)
+    @retry(YahooTokenExpiredError, tries=2)
     def get(self, order_id: str) -> List[OrderInfoData]:
         if not order_id:
             return []
 
-        data = f"""
-            <Req>
-                <Target>
-                    <OrderId>{order_id}</OrderId>
-                    <Field>OrderId,OrderStatus,ItemId,Title</Field>
-                </Target>
-                <SellerId>{YahooAPI.seller_id}</SellerId>
-            </Req>
-            """
-        root_post = ET.fromstring(data)
-        root_post.set('version', '1.0')
-        root_post.set('encoding', 'UTF-8')
-
         url = "https://circus.shopping.yahooapis.jp/ShoppingWebService/V1/orderInfo" \
             if const.IS_PRODUCTION else 'https://test.circus.shopping.yahooapis.jp/ShoppingWebService/V1/orderInfo'
         headers = {
             'HTTP-Version': 'http_version',
-            'Authorization': f'Bearer {self.auth.access_token}',
+            'Authorization': f'Bearer {self.auth.get_access_token()}',
             'Host': 'circus.shopping.yahooapis.jp' if const.IS_PRODUCTION else 'test.circus.shopping.yahooapis.jp'
         }
-        post_data = ET.tostring(element=root_post, encoding="utf-8", method='xml')
+        post_data = build_order_info_request(order_id=order_id)
         try:
             res = self.api.request_post(url=url, headers=headers, data=post_data)
             if res.status_code != 200:
@@ -537,38 +839,38 @@ class OrderInfoAPI:
                         error_msg = re_.group('error_msg')
                         if error_msg in ['invalid_token']:
                             self.log.debug('Token refresh in OrderInfoAPI.get')
-                            self.auth.update_token()
-                            raise YahooShoppingApiError('Failed to post request due to invalid token')
+                            self.auth.update_token(failed_token=get_bearer_token(headers))
+                            raise YahooTokenExpiredError('Failed to post request due to invalid token')
 
-                root_res = ET.fromstring(res.text)
-                error_code = root_res.find('.//Code').text if root_res.findall('.//Code') else ''
-                error_msg = root_res.find('.//Message').text if root_res.findall('.//Message') else ''
+                error_code, error_msg = parse_error(res.content)
                 if error_code == 'px-04102':
                     self.log.debug('Re auth in OrderInfoAPI.get')
                     self.auth.re_auth()
+                    raise YahooTokenExpiredError(
+                        f'Failed to post request due to AccessToken has been expired code={error_code}, message={error_msg}')
                 raise YahooShoppingApiError(
-                    f'Failed to post request due to AccessToken has been expired code={error_code}, message={error_msg}')
+                    f'Failed to post request code={error_code}, message={error_msg}')
+        except YahooTokenExpiredError:
+            raise
         except Exception:
             self.log.exception('Failed to post request get order info list')
             raise YahooShoppingApiError('Failed to post request to get order info list')
 
-        root_response = ET.fromstring(res.text)
-        order_info_list = []
-        for el_order_info in root_response.findall('.//OrderInfo'):
-            order_id_ = el_order_info.find('.//OrderId').text
-            order_status = int(el_order_info.find('.//OrderStatus').text)
-            order_items = []
-            for el_item in el_order_info.findall('.//Item'):
-                item_id = el_item.find('.//ItemId').text
-                title = el_item.find('.//Title').text
-                order_item_data = OrderInfoItemData(item_id=item_id,
-                                                    title=title)
-                order_items.append(order_item_data)
-
-            order_inf_data = OrderInfoData(order_id=order_id_,
-                                           order_status=order_status,
-                                           items=order_items)
-            order_info_list.append(order_inf_data)
+        return list(parse_order_info(res.content))
+
+    def get_bulk(self,
+                 order_ids: List[str],
+                 max_workers: int = const.YSHOP_ORDER_INFO_MAX_WORKERS) -> List[OrderInfoData]:
+        if not order_ids:
+            return []
+
+        # 並列取得(流量制限はAPIRequestsで待機)。結果はorder_idsの順序で返す
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = executor.map(lambda order_id: self.get(order_id=order_id), order_ids)
+
+            order_info_list = []
+            for order_info_list_1 in results:
+                order_info_list.extend(order_info_list_1)
 
         return order_info_list
 
@@ -597,7 +899,7 @@ class StockAPI:
         self.auth = auth
         self.log = log
 
-    @retry(tries=3, delay=2, backoff=2, jitter=1)
+    @retry(YahooTokenExpiredError, tries=2)
     def get(self, item_codes: List[str], chunk_size: int = 1000) -> List[GetStockData]:
         if not item_codes:
             return []
@@ -607,12 +909,12 @@ class StockAPI:
 
         headers = {
             'HTTP-Version': 'http_version',
-            'Authorization': f'Bearer {self.auth.access_token}',
+            'Authorization': f'Bearer {self.auth.get_access_token()}',
             'Host': 'circus.shopping.yahooapis.jp' if const.IS_PRODUCTION else 'test.circus.shopping.yahooapis.jp'
         }
 
         # 重複を作雄j
-        item_codes = list(set(item_codes))
+        item_codes = list(dict.fromkeys(item_codes))
         # リストを分割
         item_codes_n = [item_codes[i:i + chunk_size] for i in range(0, len(item_codes), chunk_size)]
         stock_list = []
@@ -632,39 +934,23 @@ class StockAPI:
                             error_msg = re_.group('error_msg')
                             if error_msg in ['invalid_token']:
                                 self.log.debug('Token refresh in StockAPI.get')
-                                self.auth.update_token()
-                                raise YahooShoppingApiError('Failed to post request due to invalid token')
+                                self.auth.update_token(failed_token=get_bearer_token(headers))
+                                raise YahooTokenExpiredError('Failed to post request due to invalid token')
 
-                    root_res = ET.fromstring(res.text)
-                    error_code = root_res.find('.//Code').text if root_res.findall('.//Code') else ''
-                    error_msg = root_res.find('.//Message').text if root_res.findall('.//Message') else ''
+                    error_code, error_msg = parse_error(res.content)
                     raise YahooShoppingApiError(
                         f'Failed to post request code={error_code}, message={error_msg}')
+            except YahooTokenExpiredError:
+                raise
             except Exception:
                 self.log.exception('Failed to post request to get stock')
                 raise YahooAuthError('Failed to post request to get stock')
 
-            root_response = ET.fromstring(res.text)
-
-            for el_item in root_response.findall('.//Result'):
-                item_code = el_item.find('.//ItemCode').text
-                status = el_item.find('.//Status').text
-                if status == '1':
-                    quantity = el_item.find('.//Quantity').text
-                    if quantity == '':
-                        # 在庫無限大は、-1にする
-                        quantity = -1
-                    else:
-                        quantity = int(quantity)
-
-                    stock_data = GetStockData(item_code=item_code,
-                                              status=int(status),
-                                              quantity=quantity)
-                    stock_list.append(stock_data)
+            stock_list.extend(parse_get_stock(res.content))
 
         return stock_list
 
-    @retry(tries=3, delay=2, backoff=2, jitter=1)
+    @retry(YahooTokenExpiredError, tries=2)
     def set(self, set_stock_list: List[SetStockData]) -> List[SetStockResponseData]:
         if not set_stock_list:
             return []
@@ -685,7 +971,7 @@ class StockAPI:
 
         headers = {
             'HTTP-Version': 'http_version',
-            'Authorization': f'Bearer {self.auth.access_token}',
+            'Authorization': f'Bearer {self.auth.get_access_token()}',
             'Host': 'circus.shopping.yahooapis.jp' if const.IS_PRODUCTION else 'test.circus.shopping.yahooapis.jp'
         }
 
@@ -699,35 +985,19 @@ class StockAPI:
                         error_msg = re_.group('error_msg')
                         if error_msg in ['invalid_token']:
                             self.log.debug('Token update in StockAPI.set')
-                            self.auth.update_token()
-                            raise YahooShoppingApiError('Failed to post request due to invalid token')
+                            self.auth.update_token(failed_token=get_bearer_token(headers))
+                            raise YahooTokenExpiredError('Failed to post request due to invalid token')
 
-                root_res = ET.fromstring(res.text)
-                error_code = root_res.find('.//Code').text if root_res.findall('.//Code') else ''
-                error_msg = root_res.find('.//Message').text if root_res.findall('.//Message') else ''
+                error_code, error_msg = parse_error(res.content)
                 raise YahooShoppingApiError(
                     f'Failed to post request code={error_code}, message={error_msg}')
+        except YahooTokenExpiredError:
+            raise
         except Exception:
             self.log.exception('Failed to post request to set stock')
             raise YahooAuthError('Failed to post request to set stock')
 
-        root_response = ET.fromstring(res.text)
-        stock_list = []
-        for el_item in root_response.findall('.//Result'):
-            item_code = el_item.find('.//ItemCode').text
-            quantity = el_item.find('.//Quantity').text
-            if quantity is not None:
-                if quantity == '':
-                    # 空白は在庫無限大。-1にする
-                    quantity = -1
-                else:
-                    quantity = int(quantity)
-
-                stock_data = SetStockResponseData(item_code=item_code,
-                                                  quantity=quantity)
-                stock_list.append(stock_data)
-
-        return stock_list
+        return list(parse_set_stock(res.content))
 
 
 class ShoppingAPI:
@@ -757,6 +1027,8 @@ class YahooAPI:
                  connect_timeout: float = 30.0,
                  read_timeout: float = 60.0,
                  cert: Optional[Tuple[str, str]] = None,
+                 auto_refresh_token: bool = False,
+                 reauth_mode: str = const.YJDN_REAUTH_MODE,
                  ):
         self.profile_dir = profile_dir
         self.log = log
@@ -764,7 +1036,10 @@ class YahooAPI:
                                backoff_factor=backoff_factor,
                                connect_timeout=connect_timeout,
                                read_timeout=read_timeout,
-                               cert=cert)
+                               cert=cert,
+                               rate_limiter=ratelimit.get_rate_limiter('yshop'),
+                               circuit_breaker=circuit.get_circuit_breaker('yshop'),
+                               **const.HTTP_POOL_SETTING['yshop'])
         # yahooID連携
         self.auth = YahooAuth(api=self.api,
                               profile_dir=self.profile_dir,
@@ -775,7 +1050,10 @@ class YahooAPI:
                               business_id=business_id,
                               business_password=business_password,
                               yahoo_id=yahoo_id,
-                              yahoo_password=yahoo_password)
+                              yahoo_password=yahoo_password,
+                              reauth_mode=reauth_mode)
+        if auto_refresh_token:
+            self.auth.start_auto_refresh()
         # ショッピングAPI
         self.shopping = ShoppingAPI(api=self.api, auth=self.auth, log=self.log)
 
@@ -786,4 +1064,234 @@ class YahooAPI:
         self.close()
 
     def close(self):
+        self.auth.stop_auto_refresh()
+        self.api.close()
+
+    def reset(self):
+        # 接続を破棄し、次のリクエストで再接続する。認証情報は他プロセスの更新を反映する
+        self.api.reset()
+        self.auth.reload()
+
+
+class AsyncShoppingRequest:
+    # ショッピングAPIへの非同期リクエスト(トークン取得・更新・再認証は同期版をスレッドで実行する)
+    def __init__(self,
+                 api: AsyncAPIRequests,
+                 auth: YahooAuth,
+                 log: Logger):
+        self.api = api
+        self.auth = auth
+        self.log = log
+
+    @staticmethod
+    def get_url(name: str) -> str:
+        if const.IS_PRODUCTION:
+            return f'https://circus.shopping.yahooapis.jp/ShoppingWebService/V1/{name}'
+        return f'https://test.circus.shopping.yahooapis.jp/ShoppingWebService/V1/{name}'
+
+    async def post(self, name: str, data, re_auth: bool = False) -> Response:
+        access_token = await self.api.run(self.auth.get_access_token)
+        headers = {
+            'HTTP-Version': 'http_version',
+            'Authorization': f'Bearer {access_token}',
+            'Host': 'circus.shopping.yahooapis.jp' if const.IS_PRODUCTION else 'test.circus.shopping.yahooapis.jp'
+        }
+        try:
+            res = await self.api.request_post(url=self.get_url(name), headers=headers, data=data)
+            if res.status_code != 200:
+                if res.status_code == 401:
+                    www_auth = res.headers.get('WWW-Authenticate', '')
+                    re_ = re.search(r'error="(?P<error_msg>[a-zA-Z_]+)"', www_auth)
+                    if re_:
+                        error_msg = re_.group('error_msg')
+                        if error_msg in ['invalid_token']:
+                            self.log.debug('Token refresh in %s', name)
+                            await self.api.run(self.auth.update_token, failed_token=access_token)
+                            raise YahooTokenExpiredError('Failed to post request due to invalid token')
+
+                error_code, error_msg = parse_error(res.content)
+                if re_auth and error_code == 'px-04102':
+                    self.log.debug('Re auth in %s', name)
+                    await self.api.run(self.auth.re_auth)
+                    raise YahooTokenExpiredError(
+                        f'Failed to post request due to AccessToken has been expired code={error_code}, message={error_msg}')
+                raise YahooShoppingApiError(
+                    f'Failed to post request code={error_code}, message={error_msg}')
+        except YahooTokenExpiredError:
+            raise
+        except Exception:
+            self.log.exception('Failed to post request to %s', name)
+            raise YahooShoppingApiError(f'Failed to post request to {name}')
+
+        return res
+
+
+class AsyncOrderListAPI:
+    def __init__(self, request: AsyncShoppingRequest):
+        self.request = request
+
+    async def _get_page(self,
+                        order_time_from: datetime,
+                        order_time_to: datetime,
+                        result_count: int,
+                        page: int) -> OrderListResult:
+        start = 1 + (page - 1) * result_count
+        post_data = build_order_list_request(order_time_from=order_time_from,
+                                             order_time_to=order_time_to,
+                                             result_count=result_count,
+                                             start=start if start > 1 else None)
+        res = await retry_async(lambda: self.request.post('orderList', data=post_data, re_auth=True),
+                                exceptions=YahooTokenExpiredError, tries=2, delay=0)
+        return parse_order_list(res.content)
+
+    async def get(self,
+                  order_time_from: datetime,
+                  order_time_to: datetime,
+                  result_count: Optional[int] = 2000) -> List[OrderListData]:
+        # 1ページ目で総数を取得し、残りのページは同時に取得する(結果はページ順)
+        results = await gather_pages(fetch_page=lambda page: self._get_page(order_time_from=order_time_from,
+                                                                            order_time_to=order_time_to,
+                                                                            result_count=result_count,
+                                                                            page=page),
+                                     get_total_pages=lambda result: get_order_list_total_pages(result, result_count))
+
+        order_list = []
+        for result in results:
+            order_list.extend(result.orders)
+        return order_list
+
+
+class AsyncOrderInfoAPI:
+    def __init__(self, request: AsyncShoppingRequest):
+        self.request = request
+
+    async def get(self, order_id: str) -> List[OrderInfoData]:
+        if not order_id:
+            return []
+
+        post_data = build_order_info_request(order_id=order_id)
+        res = await retry_async(lambda: self.request.post('orderInfo', data=post_data, re_auth=True),
+                                exceptions=YahooTokenExpiredError, tries=2, delay=0)
+        return list(parse_order_info(res.content))
+
+    async def get_bulk(self, order_ids: List[str]) -> List[OrderInfoData]:
+        # 同時実行数はAsyncAPIRequestsで制限する。結果はorder_idsの順序で返す
+        results = await asyncio.gather(*(self.get(order_id=order_id) for order_id in order_ids))
+        return [order_info for order_info_list_1 in results for order_info in order_info_list_1]
+
+
+class AsyncOrderAPI:
+    def __init__(self, request: AsyncShoppingRequest):
+        # 注文検索API
+        self.list = AsyncOrderListAPI(request=request)
+        # 注文詳細API
+        self.info = AsyncOrderInfoAPI(request=request)
+
+
+class AsyncStockAPI:
+    def __init__(self, request: AsyncShoppingRequest):
+        self.request = request
+
+    async def _get_chunk(self, item_codes: List[str]) -> List[GetStockData]:
+        post_data = {
+            'seller_id': YahooAPI.seller_id,
+            'item_code': ','.join(item_codes)
+        }
+        res = await retry_async(lambda: self.request.post('getStock', data=post_data),
+                                exceptions=YahooTokenExpiredError, tries=2, delay=0)
+        return list(parse_get_stock(res.content))
+
+    async def get(self, item_codes: List[str], chunk_size: int = 1000) -> List[GetStockData]:
+        if not item_codes:
+            return []
+
+        # 重複を削除
+        item_codes = list(dict.fromkeys(item_codes))
+        # リストを分割
+        item_codes_n = [item_codes[i:i + chunk_size] for i in range(0, len(item_codes), chunk_size)]
+        results = await asyncio.gather(*(self._get_chunk(item_codes_1) for item_codes_1 in item_codes_n))
+        return [stock for stock_list_1 in results for stock in stock_list_1]
+
+    async def set(self, set_stock_list: List[SetStockData]) -> List[SetStockResponseData]:
+        if not set_stock_list:
+            return []
+
+        post_data = {
+            'seller_id': YahooAPI.seller_id,
+            'item_code': ','.join(set_stock_data.item_code for set_stock_data in set_stock_list),
+            'quantity': ','.join(str(set_stock_data.quantity) for set_stock_data in set_stock_list),
+        }
+        res = await retry_async(lambda: self.request.post('setStock', data=post_data),
+                                exceptions=YahooTokenExpiredError, tries=2, delay=0)
+        return list(parse_set_stock(res.content))
+
+
+class AsyncShoppingAPI:
+    def __init__(self, request: AsyncShoppingRequest):
+        self.order = AsyncOrderAPI(request=request)
+        self.stock = AsyncStockAPI(request=request)
+
+
+class AsyncYahooAPI:
+    # YahooAPIの非同期版(結果のデータは同期版と同じ)
+    def __init__(self,
+                 profile_dir: str,
+                 application_id: str,
+                 secret: str,
+                 auth_file: str,
+                 business_id: str,
+                 business_password: str,
+                 yahoo_id: str,
+                 yahoo_password: str,
+                 log: Logger,
+                 retry_total: int = 5,
+                 backoff_factor: int = 2,
+                 connect_timeout: float = 30.0,
+                 read_timeout: float = 60.0,
+                 cert: Optional[Tuple[str, str]] = None,
+                 auto_refresh_token: bool = False,
+                 reauth_mode: str = const.YJDN_REAUTH_MODE,
+                 max_concurrency: int = const.ASYNC_API_MAX_CONCURRENCY,
+                 ):
+        self.profile_dir = profile_dir
+        self.log = log
+        self.api = AsyncAPIRequests(retry_total=retry_total,
+                                    backoff_factor=backoff_factor,
+                                    connect_timeout=connect_timeout,
+                                    read_timeout=read_timeout,
+                                    cert=cert,
+                                    rate_limiter=ratelimit.get_rate_limiter('yshop'),
+                                    circuit_breaker=circuit.get_circuit_breaker('yshop'),
+                                    max_concurrency=max_concurrency,
+                                    **const.HTTP_POOL_SETTING['yshop'])
+        # yahooID連携(トークンの取得・更新は同期版を使う)
+        self.auth = YahooAuth(api=self.api.api,
+                              profile_dir=self.profile_dir,
+                              application_id=application_id,
+                              secret=secret,
+                              auth_file=auth_file,
+                              log=self.log,
+                              business_id=business_id,
+                              business_password=business_password,
+                              yahoo_id=yahoo_id,
+                              yahoo_password=yahoo_password,
+                              reauth_mode=reauth_mode)
+        if auto_refresh_token:
+            self.auth.start_auto_refresh()
+        # ショッピングAPI
+        self.shopping = AsyncShoppingAPI(request=AsyncShoppingRequest(api=self.api, auth=self.auth, log=self.log))
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self.auth.stop_auto_refresh()
         self.api.close()
+
+    def reset(self):
+        # 接続を破棄し、次のリクエストで再接続する。認証情報は他プロセスの更新を反映する
+        self.api.reset()
+        self.auth.reload()
@@ -2,8 +2,10 @@
 # argment
 Param(
     [parameter(mandatory=$true)][ValidateSet("yshop", "rakuten", "au")][String]$ArgMall,
-    [parameter(mandatory=$true)][ValidateSet("producer", "consumer")][String]$ArgTaskType,
-    [parameter(mandatory=$true)][Int]$ArgTaskNo
+    [parameter(mandatory=$true)][ValidateSet("producer", "consumer", "auth")][String]$ArgTaskType,
+    [parameter(mandatory=$true)][Int]$ArgTaskNo,
+    # プロデューサーを常駐させる(停止するまで定期実行)
+    [switch]$Daemon
 )
 Write-Host $ArgMall
 Write-Host $ArgTaskType
@@ -25,7 +27,11 @@ cd $PyDir
 
 # python実行
 $execFile = "stockout_${ArgMall}_${ArgTaskType}.py"
-python $execFile --task_no $ArgTaskNo
+$execArgs = @("--task_no", $ArgTaskNo)
+if ($Daemon) {
+    $execArgs += "--daemon"
+}
+python $execFile @execArgs
 
 deactivate
 cd $CurrentDir
\ No newline at end of file